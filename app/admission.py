@@ -0,0 +1,245 @@
+"""Admission control for job submission.
+
+Two limits protect Redis from unbounded work:
+
+- Queue depth: entries of the job's queue (see app.queues) not yet
+  delivered to or not yet acknowledged by the worker group. Above
+  ``admission_max_queue_depth`` submissions to that queue are rejected with a
+  Retry-After derived from the queue's drain rate, or, in ``defer`` mode,
+  stored without being enqueued and released by the maintenance service once
+  the queue has drained. Each queue is limited on its own, so a slow task
+  type does not hold up submissions of the others.
+- Partition quotas: at most ``admission_partition_quota`` admitted
+  submissions per partition key per ``admission_partition_window_seconds``.
+"""
+
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.events import EventType, job_event_records
+from app.job_schema import read_jobs
+from app.models import JobStatus
+from app.queues import DEFAULT_QUEUE, QUEUES_KEY, all_queue_stats, list_queues, queue_for_task_type, queue_stats, queue_stream
+from app.redis_client import get_redis
+from app.sharding import get_shard, get_shards, shard_count
+from app.state_machine import release_deferred
+
+
+# Sorted sets of deferred job IDs by submission time, one per queue on each
+# shard; jobs deferred before queues were limited one by one are in the set
+# itself (DEFERRED_KEY)
+DEFERRED_KEY = "admission:deferred"
+
+# Lua script counting a submission against a fixed-window quota, without
+# counting rejected submissions
+PARTITION_QUOTA_SCRIPT = """
+local count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if count >= tonumber(ARGV[1]) then
+    return -1
+end
+count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return count
+"""
+
+
+@dataclass
+class AdmissionDecision:
+    """Outcome of an admission check."""
+
+    admitted: bool
+    deferred: bool = False
+    reason: Optional[str] = None
+    retry_after_seconds: Optional[int] = None
+
+
+@dataclass
+class _QueueSample:
+    taken_at: float
+    depth: int
+    delivered_total: int
+    drain_rate: Optional[float]  # Entries delivered to workers per second
+
+
+_samples: Dict[str, _QueueSample] = {}  # Queue name -> last sample
+
+
+def deferred_key(queue: str) -> str:
+    """Sorted set of the jobs deferred for a queue."""
+    return f"{DEFERRED_KEY}:{queue}"
+
+
+async def get_queue_depth(queue: Optional[str] = None) -> int:
+    """
+    Number of entries of a job queue (or of all queues) the worker group has
+    not finished with.
+
+    Args:
+        queue: Queue name; None for all queues
+
+    Returns:
+        Undelivered (lag) plus delivered but unacknowledged (pending) entries
+    """
+    if queue is not None:
+        stats = await queue_stats(queue_stream(queue))
+        return stats["lag"] + stats["pending"]
+    depth = 0
+    for stats in (await all_queue_stats()).values():
+        depth += stats["lag"] + stats["pending"]
+    return depth
+
+
+async def _queue_sample(queue: str) -> _QueueSample:
+    """Depth and drain rate of a queue, refreshed at most every admission_check_interval_ms."""
+    now = time.monotonic()
+    sample = _samples.get(queue)
+    if sample is not None and now - sample.taken_at < settings.admission_check_interval_ms / 1000:
+        return sample
+
+    stats = await queue_stats(queue_stream(queue))
+    depth = stats["lag"] + stats["pending"]
+    drain_rate = sample.drain_rate if sample is not None else None
+    if sample is not None and now > sample.taken_at:
+        rate = max(0, stats["delivered"] - sample.delivered_total) / (now - sample.taken_at)
+        # Smooth the rate so Retry-After does not jump with every sample
+        drain_rate = rate if drain_rate is None else 0.7 * drain_rate + 0.3 * rate
+
+    _samples[queue] = _QueueSample(
+        taken_at=now, depth=depth, delivered_total=stats["delivered"], drain_rate=drain_rate
+    )
+    return _samples[queue]
+
+
+def _retry_after(excess: int, drain_rate: Optional[float]) -> int:
+    if not drain_rate or drain_rate <= 0:
+        return settings.admission_max_retry_after_seconds
+    return max(1, min(math.ceil(excess / drain_rate), settings.admission_max_retry_after_seconds))
+
+
+async def check_admission(
+    partition_key: Optional[str],
+    task_type: Optional[str] = None,
+    *,
+    allow_defer: bool = True,
+) -> AdmissionDecision:
+    """
+    Decide whether a job submission is admitted.
+
+    The queue depth is checked first, so rejected submissions do not count
+    against the partition quota.
+
+    Args:
+        partition_key: Partition key of the job
+        task_type: Task type of the job, selecting the queue whose depth is checked
+        allow_defer: Whether the job may be deferred instead of rejected
+
+    Returns:
+        The admission decision
+    """
+    deferred = False
+    if settings.admission_max_queue_depth is not None:
+        sample = await _queue_sample(queue_for_task_type(task_type))
+        if sample.depth >= settings.admission_max_queue_depth:
+            if not (allow_defer and settings.admission_mode == "defer"):
+                excess = sample.depth - settings.admission_max_queue_depth + 1
+                return AdmissionDecision(
+                    admitted=False,
+                    reason="Job queue is full",
+                    retry_after_seconds=_retry_after(excess, sample.drain_rate),
+                )
+            deferred = True
+
+    if partition_key and settings.admission_partition_quota is not None:
+        window = settings.admission_partition_window_seconds
+        window_start = int(time.time()) // window * window
+        redis = get_redis()
+        count = await redis.eval(
+            PARTITION_QUOTA_SCRIPT,
+            1,
+            f"admission:partition:{partition_key}:{window_start}",
+            settings.admission_partition_quota,
+            window,
+        )
+        if count == -1:
+            return AdmissionDecision(
+                admitted=False,
+                reason=f"Submission quota of partition {partition_key} exceeded",
+                retry_after_seconds=max(1, window_start + window - int(time.time())),
+            )
+
+    if deferred:
+        return AdmissionDecision(admitted=True, deferred=True, reason="Job queue is full")
+    return AdmissionDecision(admitted=True)
+
+
+def defer_job(pipe: Any, job_id: str, task_type: Optional[str]) -> None:
+    """
+    Queue the command recording a created job that is to be enqueued once its
+    queue has room, on a pipeline of the job's shard (with the job's hash,
+    which must have ``deferred`` set).
+    """
+    queue = queue_for_task_type(task_type)
+    pipe.zadd(deferred_key(queue), {job_id: datetime.now(timezone.utc).timestamp()})
+    if queue != DEFAULT_QUEUE:
+        pipe.sadd(QUEUES_KEY, queue)  # Listed, so its deferred set is released
+
+
+async def count_deferred_jobs() -> int:
+    """Number of deferred jobs, over all queues and shards."""
+    keys = [DEFERRED_KEY] + [deferred_key(queue) for queue in await list_queues()]
+    counts = await asyncio.gather(*(shard.zcard(key) for shard in get_shards() for key in keys))
+    return sum(counts)
+
+
+async def release_deferred_jobs() -> int:
+    """
+    Enqueue deferred jobs, oldest first, as far as each queue's depth limit allows.
+
+    Each shard defers and releases its own jobs.
+
+    Returns:
+        Number of jobs enqueued
+    """
+    rooms: Dict[str, Optional[int]] = {}
+    for queue in await list_queues():
+        if settings.admission_max_queue_depth is None:
+            rooms[queue] = None
+        else:
+            rooms[queue] = settings.admission_max_queue_depth - await get_queue_depth(queue)
+
+    released = 0
+    for shard in range(shard_count()):
+        for key in [deferred_key(queue) for queue in rooms] + [DEFERRED_KEY]:
+            released += await _release_shard(shard, key, rooms)
+    return released
+
+
+async def _release_shard(shard: int, key: str, rooms: Dict[str, Optional[int]]) -> int:
+    """Release the oldest jobs of a deferred set on a shard whose queues have room (rooms are updated)."""
+    entries = await get_shard(shard).zrange(key, 0, settings.admission_release_batch_size - 1)
+    if not entries:
+        return 0
+
+    jobs = []
+    for job_id, job in zip(entries, await read_jobs(entries, ["task_type"])):
+        task_type = (job or {}).get("task_type")
+        queue = queue_for_task_type(task_type)
+        if queue not in rooms and settings.admission_max_queue_depth is not None:
+            rooms[queue] = settings.admission_max_queue_depth - await get_queue_depth(queue)
+        room = rooms.get(queue)
+        if room is not None and room <= 0:
+            continue  # Stays deferred until its queue has room
+        if room is not None:
+            rooms[queue] = room - 1
+        events = job_event_records([(job_id, EventType.ENQUEUED, JobStatus.PENDING, {"deferred": True})], task_type=task_type)
+        jobs.append((job_id, task_type, events))
+    if not jobs:
+        return 0
+    return sum(await release_deferred(key, jobs))
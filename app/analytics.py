@@ -0,0 +1,494 @@
+"""Historical job analytics over hourly rollups and the job archive.
+
+Workers maintain one rollup hash per hour (``analytics:YYYYMMDDHH``) with
+counters of attempt outcomes and the runtime sum per task type and partition
+key, and per task type only a log-scale runtime histogram and the
+distribution of attempts needed by finished jobs (so the size of a rollup
+does not grow with histogram buckets times partition keys). Queries over
+rollups are cheap for any range and approximate runtime quantiles by
+histogram bucket, except when grouped or filtered by partition key; queries
+over the archive read raw archived jobs and compute exact quantiles.
+
+Workers buffer attempts in memory and add them to the rollups in the
+background, so recording an attempt costs no Redis round trip. Aggregation is
+done column-wise with NumPy rather than per record.
+"""
+
+import asyncio
+import bisect
+import math
+import os
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.archive import list_partitions, partition_file
+from app.config import settings
+from app.redis_client import get_redis
+
+
+GROUP_BY_FIELDS = ("task_type", "partition_key", "hour")
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Upper bounds (seconds) of the runtime histogram buckets, ~19% apart from
+# 1 ms to about 4 hours; the last bucket also holds everything slower
+RUNTIME_BUCKETS: List[float] = [0.001 * 2 ** (i / 4) for i in range(96)]
+
+# Separates task type, partition key and metric in rollup hash fields; the
+# parts are percent-escaped so they may contain it
+_SEP = "|"
+
+# Partition key part of fields counted per task type only (escaping never produces it)
+_ANY_PARTITION = "%*"
+
+
+def _escape(part: str) -> str:
+    return part.replace("%", "%25").replace(_SEP, "%7C")
+
+
+def _unescape(part: str) -> str:
+    return part.replace("%7C", _SEP).replace("%25", "%")
+
+
+def _utc(moment: datetime) -> datetime:
+    """A datetime in UTC; naive datetimes are taken to be UTC already."""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def _rollup_key(hour: datetime) -> str:
+    return f"analytics:{hour.strftime('%Y%m%d%H')}"
+
+
+def _hour_label(hour: datetime) -> str:
+    return hour.strftime("%Y-%m-%dT%H")
+
+
+def runtime_bucket(runtime_seconds: float) -> int:
+    """Index of the histogram bucket holding a runtime."""
+    return min(bisect.bisect_left(RUNTIME_BUCKETS, runtime_seconds), len(RUNTIME_BUCKETS) - 1)
+
+
+class AttemptRollups:
+    """Attempt counters added up per hour, flushed to the rollups in the background."""
+
+    def __init__(self) -> None:
+        # (rollup key, field) -> increment not yet flushed
+        self._counts: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def record(
+        self,
+        task_type: str,
+        partition_key: str,
+        outcome: str,
+        runtime_seconds: float,
+        *,
+        attempts: Optional[int] = None,
+        dead_lettered: bool = False,
+    ) -> None:
+        """Add an attempt to the current hour (see record_attempt)."""
+        key = _rollup_key(datetime.now(timezone.utc))
+        prefix = f"{_escape(task_type)}{_SEP}{_escape(partition_key)}{_SEP}"
+        task_prefix = f"{_escape(task_type)}{_SEP}{_ANY_PARTITION}{_SEP}"
+        self._counts[(key, prefix + outcome)] += 1
+        self._counts[(key, prefix + "runtime_sum")] += runtime_seconds
+        if dead_lettered:
+            self._counts[(key, prefix + "dead_lettered")] += 1
+        self._counts[(key, f"{task_prefix}rt:{runtime_bucket(runtime_seconds)}")] += 1
+        if attempts is not None:
+            self._counts[(key, f"{task_prefix}att:{attempts}")] += 1
+
+    async def flush(self) -> None:
+        """Add the attempts recorded since the last flush to Redis.
+
+        The counts are added in one transaction; if it fails they are kept
+        for the next flush.
+        """
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, defaultdict(float)
+        pipe = get_redis().pipeline(transaction=True)
+        keys = set()
+        for (key, field), value in counts.items():
+            if field.endswith(_SEP + "runtime_sum"):
+                pipe.hincrbyfloat(key, field, value)
+            else:
+                pipe.hincrby(key, field, int(value))
+            keys.add(key)
+        for key in keys:
+            pipe.expire(key, settings.analytics_retention_days * 86400, nx=True)
+        try:
+            await pipe.execute()
+        except Exception:
+            for item, value in counts.items():
+                self._counts[item] += value
+            raise
+
+    def start(self) -> None:
+        """Start flushing every analytics_flush_seconds (must be called from a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop flushing, after a final flush."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing attempt rollups: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.analytics_flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing attempt rollups: {e}")
+
+
+attempt_rollups = AttemptRollups()
+
+
+async def record_attempt(
+    task_type: str,
+    partition_key: str,
+    outcome: str,
+    runtime_seconds: float,
+    *,
+    attempts: Optional[int] = None,
+    dead_lettered: bool = False,
+) -> None:
+    """
+    Add one execution attempt to the current hour's rollup.
+
+    The attempt is buffered while attempt_rollups is running and written at
+    once otherwise.
+
+    Args:
+        task_type: Task type of the job
+        partition_key: Partition key of the job ("" if none)
+        outcome: "succeeded" or "failed"
+        runtime_seconds: Handler runtime of the attempt
+        attempts: Attempts the job needed, if this attempt finished the job
+        dead_lettered: Whether the job was dead-lettered after this attempt
+    """
+    attempt_rollups.record(
+        task_type, partition_key, outcome, runtime_seconds, attempts=attempts, dead_lettered=dead_lettered
+    )
+    if not attempt_rollups.running:
+        await attempt_rollups.flush()
+
+
+def _hours(start: datetime, end: datetime) -> List[datetime]:
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while hour < end:
+        hours.append(hour)
+        hour += timedelta(hours=1)
+    return hours
+
+
+def _group_labels(
+    group_by: Sequence[str],
+    task_types: np.ndarray,
+    partition_keys: np.ndarray,
+    hours: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Map rows to groups.
+
+    Returns:
+        (unique group label tuples, group index of every row)
+    """
+    if not group_by:
+        labels = np.empty(1, dtype=object)
+        labels[0] = ()
+        return labels, np.zeros(len(task_types), dtype=np.int64)
+
+    columns = [{"task_type": task_types, "partition_key": partition_keys, "hour": hours}[field] for field in group_by]
+    keys = columns[0].astype(str)
+    for column in columns[1:]:
+        keys = np.char.add(np.char.add(keys, "\x1f"), column.astype(str))
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    labels = np.empty(len(first), dtype=object)
+    labels[:] = list(zip(*(column[first] for column in columns)))
+    return labels, inverse.reshape(-1)
+
+
+def _histogram_quantiles(histograms: np.ndarray) -> Dict[str, np.ndarray]:
+    """Approximate quantiles (bucket upper bounds) of each histogram row."""
+    bounds = np.asarray(RUNTIME_BUCKETS)
+    cumulative = histograms.cumsum(axis=1)
+    totals = cumulative[:, -1]
+    result = {}
+    for q in QUANTILES:
+        target = np.ceil(q * totals)[:, None]
+        index = np.minimum((cumulative < target).sum(axis=1), len(bounds) - 1)
+        result[f"p{int(q * 100)}"] = np.where(totals > 0, bounds[index], np.nan)
+    return result
+
+
+def _exact_quantiles(values: np.ndarray, groups: np.ndarray, group_count: int) -> Dict[str, np.ndarray]:
+    """Linearly interpolated quantiles of values per group (NaN values ignored)."""
+    valid = ~np.isnan(values)
+    values, groups = values[valid], groups[valid]
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], counts.cumsum()[:-1]))
+
+    result = {}
+    for q in QUANTILES:
+        position = q * np.maximum(counts - 1, 0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(counts - 1, 0))
+        if len(sorted_values):
+            low_values = sorted_values[np.minimum(starts + low, len(sorted_values) - 1)]
+            high_values = sorted_values[np.minimum(starts + high, len(sorted_values) - 1)]
+            quantile = low_values + (position - low) * (high_values - low_values)
+        else:
+            quantile = np.zeros(group_count)
+        result[f"p{int(q * 100)}"] = np.where(counts > 0, quantile, np.nan)
+    return result
+
+
+def _finite_or_none(value: float) -> Optional[float]:
+    return None if math.isnan(value) else round(float(value), 6)
+
+
+def _build_groups(
+    group_by: Sequence[str],
+    labels: np.ndarray,
+    succeeded: np.ndarray,
+    failed: np.ndarray,
+    dead_lettered: np.ndarray,
+    runtime_sum: np.ndarray,
+    runtime_count: np.ndarray,
+    quantiles: Dict[str, np.ndarray],
+    attempt_counts: np.ndarray,
+) -> List[Dict[str, Any]]:
+    attempts = succeeded + failed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        failure_rate = np.where(attempts > 0, failed / attempts, np.nan)
+        mean_runtime = np.where(runtime_count > 0, runtime_sum / runtime_count, np.nan)
+
+    groups = []
+    for i, label in enumerate(labels):
+        distribution = {str(n): int(c) for n, c in enumerate(attempt_counts[i]) if c}
+        groups.append({
+            **dict(zip(group_by, (str(value) if value != "" else None for value in label))),
+            "attempts": int(attempts[i]),
+            "succeeded": int(succeeded[i]),
+            "failed": int(failed[i]),
+            "dead_lettered": int(dead_lettered[i]),
+            "failure_rate": _finite_or_none(failure_rate[i]),
+            "runtime_seconds": {
+                "mean": _finite_or_none(mean_runtime[i]),
+                **{name: _finite_or_none(values[i]) for name, values in quantiles.items()},
+            },
+            "attempts_distribution": distribution,
+        })
+    return groups
+
+
+async def query_rollups(
+    start: datetime,
+    end: datetime,
+    group_by: Sequence[str],
+    task_type: Optional[str] = None,
+    partition_key: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Aggregate hourly rollups.
+
+    Args:
+        start: Range start (inclusive, rounded down to the hour)
+        end: Range end (exclusive)
+        group_by: Fields to group by (see GROUP_BY_FIELDS)
+        task_type: Only this task type
+        partition_key: Only this partition key
+
+    Returns:
+        One aggregate per group; runtime quantiles and attempt distributions
+        are only given when neither grouped nor filtered by partition key
+    """
+    hours = _hours(_utc(start), _utc(end))
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    for hour in hours:
+        pipe.hgetall(_rollup_key(hour))
+    rollups = await pipe.execute()
+
+    # One row per (hour, task type, partition key, metric) counter
+    rows: List[Tuple[str, str, str, str, str]] = []
+    for hour, rollup in zip(hours, rollups):
+        label = _hour_label(hour)
+        for field, value in rollup.items():
+            parts = field.split(_SEP)
+            if len(parts) == 3:
+                rows.append((_unescape(parts[0]), _unescape(parts[1]), label, parts[2], value))
+    if not rows:
+        return []
+
+    task_types, partition_keys, hour_labels, metrics, values = (np.array(column) for column in zip(*rows))
+    values = values.astype(np.float64)
+    keep = np.ones(len(rows), dtype=bool)
+    if partition_key is not None or "partition_key" in group_by:
+        # Histograms and attempt distributions are not kept per partition key
+        keep &= partition_keys != _ANY_PARTITION
+    if task_type is not None:
+        keep &= task_types == task_type
+    if partition_key is not None:
+        keep &= partition_keys == partition_key
+    if not keep.any():
+        return []
+    task_types, partition_keys, hour_labels = task_types[keep], partition_keys[keep], hour_labels[keep]
+    metrics, values = metrics[keep], values[keep]
+
+    labels, group_index = _group_labels(group_by, task_types, partition_keys, hour_labels)
+    group_count = len(labels)
+
+    def total(metric: str) -> np.ndarray:
+        mask = metrics == metric
+        return np.bincount(group_index[mask], weights=values[mask], minlength=group_count)
+
+    def indexed(prefix: str) -> Tuple[np.ndarray, np.ndarray]:
+        mask = np.char.startswith(metrics, prefix)
+        if not mask.any():
+            # np.char.replace cannot size an empty result
+            return mask, np.zeros(0, dtype=np.int64)
+        return mask, np.char.replace(metrics[mask], prefix, "").astype(np.int64)
+
+    def distribution(prefix: str) -> np.ndarray:
+        mask, index = indexed(prefix)
+        width = len(RUNTIME_BUCKETS) if prefix == "rt:" else int(index.max(initial=0)) + 1
+        counts = np.zeros((group_count, width))
+        np.add.at(counts, (group_index[mask], np.minimum(index, width - 1)), values[mask])
+        return counts
+
+    histograms = distribution("rt:")
+    return _build_groups(
+        group_by,
+        labels,
+        total("succeeded"),
+        total("failed"),
+        total("dead_lettered"),
+        total("runtime_sum"),
+        total("succeeded") + total("failed"),
+        _histogram_quantiles(histograms),
+        distribution("att:"),
+    )
+
+
+_ARCHIVE_QUERY = """
+SELECT
+    j.task_type,
+    COALESCE(j.partition_key, ''),
+    strftime('%Y-%m-%dT%H', j.updated_at),
+    j.status,
+    j.attempts,
+    (julianday(j.updated_at) - julianday(
+        (SELECT MAX(e.timestamp) FROM events e WHERE e.job_id = j.job_id AND e.event_type = 'STARTED')
+    )) * 86400.0
+FROM jobs j
+WHERE julianday(j.updated_at) >= julianday(?) AND julianday(j.updated_at) < julianday(?)
+"""
+
+
+def _read_archive(start: datetime, end: datetime) -> List[Tuple[Any, ...]]:
+    """Read the analytics columns of archived jobs in a range (blocking)."""
+    # Archived timestamps are UTC and partitioned by their UTC month; SQLite
+    # compares them as instants whatever their offset suffix
+    start, end = _utc(start), _utc(end)
+    first, last = start.strftime("%Y-%m"), end.strftime("%Y-%m")
+    rows: List[Tuple[Any, ...]] = []
+    for partition in list_partitions():
+        if not first <= partition <= last:
+            continue
+        conn = sqlite3.connect(os.path.join(settings.archive_dir, partition_file(partition)))
+        try:
+            rows.extend(conn.execute(_ARCHIVE_QUERY, (start.isoformat(), end.isoformat())))
+        except sqlite3.OperationalError:
+            continue  # Partition without tables yet
+        finally:
+            conn.close()
+    return rows
+
+
+async def query_archive(
+    start: datetime,
+    end: datetime,
+    group_by: Sequence[str],
+    task_type: Optional[str] = None,
+    partition_key: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Aggregate archived jobs, with exact runtime quantiles.
+
+    Runtime is measured from a job's last STARTED event to its final update.
+    Each archived job counts as one finished job; its earlier attempts count
+    as failed.
+
+    Args:
+        start: Range start (inclusive, by last update)
+        end: Range end (exclusive)
+        group_by: Fields to group by (see GROUP_BY_FIELDS)
+        task_type: Only this task type
+        partition_key: Only this partition key
+
+    Returns:
+        One aggregate per group
+    """
+    rows = await asyncio.to_thread(_read_archive, start, end)
+    if task_type is not None:
+        rows = [row for row in rows if row[0] == task_type]
+    if partition_key is not None:
+        rows = [row for row in rows if row[1] == partition_key]
+    if not rows:
+        return []
+
+    task_types, partition_keys, hour_labels, statuses, attempts, runtimes = zip(*rows)
+    task_types = np.array([t or "" for t in task_types])
+    statuses = np.array(statuses)
+    attempts = np.array(attempts, dtype=np.int64)
+    runtimes = np.array([np.nan if r is None else r for r in runtimes], dtype=np.float64)
+    labels, group_index = _group_labels(group_by, task_types, np.array(partition_keys), np.array(hour_labels))
+    group_count = len(labels)
+
+    is_succeeded = statuses == "SUCCEEDED"
+    is_dead_lettered = statuses == "DEAD_LETTERED"
+    succeeded = np.bincount(group_index, weights=is_succeeded, minlength=group_count)
+    total_attempts = np.bincount(group_index, weights=attempts, minlength=group_count)
+    has_runtime = ~np.isnan(runtimes)
+
+    attempt_counts = np.zeros((group_count, attempts.max() + 1))
+    np.add.at(attempt_counts, (group_index, attempts), 1)
+
+    return _build_groups(
+        group_by,
+        labels,
+        succeeded,
+        total_attempts - succeeded,
+        np.bincount(group_index, weights=is_dead_lettered, minlength=group_count),
+        np.bincount(group_index[has_runtime], weights=runtimes[has_runtime], minlength=group_count),
+        np.bincount(group_index[has_runtime], minlength=group_count),
+        _exact_quantiles(runtimes, group_index, group_count),
+        attempt_counts,
+    )
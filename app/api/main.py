@@ -1,10 +1,47 @@
 """FastAPI application and router wiring."""
 
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.config import settings
-from app.api import routes_health, routes_jobs, routes_metrics, routes_dev
+from app.events import event_sink
+from app.job_cache import job_cache
+from app.redis_client import RedisClient
+from app.sharding import check_shard_set
+from app.tracing import tracer
+from app.api import (
+    routes_analytics,
+    routes_health,
+    routes_bulk,
+    routes_dlq,
+    routes_jobs,
+    routes_metrics,
+    routes_dev,
+    routes_schedules,
+    routes_workflows,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Run the buffered event writer, job cache and tracer for the lifetime of the app."""
+    await check_shard_set()
+    if settings.event_sink_enabled:
+        event_sink.start()
+    if settings.job_cache_enabled:
+        job_cache.start()
+    if settings.tracing_enabled:
+        tracer.start("dtq-api")
+    try:
+        yield
+    finally:
+        await tracer.stop()
+        await job_cache.stop()
+        await event_sink.stop()
+        await RedisClient.close()
 
 
 def create_app() -> FastAPI:
@@ -13,7 +50,8 @@ def create_app() -> FastAPI:
         title=settings.app_name,
         description="Distributed Task Queue & Job Orchestrator",
         version="1.0.0",
-        redirect_slashes=False
+        redirect_slashes=False,
+        lifespan=lifespan
     )
     
     # Add CORS middleware
@@ -36,8 +74,14 @@ def create_app() -> FastAPI:
     
     # Register routers - NO prefixes, routes have full paths
     app.include_router(routes_health.router, prefix="/health", tags=["health"])
+    # Bulk routes first so /jobs/bulk/... is not captured by /jobs/{job_id}/...
+    app.include_router(routes_bulk.router, tags=["bulk"])
     app.include_router(routes_jobs.router, tags=["jobs"])
+    app.include_router(routes_workflows.router, tags=["workflows"])
+    app.include_router(routes_schedules.router, tags=["schedules"])
+    app.include_router(routes_dlq.router, tags=["dlq"])
     app.include_router(routes_metrics.router, tags=["metrics"])
+    app.include_router(routes_analytics.router, tags=["analytics"])
     app.include_router(routes_dev.router, tags=["dev"])
     
     return app
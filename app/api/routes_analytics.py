@@ -0,0 +1,62 @@
+"""Historical job analytics endpoints."""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+
+from app.analytics import GROUP_BY_FIELDS, query_archive, query_rollups
+from app.config import settings
+
+router = APIRouter()
+
+
+@router.get("/analytics/jobs")
+async def job_analytics(
+    start: Optional[datetime] = Query(default=None, description="Range start (default: 24 hours before end)"),
+    end: Optional[datetime] = Query(default=None, description="Range end (default: now)"),
+    group_by: List[str] = Query(default=["task_type"], description="Any of task_type, partition_key, hour"),
+    task_type: Optional[str] = Query(default=None, description="Only this task type"),
+    partition_key: Optional[str] = Query(default=None, description="Only this partition key"),
+    source: Literal["rollups", "archive"] = Query(
+        default="rollups",
+        description="rollups: all executions, approximate quantiles; archive: archived jobs, exact quantiles"
+    ),
+) -> Dict[str, Any]:
+    """
+    Aggregate job outcomes, failure rates, runtime quantiles and attempt
+    distributions over a time range.
+    """
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+
+    unknown = [field for field in group_by if field not in GROUP_BY_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid group_by field(s): {', '.join(unknown)}"
+        )
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end"
+        )
+    if end - start > timedelta(days=settings.analytics_max_range_days):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range must not exceed {settings.analytics_max_range_days} days"
+        )
+
+    query = query_rollups if source == "rollups" else query_archive
+    groups = await query(start, end, group_by, task_type=task_type, partition_key=partition_key)
+    return {
+        "source": source,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "groups": groups,
+    }
@@ -0,0 +1,63 @@
+"""Bulk job operation endpoints."""
+
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.bulk_ops import BulkAction, count_matching_jobs, run_bulk_operation
+from app.models import BulkJobFilter
+from app.operations import create_operation, get_operation, run_operation
+
+router = APIRouter()
+
+
+class BulkOperationRequest(BaseModel):
+    """Request model for a bulk cancel/retry/requeue."""
+
+    filter: BulkJobFilter = Field(..., description="Job selection criteria")
+    reason: Optional[str] = Field(default=None, description="Reason recorded on each job")
+    dry_run: bool = Field(default=False, description="Only count matching jobs")
+    batch_size: int = Field(default=500, ge=1, le=5000, description="Jobs processed per batch")
+
+
+@router.post("/jobs/bulk/{action}", status_code=status.HTTP_202_ACCEPTED)
+async def bulk_job_action(action: BulkAction, request: BulkOperationRequest) -> Dict[str, Any]:
+    """
+    Cancel, retry or requeue all jobs matching a filter.
+
+    The action runs server-side in batches; poll the returned operation for
+    progress. With ``dry_run`` the matching jobs are only counted.
+    """
+    if request.dry_run:
+        matched = await count_matching_jobs(request.filter, request.batch_size)
+        return {"action": action.value, "dry_run": True, "matched": matched}
+
+    operation_id = await create_operation(
+        f"bulk_{action.value}",
+        request.model_dump(mode="json"),
+    )
+    run_operation(
+        operation_id,
+        run_bulk_operation(
+            operation_id,
+            action,
+            request.filter,
+            reason=request.reason,
+            batch_size=request.batch_size,
+        ),
+    )
+
+    return {"action": action.value, "dry_run": False, "operation_id": operation_id}
+
+
+@router.get("/jobs/bulk/operations/{operation_id}")
+async def get_bulk_operation(operation_id: str) -> Dict[str, Any]:
+    """Get progress of a bulk operation."""
+    operation = await get_operation(operation_id)
+    if operation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Operation {operation_id} not found"
+        )
+    return operation
@@ -0,0 +1,116 @@
+"""Dead letter queue inspection, replay and purge endpoints."""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+from pydantic import BaseModel, Field
+
+from app.dlq import count_replayable, list_dlq_entries, purge_dlq, replay_dlq, summarize_dlq
+from app.operations import create_operation, get_operation, run_operation
+
+router = APIRouter()
+
+
+class DlqReplayRequest(BaseModel):
+    """Request model for replaying dead-lettered jobs."""
+
+    task_type: Optional[str] = Field(default=None, description="Only entries of this task type")
+    error_signature: Optional[str] = Field(default=None, description="Only entries with this error signature")
+    limit: Optional[int] = Field(default=None, ge=1, description="Maximum number of jobs to replay")
+    rate_per_second: float = Field(default=100.0, gt=0, le=100000, description="Maximum jobs re-enqueued per second")
+    reset_attempts: bool = Field(default=True, description="Reset attempt counter of replayed jobs")
+    payload_patch: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="Keys merged into each replayed payload's data"
+    )
+    delete_after_replay: bool = Field(
+        default=False,
+        description="Delete entries from the DLQ once replayed (otherwise marked for purge)"
+    )
+    dry_run: bool = Field(default=False, description="Only count matching entries")
+
+
+class DlqPurgeRequest(BaseModel):
+    """Request model for purging DLQ entries."""
+
+    replayed_only: bool = Field(default=False, description="Delete entries that have been replayed")
+    before: Optional[datetime] = Field(default=None, description="Delete entries dead-lettered before this time")
+    max_len: Optional[int] = Field(default=None, ge=0, description="Keep at most this many newest entries")
+
+
+@router.get("/dlq")
+async def list_dlq(
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page"),
+    count: int = Query(default=50, ge=1, le=1000, description="Maximum number of entries to return"),
+    task_type: Optional[str] = Query(default=None, description="Filter by task type"),
+    error_signature: Optional[str] = Query(default=None, description="Filter by error signature"),
+) -> Dict[str, Any]:
+    """Browse DLQ entries, oldest first, with cursor pagination."""
+    return await list_dlq_entries(cursor=cursor, count=count, task_type=task_type, signature=error_signature)
+
+
+@router.get("/dlq/summary")
+async def dlq_summary() -> List[Dict[str, Any]]:
+    """Get DLQ entry counts grouped by task type and error signature."""
+    return await summarize_dlq()
+
+
+@router.post("/dlq/replay", status_code=status.HTTP_202_ACCEPTED)
+async def replay_dlq_endpoint(request: DlqReplayRequest) -> Dict[str, Any]:
+    """
+    Replay dead-lettered jobs back onto the job stream.
+
+    Runs in the background at the requested rate; poll the returned operation
+    for progress.
+    """
+    if request.dry_run:
+        matched = await count_replayable(request.task_type, request.error_signature)
+        if request.limit is not None:
+            matched = min(matched, request.limit)
+        return {"dry_run": True, "matched": matched}
+
+    operation_id = await create_operation("dlq_replay", request.model_dump(mode="json"))
+    run_operation(
+        operation_id,
+        replay_dlq(
+            operation_id,
+            task_type=request.task_type,
+            signature=request.error_signature,
+            limit=request.limit,
+            rate_per_second=request.rate_per_second,
+            reset_attempts=request.reset_attempts,
+            payload_patch=request.payload_patch,
+            delete_after_replay=request.delete_after_replay,
+        ),
+    )
+    return {"dry_run": False, "operation_id": operation_id}
+
+
+@router.get("/dlq/operations/{operation_id}")
+async def get_dlq_operation(operation_id: str) -> Dict[str, Any]:
+    """Get progress of a DLQ replay."""
+    operation = await get_operation(operation_id)
+    if operation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Operation {operation_id} not found"
+        )
+    return operation
+
+
+@router.post("/dlq/purge")
+async def purge_dlq_endpoint(request: DlqPurgeRequest) -> Dict[str, Any]:
+    """Delete replayed or old entries from the DLQ."""
+    if not request.replayed_only and request.before is None and request.max_len is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Specify at least one of replayed_only, before or max_len"
+        )
+
+    deleted = await purge_dlq(
+        replayed_only=request.replayed_only,
+        before=request.before,
+        max_len=request.max_len,
+    )
+    return {"deleted": deleted}
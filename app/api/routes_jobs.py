@@ -1,68 +1,146 @@
 """Job lifecycle management endpoints."""
 
-import json
+import asyncio
 from datetime import datetime, timezone
-from typing import List, Optional
-from uuid import UUID, uuid4
+from typing import Dict, List, Optional
+from uuid import UUID
 
-from fastapi import APIRouter, HTTPException, Query, status
+from fastapi import APIRouter, Header, HTTPException, Query, Response, status
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
+from app.admission import check_admission, defer_job
+from app.archive import get_archived_job, get_archived_job_events
+from app.codec import decode, encode
 from app.config import settings
-from app.events import EventType, append_job_event, get_job_events
+from app.events import EventType, append_job_events, get_job_events
+from app.job_cache import compute_etag, etag_matches, job_cache
+from app.job_schema import queue_job_write, read_job, read_jobs
 from app.jobs_service import transition_job_status
-from app.models import JobCreateRequest, JobResponse, JobStatus
+from app.map_jobs import MAP_TASK_TYPE, get_map_progress, submit_map_job
+from app.models import JobCreateRequest, JobPayload, JobResponse, JobStatus
 from app.redis_client import get_redis
+from app.queues import enqueue_job
+from app.sharding import get_redis_for, get_shards, new_job_id
+from app.tracing import SPAN_KIND_PRODUCER, parse_traceparent, start_span
 from app.transitions import InvalidTransitionError
 
 router = APIRouter()
 
 
-@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
-async def create_job(request: JobCreateRequest) -> JobResponse:
-    """Create a new job and add it to the queue."""
-    redis = await get_redis()
+def job_response_from_hash(job_hash: Dict[str, str]) -> JobResponse:
+    """Build a JobResponse from a job hash.
+
+    The payload was validated when the job was created, so it is not
+    validated again on every read.
+    """
+    payload_data = decode(job_hash.get("payload_json", "{}"))
+    return JobResponse(
+        job_id=UUID(job_hash["job_id"]),
+        status=JobStatus(job_hash.get("status", "PENDING")),
+        created_at=datetime.fromisoformat(job_hash["created_at"]),
+        updated_at=datetime.fromisoformat(job_hash["updated_at"]),
+        payload=JobPayload.model_construct(**payload_data),
+        attempts=int(job_hash.get("attempts", "0")),
+        partition_key=job_hash.get("partition_key") or None,
+        result=decode(job_hash["result"]) if job_hash.get("result") else None
+    )
+
+
+async def create_job(
+    request: JobCreateRequest,
+    *,
+    defer: bool = False,
+    traceparent: Optional[str] = None,
+) -> JobResponse:
+    """
+    Create a new job and add it to the queue.
+
+    Does not apply admission control; see create_job_endpoint.
+
+    Args:
+        request: The job to create
+        defer: Store the job without enqueueing it; the maintenance service
+            enqueues it once the queue has room
+        traceparent: Trace context of the caller; the job's trace continues
+            it (when tracing is enabled)
+
+    Returns:
+        The created job
+    """
+    # Map jobs are split into chunk jobs instead of being enqueued directly
+    if request.payload.task_type == MAP_TASK_TYPE:
+        try:
+            return await submit_map_job(request)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
     
-    # Generate job ID
-    job_id = uuid4()
+    # Generate job ID; it places the job on its shard (see app.sharding)
+    job_id = new_job_id()
+    redis = get_redis_for(str(job_id))
+    # Job timestamps are stored with millisecond precision
     now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
     
     # Prepare job metadata
-    job_key = f"job:{job_id}"
-    payload_json = request.payload.model_dump_json()
+    payload_json = encode(request.payload.model_dump(mode="json"))
     
     # Store job hash in Redis
     job_hash = {
-        "job_id": str(job_id),
         "status": JobStatus.PENDING.value,
-        "created_at": now.isoformat(),
-        "updated_at": now.isoformat(),
+        "created_at": now,
+        "updated_at": now,
         "attempts": "0",
-        "partition_key": request.partition_key or "",
+        "partition_key": request.partition_key,
         "task_type": request.payload.task_type,
         "payload_json": payload_json
     }
     
-    # Store job hash
-    await redis.hset(job_key, mapping=job_hash)
-    
-    # Append to Redis Stream
-    stream_fields = {
-        "job_id": str(job_id),
-        "partition_key": request.partition_key or "",
-        "task_type": request.payload.task_type,
-        "payload_json": payload_json
-    }
+    # Start the job's trace; its context travels with the job to the workers
+    span = None
+    if settings.tracing_enabled:
+        span = start_span(
+            "job.create",
+            parse_traceparent(traceparent),
+            kind=SPAN_KIND_PRODUCER,
+            attributes={"job.id": str(job_id), "job.task_type": request.payload.task_type, "job.deferred": defer},
+        )
+        job_hash["traceparent"] = span.context.traceparent
+    if defer:
+        job_hash["deferred"] = "1"
     
-    await redis.xadd(settings.job_stream, stream_fields)
+    # Store job hash and either add the job to its task type's queue or defer it
+    pipe = redis.pipeline(transaction=True)
+    queue_job_write(pipe, str(job_id), job_hash, new=True)
+    if defer:
+        defer_job(pipe, str(job_id), request.payload.task_type)
+    else:
+        enqueue_job(
+            pipe,
+            str(job_id),
+            request.partition_key or "",
+            request.payload.task_type,
+            payload_json,
+            job_hash.get("traceparent"),
+        )
+    await pipe.execute()
     
     # Increment creation counter
-    await redis.incr("metrics:jobs_created_total")
+    await get_redis().incr("metrics:jobs_created_total")
     
     # Emit events
-    await append_job_event(str(job_id), EventType.CREATED, JobStatus.PENDING)
-    await append_job_event(str(job_id), EventType.ENQUEUED, JobStatus.PENDING)
+    await append_job_events(
+        [
+            (str(job_id), EventType.CREATED, JobStatus.PENDING, {"trace_id": span.context.trace_id} if span else None),
+            (str(job_id), EventType.DEFERRED if defer else EventType.ENQUEUED, JobStatus.PENDING, None),
+        ],
+        task_type=request.payload.task_type,
+    )
+    if span is not None:
+        span.end()
     
     # Return job response
     return JobResponse(
@@ -76,16 +154,46 @@ async def create_job(request: JobCreateRequest) -> JobResponse:
     )
 
 
+@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_job_endpoint(
+    request: JobCreateRequest,
+    response: Response,
+    traceparent: Optional[str] = Header(default=None),
+) -> JobResponse:
+    """Create a new job, subject to admission control."""
+    # Map jobs enqueue their chunks immediately, so they are never deferred
+    decision = await check_admission(
+        request.partition_key,
+        request.payload.task_type,
+        allow_defer=request.payload.task_type != MAP_TASK_TYPE,
+    )
+    if not decision.admitted:
+        redis = get_redis()
+        await redis.incr("metrics:jobs_rejected_total")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=decision.reason,
+            headers={"Retry-After": str(decision.retry_after_seconds)},
+        )
+
+    if decision.deferred:
+        response.headers["X-Admission"] = "deferred"
+    return await create_job(request, defer=decision.deferred, traceparent=traceparent)
+
+
 @router.get("/jobs", response_model=List[JobResponse])
 async def list_jobs(
     limit: int = Query(default=50, ge=1, le=1000, description="Maximum number of jobs to return"),
     offset: int = Query(default=0, ge=0, description="Number of jobs to skip")
 ) -> List[JobResponse]:
-    """List jobs with pagination."""
-    redis = await get_redis()
-    
-    # Get all job keys
-    job_keys = await redis.keys("job:*")
+    """List jobs with pagination, across all shards."""
+    # Get all job keys, skipping per-job sub-keys such as job:{id}:log
+    job_keys = [
+        job_key
+        for keys in await asyncio.gather(*(redis.keys("job:*") for redis in get_shards()))
+        for job_key in keys
+        if job_key.count(":") == 1
+    ]
     
     # Sort by key (which includes job_id) for consistent ordering
     job_keys.sort()
@@ -95,27 +203,14 @@ async def list_jobs(
     
     # Fetch job data
     jobs = []
-    from app.models import JobPayload
     
-    for job_key in paginated_keys:
-        job_hash = await redis.hgetall(job_key)
+    job_hashes = await read_jobs([job_key.split(":", 1)[1] for job_key in paginated_keys])
+    for job_hash in job_hashes:
         if not job_hash:
             continue
         
         try:
-            payload_json = job_hash.get("payload_json", "{}")
-            payload_data = json.loads(payload_json)
-            
-            job = JobResponse(
-                job_id=UUID(job_hash["job_id"]),
-                status=JobStatus(job_hash.get("status", "PENDING")),
-                created_at=datetime.fromisoformat(job_hash["created_at"]),
-                updated_at=datetime.fromisoformat(job_hash["updated_at"]),
-                payload=JobPayload(**payload_data),
-                attempts=int(job_hash.get("attempts", "0")),
-                partition_key=job_hash.get("partition_key") or None
-            )
-            jobs.append(job)
+            jobs.append(job_response_from_hash(job_hash))
         except Exception:
             # Skip invalid jobs
             continue
@@ -123,13 +218,11 @@ async def list_jobs(
     return jobs
 
 
-@router.get("/jobs/{job_id}", response_model=JobResponse)
 async def get_job(job_id: UUID) -> JobResponse:
-    """Get job status by ID."""
-    redis = await get_redis()
-    
-    job_key = f"job:{job_id}"
-    job_hash = await redis.hgetall(job_key)
+    """Get job status by ID, falling back to the archive."""
+    job_hash = await read_job(str(job_id))
+    if not job_hash:
+        job_hash = await get_archived_job(str(job_id))
     
     if not job_hash:
         raise HTTPException(
@@ -137,33 +230,59 @@ async def get_job(job_id: UUID) -> JobResponse:
             detail=f"Job {job_id} not found"
         )
     
-    # Parse job data
-    payload_json = job_hash.get("payload_json", "{}")
-    payload_data = json.loads(payload_json)
-    
-    from app.models import JobPayload
+    return job_response_from_hash(job_hash)
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job_endpoint(
+    job_id: UUID,
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    """
+    Get job status by ID.
+
+    Responses carry an ETag; a matching If-None-Match returns 304.
+    """
+    cached = job_cache.get(str(job_id))
+    if cached is not None:
+        body, etag = cached
+    else:
+        token = job_cache.begin_load(str(job_id))
+        job = await get_job(job_id)
+        body = job.model_dump_json().encode()
+        etag = compute_etag(body)
+        job_cache.put(str(job_id), token, body, etag, job.status.value)
     
-    return JobResponse(
-        job_id=UUID(job_hash["job_id"]),
-        status=JobStatus(job_hash.get("status", "PENDING")),
-        created_at=datetime.fromisoformat(job_hash["created_at"]),
-        updated_at=datetime.fromisoformat(job_hash["updated_at"]),
-        payload=JobPayload(**payload_data),
-        attempts=int(job_hash.get("attempts", "0")),
-        partition_key=job_hash.get("partition_key") or None
-    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/jobs/{job_id}/map")
+async def get_map_progress_endpoint(job_id: UUID):
+    """Get chunk and item progress of a map job."""
+    progress = await get_map_progress(str(job_id))
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Map job {job_id} not found"
+        )
+    return progress
 
 
 @router.get("/jobs/{job_id}/events")
 async def get_job_events_endpoint(job_id: UUID):
-    """Get all events for a specific job."""
+    """Get all events for a specific job, falling back to the archive."""
     events = await get_job_events(str(job_id))
     if not events:
         # Check if job exists
-        redis = await get_redis()
+        redis = get_redis_for(str(job_id))
         job_key = f"job:{job_id}"
-        job_hash = await redis.hgetall(job_key)
-        if not job_hash:
+        if await redis.exists(job_key):
+            return events
+        events = await get_archived_job_events(str(job_id))
+        if events is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Job {job_id} not found"
@@ -173,47 +292,23 @@ async def get_job_events_endpoint(job_id: UUID):
 
 @router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
 async def cancel_job(job_id: UUID) -> JobResponse:
-    """Cancel a job."""
-    redis = await get_redis()
-    
-    job_key = f"job:{job_id}"
-    job_hash = await redis.hgetall(job_key)
-    
-    if not job_hash:
+    """Cancel a pending or running job."""
+    try:
+        await transition_job_status(
+            str(job_id), JobStatus.CANCELLED, reason="User requested cancellation", actor="user"
+        )
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Job {job_id} not found"
         )
+    except InvalidTransitionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
-    # Cancel job - set status to "CANCELLED" string directly
-    now = datetime.now(timezone.utc)
-    await redis.hset(job_key, mapping={
-        "status": "CANCELLED",
-        "updated_at": now.isoformat()
-    })
-    
-    # Emit CANCELLED event
-    await append_job_event(str(job_id), EventType.CANCELLED, JobStatus.PENDING, details={"actor": "user", "reason": "User requested cancellation"})
-    
-    # Get updated job data
-    job_hash = await redis.hgetall(job_key)
-    payload_json = job_hash.get("payload_json", "{}")
-    payload_data = json.loads(payload_json)
-    
-    from app.models import JobPayload
-    
-    # Get updated job data
-    updated_job_hash = await redis.hgetall(job_key)
-    
-    return JobResponse(
-        job_id=UUID(updated_job_hash["job_id"]),
-        status=JobStatus.PENDING,  # Status is CANCELLED in Redis, but enum doesn't include it
-        created_at=datetime.fromisoformat(updated_job_hash["created_at"]),
-        updated_at=datetime.fromisoformat(updated_job_hash["updated_at"]),
-        payload=JobPayload(**payload_data),
-        attempts=int(updated_job_hash.get("attempts", "0")),
-        partition_key=updated_job_hash.get("partition_key") or None
-    )
+    return await get_job(job_id)
 
 
 class TransitionRequest(BaseModel):
@@ -222,6 +317,14 @@ class TransitionRequest(BaseModel):
     reason: Optional[str] = Field(None, description="Reason for transition")
 
 
+# Statuses a job may be in for each transition allowed via the UI
+# (None: any status ALLOWED_TRANSITIONS permits)
+UI_TRANSITIONS: Dict[JobStatus, Optional[List[JobStatus]]] = {
+    JobStatus.CANCELLED: None,  # Cancel
+    JobStatus.PENDING: [JobStatus.FAILED, JobStatus.DEAD_LETTERED, JobStatus.CANCELLED],  # Retry / requeue
+}
+
+
 @router.post("/jobs/{job_id}/transition", response_model=JobResponse)
 async def transition_job_endpoint(
     job_id: UUID,
@@ -236,67 +339,31 @@ async def transition_job_endpoint(
             detail=f"Invalid status: {request.to_status}"
         )
 
-    # Only allow specific UI transitions
-    # CANCELLED is stored as string, so we check it differently
-    allowed_ui_transitions = {
-        (JobStatus.PENDING, "CANCELLED"),  # Cancel
-        (JobStatus.FAILED, JobStatus.PENDING),  # Retry
-        (JobStatus.DEAD_LETTERED, JobStatus.PENDING),  # Requeue
-        ("CANCELLED", JobStatus.PENDING),  # Requeue from cancelled
-    }
-
-    redis = await get_redis()
-    job_key = f"job:{job_id}"
-    job_hash = await redis.hgetall(job_key)
-    if not job_hash:
+    if target_status not in UI_TRANSITIONS:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Job {job_id} not found"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Transition to {target_status.value} not allowed via UI"
         )
+    expected = UI_TRANSITIONS[target_status]
 
-    current_status_str = job_hash.get("status", "PENDING")
-    
-    # Handle CANCELLED transition
-    if request.to_status.upper() == "CANCELLED":
-        # Direct cancellation
-        now = datetime.now(timezone.utc)
-        await redis.hset(job_key, mapping={
-            "status": "CANCELLED",
-            "updated_at": now.isoformat()
-        })
-        await append_job_event(str(job_id), EventType.CANCELLED, JobStatus.PENDING, details={"actor": "ui", "reason": request.reason})
-        return await get_job(job_id)
-    
     try:
-        current_status = JobStatus(current_status_str)
+        await transition_job_status(
+            str(job_id), target_status, reason=request.reason, actor="ui", expected=expected
+        )
     except ValueError:
-        if current_status_str == "CANCELLED":
-            # Requeue from CANCELLED
-            if target_status != JobStatus.PENDING:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Can only requeue from CANCELLED to PENDING"
-                )
-            # Allow requeue
-            await transition_job_status(str(job_id), target_status, reason=request.reason, actor="ui")
-            return await get_job(job_id)
-        current_status = JobStatus.PENDING
-
-    # Check if transition is allowed
-    transition_key = (current_status, target_status)
-    if transition_key not in allowed_ui_transitions:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Transition from {current_status.value} to {target_status.value} not allowed via UI"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
         )
-
-    try:
-        await transition_job_status(str(job_id), target_status, reason=request.reason, actor="ui")
-        # Return updated job
-        return await get_job(job_id)
     except InvalidTransitionError as e:
+        if expected is not None and e.from_status not in expected:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Transition from {e.from_status.value} to {target_status.value} not allowed via UI"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
 
+    return await get_job(job_id)
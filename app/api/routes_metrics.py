@@ -1,23 +1,45 @@
 """Metrics endpoints."""
 
-from typing import Any, Dict
+import asyncio
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from pydantic import BaseModel, Field
 
+from app.admission import count_deferred_jobs, get_queue_depth
 from app.config import settings
+from app.events import event_sink
+from app.job_cache import job_cache
+from app.job_schema import read_jobs
 from app.models import JobStatus
+from app.profiling import get_slow_jobs, get_stage_stats, request_profile, reset_stage_stats
+from app.queues import all_queue_stats
 from app.redis_client import get_redis
+from app.sharding import get_nodes, get_shards, shard_count
+from app.stream_retention import stream_memory_usage
 
 router = APIRouter()
 
+_COUNTERS = [
+    "jobs_created_total",
+    "jobs_completed_total",
+    "events_dropped_total",
+    "events_late_total",
+    "jobs_rejected_total",
+]
+
 
 @router.get("/metrics")
 async def get_metrics() -> Dict[str, Any]:
-    """Get job metrics including counts by status and DLQ depth."""
-    redis = await get_redis()
+    """Get job metrics including counts by status and DLQ depth, across all shards."""
+    redis = get_redis()
     
     # Get all job keys
-    job_keys = await redis.keys("job:*")
+    job_keys = [
+        job_key
+        for keys in await asyncio.gather(*(shard.keys("job:*") for shard in get_shards()))
+        for job_key in keys
+    ]
     
     # Count jobs by status
     status_counts = {
@@ -26,30 +48,82 @@ async def get_metrics() -> Dict[str, Any]:
         JobStatus.SUCCEEDED.value: 0,
         JobStatus.FAILED.value: 0,
         JobStatus.DEAD_LETTERED.value: 0,
-        "CANCELLED": 0
+        JobStatus.CANCELLED.value: 0
     }
     
-    for job_key in job_keys:
-        job_hash = await redis.hgetall(job_key)
-        if not job_hash:
+    # Skip per-job sub-keys such as job:{id}:log
+    job_ids = [job_key.split(":", 1)[1] for job_key in job_keys if job_key.count(":") == 1]
+    for job in await read_jobs(job_ids, ["status"]):
+        if not job:
             continue
         
-        status = job_hash.get("status", "PENDING")
+        status = job.get("status", "PENDING")
         if status in status_counts:
             status_counts[status] += 1
     
     # Get DLQ depth
     dlq_depth = await redis.xlen(settings.dlq_stream)
 
-    # Get throughput metrics
-    jobs_created_total = await redis.get("metrics:jobs_created_total") or "0"
-    jobs_completed_total = await redis.get("metrics:jobs_completed_total") or "0"
+    # Get throughput metrics; counters written by scripts live on the job's
+    # shard, so every counter is summed over all nodes
+    counters = {name: 0 for name in _COUNTERS}
+    for node in get_nodes():
+        for name, value in zip(_COUNTERS, await node.mget([f"metrics:{name}" for name in _COUNTERS])):
+            counters[name] += int(value or 0)
+    jobs_deferred = await count_deferred_jobs()
 
     return {
         "job_counts": status_counts,
         "dlq_depth": dlq_depth,
         "total_jobs": sum(status_counts.values()),
-        "jobs_created_total": int(jobs_created_total),
-        "jobs_completed_total": int(jobs_completed_total),
+        "jobs_created_total": counters["jobs_created_total"],
+        "jobs_completed_total": counters["jobs_completed_total"],
+        "events_dropped_total": counters["events_dropped_total"],
+        "events_late_total": counters["events_late_total"],
+        "queue_depth": await get_queue_depth(),
+        "queues": await all_queue_stats(),  # Lag and pending entries per queue
+        "jobs_deferred": jobs_deferred,
+        "jobs_rejected_total": counters["jobs_rejected_total"],
+        "shards": shard_count(),
+        "streams": await stream_memory_usage(),
+        "event_sink": event_sink.stats(),  # This API process only
+        "job_cache": job_cache.stats(),  # This API process only
     }
 
+
+
+@router.get("/metrics/stages")
+async def get_stage_timings() -> Dict[str, Any]:
+    """Time workers spent per stage of processing jobs, per task type, since the last reset."""
+    return {"task_types": await get_stage_stats()}
+
+
+@router.delete("/metrics/stages")
+async def reset_stage_timings() -> Dict[str, Any]:
+    """Reset the stage timings."""
+    await reset_stage_stats()
+    return {"reset": True}
+
+
+@router.get("/metrics/slow-jobs")
+async def list_slow_jobs(limit: int = Query(default=100, ge=1, le=1000)) -> List[Dict[str, Any]]:
+    """Latest jobs that took longer than SLOW_JOB_THRESHOLD_SECONDS, with their stage breakdown."""
+    return await get_slow_jobs(limit)
+
+
+class ProfileRequest(BaseModel):
+    """Request model for taking worker profiles."""
+
+    duration_seconds: float = Field(default=30.0, gt=0, description="How long to sample")
+    worker_id: Optional[str] = Field(default=None, description="Only this worker (default: all)")
+
+
+@router.post("/metrics/profile")
+async def profile_workers(request: ProfileRequest) -> Dict[str, Any]:
+    """
+    Ask workers to take a sampling profile.
+
+    Each worker writes its profile to its PROFILE_DIR.
+    """
+    workers = await request_profile(request.duration_seconds, request.worker_id)
+    return {"workers_notified": workers}
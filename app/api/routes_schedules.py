@@ -0,0 +1,62 @@
+"""Recurring job schedule endpoints."""
+
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, HTTPException, status
+
+from app.models import ScheduleTemplate
+from app.schedules import delete_schedule, list_schedules, save_schedule
+
+router = APIRouter()
+
+
+@router.put("/schedules/{name}")
+async def put_schedule(name: str, template: ScheduleTemplate) -> Dict[str, Any]:
+    """
+    Create or replace a recurring job schedule.
+
+    Runs are enqueued by the scheduler service through the normal job
+    creation path.
+    """
+    if template.name != name:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Schedule name in path and body must match"
+        )
+
+    try:
+        return await save_schedule(template)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+@router.get("/schedules")
+async def get_schedules() -> List[Dict[str, Any]]:
+    """List schedules with their next fire time."""
+    return await list_schedules()
+
+
+@router.get("/schedules/{name}")
+async def get_schedule(name: str) -> Dict[str, Any]:
+    """Get a schedule by name."""
+    for schedule in await list_schedules():
+        if schedule["name"] == name:
+            return schedule
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Schedule {name} not found"
+    )
+
+
+@router.delete("/schedules/{name}")
+async def remove_schedule(name: str) -> Dict[str, Any]:
+    """Delete a schedule."""
+    if not await delete_schedule(name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Schedule {name} not found"
+        )
+    return {"deleted": name}
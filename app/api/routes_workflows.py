@@ -0,0 +1,40 @@
+"""Workflow (job DAG) endpoints."""
+
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException, status
+
+from app.models import WorkflowCreateRequest
+from app.workflows import InvalidWorkflowError, create_workflow, get_workflow
+
+router = APIRouter()
+
+
+@router.post("/workflows", status_code=status.HTTP_202_ACCEPTED)
+async def create_workflow_endpoint(request: WorkflowCreateRequest) -> Dict[str, Any]:
+    """
+    Submit a DAG of jobs.
+
+    Nodes without dependencies are enqueued immediately; every other node is
+    enqueued as soon as all nodes it depends on have succeeded. If a node
+    fails terminally or is cancelled, all of its descendants are skipped.
+    """
+    try:
+        return await create_workflow(request)
+    except InvalidWorkflowError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+@router.get("/workflows/{workflow_id}")
+async def get_workflow_endpoint(workflow_id: str) -> Dict[str, Any]:
+    """Get workflow status and the status of each node."""
+    workflow = await get_workflow(workflow_id)
+    if workflow is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Workflow {workflow_id} not found"
+        )
+    return workflow
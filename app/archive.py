@@ -0,0 +1,291 @@
+"""Cold storage of terminal jobs in monthly SQLite files.
+
+Succeeded and dead-lettered jobs that have not changed for
+``settings.archive_after_seconds`` are copied, with their events, into
+``<archive_dir>/jobs-YYYY-MM.sqlite`` (by the month of their last update) and
+then removed from Redis. ``index.sqlite`` maps job IDs to their partition so
+lookups open a single file.
+
+Archived dead-lettered jobs can still be replayed from the DLQ, which
+recreates the job hash.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.events import job_events_key, legacy_job_events_key, parse_job_events
+from app.job_schema import JOB_HASH_LUA, job_key, job_sub_keys, read_jobs, scan_job_ids, to_ms
+from app.models import JobStatus
+from app.sharding import get_shard
+
+
+ARCHIVED_STATUSES = (JobStatus.SUCCEEDED.value, JobStatus.DEAD_LETTERED.value)
+
+INDEX_FILE = "index.sqlite"
+
+_PARTITION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    task_type TEXT,
+    partition_key TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    attempts INTEGER,
+    fields_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    status TEXT,
+    details_json TEXT
+);
+CREATE INDEX IF NOT EXISTS events_job_id ON events (job_id);
+"""
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_index (
+    job_id TEXT PRIMARY KEY,
+    partition TEXT NOT NULL
+);
+"""
+
+# Lua script deleting a job hash and its large value keys only if it was not
+# updated since it was read, so a job requeued while being archived stays in
+# Redis. ARGV: updated_at as read (ISO-8601) and in epoch milliseconds
+DELETE_IF_UNCHANGED_SCRIPT = JOB_HASH_LUA + """
+local updated_at = job_get(KEYS[1], 'updated_at')
+if updated_at ~= ARGV[1] and updated_at ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', unpack(KEYS))
+return 1
+"""
+
+# (job hash, events) of one job
+ArchivedJob = Tuple[Dict[str, str], List[Dict[str, Any]]]
+
+
+def _connect(filename: str) -> sqlite3.Connection:
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    return sqlite3.connect(os.path.join(settings.archive_dir, filename))
+
+
+def partition_file(partition: str) -> str:
+    """File name of a monthly partition ("YYYY-MM")."""
+    return f"jobs-{partition}.sqlite"
+
+
+def list_partitions() -> List[str]:
+    """Archive partitions on disk, oldest first."""
+    if not os.path.isdir(settings.archive_dir):
+        return []
+    return sorted(
+        name[len("jobs-"):-len(".sqlite")]
+        for name in os.listdir(settings.archive_dir)
+        if name.startswith("jobs-") and name.endswith(".sqlite")
+    )
+
+
+def _write_partition(partition: str, jobs: List[ArchivedJob]) -> None:
+    """Write jobs into one partition and the index (blocking)."""
+    conn = _connect(partition_file(partition))
+    try:
+        conn.executescript(_PARTITION_SCHEMA)
+        with conn:
+            for job_hash, events in jobs:
+                job_id = job_hash["job_id"]
+                conn.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job_id,
+                        job_hash.get("status"),
+                        job_hash.get("task_type"),
+                        job_hash.get("partition_key") or None,
+                        job_hash.get("created_at"),
+                        job_hash.get("updated_at"),
+                        int(job_hash.get("attempts", "0")),
+                        json.dumps(job_hash),
+                    ),
+                )
+                # A job archived again after a requeue replaces its old events
+                conn.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+                conn.executemany(
+                    "INSERT INTO events VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            job_id,
+                            event.get("timestamp", ""),
+                            event.get("event_type", ""),
+                            event.get("status"),
+                            json.dumps(event["details"]) if event.get("details") else None,
+                        )
+                        for event in events
+                    ],
+                )
+    finally:
+        conn.close()
+
+    conn = _connect(INDEX_FILE)
+    try:
+        conn.executescript(_INDEX_SCHEMA)
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_index VALUES (?, ?)",
+                [(job_hash["job_id"], partition) for job_hash, _ in jobs],
+            )
+    finally:
+        conn.close()
+
+
+def _find_partition(job_id: str) -> Optional[str]:
+    if not os.path.exists(os.path.join(settings.archive_dir, INDEX_FILE)):
+        return None
+    conn = _connect(INDEX_FILE)
+    try:
+        row = conn.execute("SELECT partition FROM job_index WHERE job_id = ?", (job_id,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def _read_job(job_id: str) -> Optional[ArchivedJob]:
+    """Read an archived job and its events (blocking)."""
+    partition = _find_partition(job_id)
+    if partition is None:
+        return None
+
+    conn = _connect(partition_file(partition))
+    try:
+        row = conn.execute("SELECT fields_json FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        event_rows = conn.execute(
+            "SELECT timestamp, event_type, status, details_json FROM events WHERE job_id = ? ORDER BY timestamp",
+            (job_id,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    events = []
+    for timestamp, event_type, status, details_json in event_rows:
+        event = {"job_id": job_id, "event_type": event_type, "status": status, "timestamp": timestamp}
+        if details_json:
+            event["details"] = json.loads(details_json)
+        events.append(event)
+    return json.loads(row[0]), events
+
+
+async def get_archived_job(job_id: str) -> Optional[Dict[str, str]]:
+    """
+    Get the job hash of an archived job.
+
+    Args:
+        job_id: The job identifier
+
+    Returns:
+        Job hash fields as they were in Redis, or None if not archived
+    """
+    archived = await asyncio.to_thread(_read_job, job_id)
+    return archived[0] if archived else None
+
+
+async def get_archived_job_events(job_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get the events of an archived job.
+
+    Args:
+        job_id: The job identifier
+
+    Returns:
+        Events in chronological order, or None if the job is not archived
+    """
+    archived = await asyncio.to_thread(_read_job, job_id)
+    return archived[1] if archived else None
+
+
+async def _archive_batch(shard: int, job_ids: List[str], cutoff: str) -> int:
+    """Archive the eligible jobs of one batch, all on one shard, and remove them from Redis."""
+    redis = get_shard(shard)
+
+    rows = await read_jobs(job_ids, ["status", "updated_at"])
+    eligible = [
+        job_id for job_id, row in zip(job_ids, rows)
+        if row and row.get("status") in ARCHIVED_STATUSES and row.get("updated_at", cutoff) < cutoff
+    ]
+    if not eligible:
+        return 0
+
+    job_hashes = await read_jobs(eligible)
+    pipe = redis.pipeline(transaction=False)
+    for job_id in eligible:
+        pipe.get(job_events_key(job_id))
+        pipe.lrange(legacy_job_events_key(job_id), 0, -1)
+    results = await pipe.execute()
+
+    by_partition: Dict[str, List[ArchivedJob]] = {}
+    for i, job_id in enumerate(eligible):
+        job_hash = job_hashes[i]
+        log, legacy_events = results[2 * i:2 * i + 2]
+        if not job_hash:
+            continue
+        events = parse_job_events(job_id, log, legacy_events)
+        by_partition.setdefault(job_hash["updated_at"][:7], []).append((job_hash, events))
+
+    for partition, jobs in by_partition.items():
+        await asyncio.to_thread(_write_partition, partition, jobs)
+
+    # Only delete what is safely on disk and unchanged since it was read
+    script = redis.register_script(DELETE_IF_UNCHANGED_SCRIPT)
+    archived = [job_hash for jobs in by_partition.values() for job_hash, _ in jobs]
+    pipe = redis.pipeline(transaction=False)
+    for job_hash in archived:
+        await script(
+            keys=[job_key(job_hash["job_id"]), *job_sub_keys(job_hash["job_id"])],
+            args=[job_hash["updated_at"], to_ms(job_hash["updated_at"])],
+            client=pipe,
+        )
+    deleted = await pipe.execute()
+
+    pipe = redis.pipeline(transaction=False)
+    removed = 0
+    for job_hash, was_deleted in zip(archived, deleted):
+        if was_deleted:
+            pipe.delete(job_events_key(job_hash["job_id"]), legacy_job_events_key(job_hash["job_id"]))
+            removed += 1
+    if removed:
+        await pipe.execute()
+    return removed
+
+
+async def archive_terminal_jobs(
+    older_than_seconds: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    """
+    Move terminal jobs that have not changed for a while to the archive.
+
+    Args:
+        older_than_seconds: Minimum age since the last update, defaults to
+            settings.archive_after_seconds
+        batch_size: Jobs examined per batch, defaults to settings.archive_batch_size
+
+    Returns:
+        Number of jobs archived
+    """
+    older_than_seconds = settings.archive_after_seconds if older_than_seconds is None else older_than_seconds
+    batch_size = batch_size or settings.archive_batch_size
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)).isoformat()
+
+    archived = 0
+    async for shard, job_ids in scan_job_ids(batch_size):
+        archived += await _archive_batch(shard, job_ids, cutoff)
+    return archived
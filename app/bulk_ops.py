@@ -0,0 +1,249 @@
+"""Server-side bulk cancel, retry and requeue of jobs selected by filter."""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.events import EventType, JobEvent, job_event_records
+from app.job_schema import read_jobs, scan_job_ids
+from app.models import BulkJobFilter, JobStatus
+from app.operations import record_progress
+from app.state_machine import Transition, transition_jobs
+
+
+class BulkAction(str, Enum):
+    """Supported bulk actions."""
+
+    CANCEL = "cancel"
+    RETRY = "retry"
+    REQUEUE = "requeue"
+
+
+@dataclass(frozen=True)
+class BulkActionRule:
+    """How a bulk action changes a job."""
+
+    from_statuses: frozenset
+    to_status: str
+    enqueue: bool
+    reset_attempts: bool
+
+
+# Mirrors the UI actions (POST /jobs/{job_id}/cancel and the retry / requeue
+# transitions of POST /jobs/{job_id}/transition); a cancelled running job's
+# outcome is discarded by its worker
+BULK_ACTION_RULES: Dict[BulkAction, BulkActionRule] = {
+    BulkAction.CANCEL: BulkActionRule(
+        from_statuses=frozenset({JobStatus.PENDING.value, JobStatus.RUNNING.value}),
+        to_status=JobStatus.CANCELLED.value,
+        enqueue=False,
+        reset_attempts=False,
+    ),
+    BulkAction.RETRY: BulkActionRule(
+        from_statuses=frozenset({JobStatus.FAILED.value}),
+        to_status=JobStatus.PENDING.value,
+        enqueue=True,
+        reset_attempts=False,
+    ),
+    BulkAction.REQUEUE: BulkActionRule(
+        from_statuses=frozenset({JobStatus.DEAD_LETTERED.value, JobStatus.CANCELLED.value}),
+        to_status=JobStatus.PENDING.value,
+        enqueue=True,
+        reset_attempts=True,
+    ),
+}
+
+# Fields needed to evaluate a BulkJobFilter
+_FILTER_FIELDS = ["status", "task_type", "partition_key", "created_at"]
+
+def _as_utc(dt: datetime) -> datetime:
+    """Treat naive datetimes as UTC so they compare with stored timestamps."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _matches(job_filter: BulkJobFilter, job: Optional[Dict[str, str]]) -> bool:
+    """Check the filter fields of one job against the filter."""
+    if not job or "status" not in job:
+        return False  # Job doesn't exist
+    status, task_type, partition_key, created_at = (job.get(name) for name in _FILTER_FIELDS)
+
+    if job_filter.status and status not in {s.upper() for s in job_filter.status}:
+        return False
+    if job_filter.task_type is not None and task_type != job_filter.task_type:
+        return False
+    if job_filter.partition_key is not None and (partition_key or "") != job_filter.partition_key:
+        return False
+
+    if job_filter.created_after or job_filter.created_before:
+        try:
+            created = datetime.fromisoformat(created_at or "")
+        except ValueError:
+            return False
+        if job_filter.created_after and created < _as_utc(job_filter.created_after):
+            return False
+        if job_filter.created_before and created >= _as_utc(job_filter.created_before):
+            return False
+
+    return True
+
+
+async def _filter_batch(job_filter: BulkJobFilter, job_ids: List[str]) -> List[str]:
+    """Fetch filter fields for a batch of jobs in one round trip and keep matches."""
+    jobs = await read_jobs(job_ids, _FILTER_FIELDS)
+    return [job_id for job_id, job in zip(job_ids, jobs) if _matches(job_filter, job)]
+
+
+async def iter_matching_jobs(
+    job_filter: BulkJobFilter,
+    batch_size: int = 500,
+) -> AsyncIterator[List[str]]:
+    """
+    Yield batches of job IDs matching a filter.
+
+    Explicit ID lists are checked directly; otherwise job hashes are found with
+    an incremental SCAN of each shard so the keyspace is never loaded at once.
+
+    Args:
+        job_filter: Selection criteria
+        batch_size: Approximate number of jobs examined per batch
+
+    Yields:
+        Lists of matching job IDs
+    """
+    if job_filter.job_ids is not None:
+        job_ids = [str(job_id) for job_id in job_filter.job_ids]
+        for i in range(0, len(job_ids), batch_size):
+            matched = await _filter_batch(job_filter, job_ids[i:i + batch_size])
+            if matched:
+                yield matched
+        return
+
+    async for _, job_ids in scan_job_ids(batch_size):
+        matched = await _filter_batch(job_filter, job_ids)
+        if matched:
+            yield matched
+
+
+async def count_matching_jobs(job_filter: BulkJobFilter, batch_size: int = 500) -> int:
+    """
+    Count jobs matching a filter without modifying them (dry run).
+
+    Args:
+        job_filter: Selection criteria
+        batch_size: Approximate number of jobs examined per batch
+
+    Returns:
+        Number of matching jobs
+    """
+    total = 0
+    async for batch in iter_matching_jobs(job_filter, batch_size):
+        total += len(batch)
+    return total
+
+
+async def apply_bulk_action(
+    action: BulkAction,
+    job_ids: List[str],
+    *,
+    reason: Optional[str] = None,
+    actor: str = "bulk",
+    operation_id: Optional[str] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    Apply a bulk action to a batch of jobs in pipelined round trips.
+
+    Each job goes through the state machine (app.state_machine); jobs whose
+    status no longer permits the action are left untouched.
+
+    Args:
+        action: The bulk action
+        job_ids: Job identifiers in this batch
+        reason: Optional reason recorded on each job
+        actor: Who triggered the action
+        operation_id: Optional operation identifier recorded in event details
+
+    Returns:
+        IDs of the jobs that were changed, and of those whose transition
+        failed with an error (the others were left as they are)
+    """
+    rule = BULK_ACTION_RULES[action]
+    details = {"actor": actor, "action": action.value}
+    if reason:
+        details["reason"] = reason
+    if operation_id:
+        details["operation_id"] = operation_id
+
+    fields: Dict[str, Any] = {"last_status_actor": actor}
+    if reason:
+        fields["last_status_change_reason"] = reason
+    if rule.reset_attempts:
+        fields["attempts"] = 0
+
+    transitions = []
+    for job_id in job_ids:
+        if action == BulkAction.CANCEL:
+            events: List[JobEvent] = [(job_id, EventType.CANCELLED, JobStatus.CANCELLED, details)]
+        else:
+            events = [
+                (job_id, EventType.STATUS_CHANGED, JobStatus.PENDING, details),
+                (job_id, EventType.ENQUEUED, JobStatus.PENDING, None),
+            ]
+        transitions.append(Transition(
+            job_id=job_id,
+            steps=[JobStatus(rule.to_status)],
+            expected=[JobStatus(status) for status in sorted(rule.from_statuses)],
+            fields=fields,
+            enqueue=rule.enqueue,
+            events=job_event_records(events),
+        ))
+
+    # Each job changes atomically with its events and workflow (cancelled jobs
+    # skip their dependents), on its own shard; jobs whose status changed
+    # concurrently are refused by the state machine
+    results = await transition_jobs(transitions)
+    changed = [job_id for job_id, result in zip(job_ids, results) if result.ok]
+    failed = []
+    for job_id, result in zip(job_ids, results):
+        if result.error is not None:
+            print(f"Bulk {action.value} of job {job_id} failed: {result.error}")
+            failed.append(job_id)
+
+    return changed, failed
+
+
+async def run_bulk_operation(
+    operation_id: str,
+    action: BulkAction,
+    job_filter: BulkJobFilter,
+    *,
+    reason: Optional[str] = None,
+    batch_size: int = 500,
+) -> None:
+    """
+    Apply a bulk action to all matching jobs, reporting progress per batch.
+
+    Args:
+        operation_id: Operation record to report progress to
+        action: The bulk action
+        job_filter: Selection criteria
+        reason: Optional reason recorded on each job
+        batch_size: Approximate number of jobs processed per batch
+    """
+    async for batch in iter_matching_jobs(job_filter, batch_size):
+        changed, failed = await apply_bulk_action(
+            action,
+            batch,
+            reason=reason,
+            operation_id=operation_id,
+        )
+        await record_progress(
+            operation_id,
+            matched=len(batch),
+            processed=len(batch),
+            succeeded=len(changed),
+            failed=len(failed),
+            skipped=len(batch) - len(changed) - len(failed),
+        )
@@ -0,0 +1,194 @@
+"""Pluggable serialization for payloads, results and events stored in Redis.
+
+Encoded values are text (the Redis client decodes responses to str) in one
+of two formats:
+
+- Legacy: plain JSON, written by the ``json`` codec without compression.
+  Workers and APIs that predate this module can read it.
+- Versioned envelope: ``~1<codec><compression>:<body>``, where ``<codec>`` is
+  ``j`` (json), ``o`` (orjson) or ``m`` (msgpack) and ``<compression>`` is
+  ``n`` (none), ``z`` (zlib), ``s`` (zstd) or ``l`` (lz4). Binary bodies are
+  base64 encoded, which makes them a third larger: a value is only stored
+  compressed when that is still smaller than its uncompressed form, and
+  uncompressed msgpack bodies are usually larger than JSON.
+
+Readers accept every format regardless of their own write settings, so a
+fleet can be rolled out with the default codec first and switched to a
+faster or smaller one once every process understands envelopes. The codecs
+and compressions other than json and zlib need the packages of
+requirements-codecs.txt.
+"""
+
+import base64
+import json
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover - optional dependency
+    lz4_frame = None
+
+
+ENVELOPE_PREFIX = "~1"
+
+# codec name -> (envelope code, dumps to bytes, loads from bytes, text body)
+_CODECS: Dict[str, Tuple[str, Callable[[Any], bytes], Callable[[bytes], Any], bool]] = {
+    "json": (
+        "j",
+        lambda obj: json.dumps(obj, separators=(",", ":")).encode(),
+        lambda data: json.loads(data),
+        True,
+    ),
+}
+if orjson is not None:
+    _CODECS["orjson"] = ("o", orjson.dumps, orjson.loads, True)
+if msgpack is not None:
+    _CODECS["msgpack"] = (
+        "m",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+        False,
+    )
+
+# compression name -> (envelope code, compress, decompress)
+_COMPRESSIONS: Dict[str, Tuple[str, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": ("z", zlib.compress, zlib.decompress),
+}
+if zstandard is not None:
+    _COMPRESSIONS["zstd"] = (
+        "s",
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if lz4_frame is not None:
+    _COMPRESSIONS["lz4"] = ("l", lz4_frame.compress, lz4_frame.decompress)
+
+_LOADS_BY_CODE = {code: loads for code, _, loads, _ in _CODECS.values()}
+_DECOMPRESS_BY_CODE = {code: decompress for code, _, decompress in _COMPRESSIONS.values()}
+
+
+class CodecError(ValueError):
+    """Raised for unknown or unavailable codecs and undecodable values."""
+
+
+class Codec:
+    """Encoder for one codec/compression configuration."""
+
+    def __init__(
+        self,
+        codec: str = "json",
+        compression: Optional[str] = None,
+        compression_threshold: int = 1024,
+    ):
+        if codec not in _CODECS:
+            raise CodecError(f"Codec {codec!r} is unknown or its package is not installed")
+        if compression and compression not in _COMPRESSIONS:
+            raise CodecError(f"Compression {compression!r} is unknown or its package is not installed")
+
+        self.name = codec
+        self._code, self._dumps, _, self._text_body = _CODECS[codec]
+        self._compression = _COMPRESSIONS[compression] if compression else None
+        self._compression_threshold = compression_threshold
+
+    def encode(self, obj: Any) -> str:
+        """
+        Encode a value for storage in Redis.
+
+        Args:
+            obj: JSON-compatible value
+
+        Returns:
+            Encoded text
+        """
+        data = self._dumps(obj)
+        if self._code == "j":
+            # Legacy format, readable by every version
+            text = data.decode()
+        elif self._text_body:
+            text = f"{ENVELOPE_PREFIX}{self._code}n:{data.decode()}"
+        else:
+            text = f"{ENVELOPE_PREFIX}{self._code}n:{base64.b64encode(data).decode('ascii')}"
+
+        if self._compression is not None and len(data) >= self._compression_threshold:
+            compression_code, compress, _ = self._compression
+            body = base64.b64encode(compress(data)).decode("ascii")
+            # Base64 takes back part of the saving; keep whichever is smaller
+            if len(body) + len(ENVELOPE_PREFIX) + 3 < len(text):
+                return f"{ENVELOPE_PREFIX}{self._code}{compression_code}:{body}"
+        return text
+
+
+def decode(text: str) -> Any:
+    """
+    Decode a value written by any codec configuration (or legacy JSON).
+
+    Args:
+        text: Encoded text
+
+    Returns:
+        The decoded value
+
+    Raises:
+        CodecError: If the value uses a codec that is not installed here
+    """
+    if not text.startswith(ENVELOPE_PREFIX):
+        if orjson is not None:
+            try:
+                return orjson.loads(text)
+            except orjson.JSONDecodeError:
+                # json.dumps writes NaN and Infinity, which orjson rejects
+                pass
+        return json.loads(text)
+
+    codec_code, compression_code = text[2], text[3]
+    body = text[5:]
+    loads = _LOADS_BY_CODE.get(codec_code)
+    if loads is None:
+        raise CodecError(f"Value encoded with unavailable codec {codec_code!r}")
+
+    if compression_code == "n":
+        data = body.encode() if codec_code in ("j", "o") else base64.b64decode(body)
+    else:
+        decompress = _DECOMPRESS_BY_CODE.get(compression_code)
+        if decompress is None:
+            raise CodecError(f"Value encoded with unavailable compression {compression_code!r}")
+        data = decompress(base64.b64decode(body))
+    return loads(data)
+
+
+_codec: Optional[Codec] = None
+
+
+def get_codec() -> Codec:
+    """Get the codec configured by settings."""
+    global _codec
+    if _codec is None:
+        _codec = Codec(
+            settings.payload_codec,
+            settings.payload_compression,
+            settings.payload_compression_threshold,
+        )
+    return _codec
+
+
+def encode(obj: Any) -> str:
+    """Encode a value with the configured codec."""
+    return get_codec().encode(obj)
@@ -20,6 +20,24 @@ class Settings(BaseSettings):
     
     # Redis
     redis_url: str = Field(default="redis://localhost:6379/0")
+    redis_sentinels: str | None = Field(default=None)  # "host:port,host:port"; REDIS_URL then only gives credentials and db
+    redis_sentinel_master: str = Field(default="mymaster")
+    redis_max_connections: int = Field(default=50)  # Per process, regular commands
+    redis_blocking_max_connections: int = Field(default=20)  # Per process, blocking reads and subscriptions
+    redis_pool_timeout_seconds: float = Field(default=5.0)  # Wait for a free connection before failing
+    redis_connect_timeout_seconds: float = Field(default=5.0)
+    redis_socket_timeout_seconds: float = Field(default=5.0)  # Read timeout of regular commands
+    redis_blocking_socket_timeout_seconds: float = Field(default=30.0)  # Must exceed the longest BLOCK time
+    redis_health_check_interval_seconds: int = Field(default=30)  # PING idle connections before reuse
+    redis_retry_attempts: int = Field(default=3)  # Retries of commands failing with connection errors
+    redis_retry_backoff_base_ms: int = Field(default=50)
+    redis_retry_backoff_cap_ms: int = Field(default=1000)
+    redis_hiredis: bool = Field(default=True)  # Use the hiredis parser when installed
+    redis_backend: str = Field(default="redis")  # redis, or memory: an in-process test server (see app.memory_backend)
+    memory_block_poll_ms: float = Field(default=10.0)  # How often blocked stream reads re-check the memory backend
+    redis_shards: str | None = Field(default=None)  # Comma-separated URLs of the nodes holding job data (see app.sharding); default: REDIS_URL
+    redis_shard_vnodes: int = Field(default=160)  # Points per node on the consistent-hash ring
+    redis_shards_accept_change: bool = Field(default=False)  # Start with a shard set other than the recorded one (data is not moved)
     
     # Stream names
     job_stream: str = Field(default="dtq:jobs")
@@ -29,11 +47,131 @@ class Settings(BaseSettings):
     # Consumer group
     consumer_group: str = Field(default="dtq:workers")
     
+    # Job queues: each queue is a stream with its own consumer group. Task types
+    # use the default queue (job_stream) unless routed to a named queue
+    job_queue_routes: dict[str, str] = Field(default_factory=dict)  # JSON object: task type -> queue name
+    job_queue_per_task_type: bool = Field(default=False)  # Unrouted task types get a queue of their own
+    worker_queues: str | None = Field(default=None)  # Comma-separated queues a worker serves (default: all)
+    worker_task_types: str | None = Field(default=None)  # Comma-separated task types whose queues a worker serves
+    worker_queue_refresh_seconds: float = Field(default=30.0)  # How often workers serving all queues look for new ones
+    
     # Retry configuration
     max_retries: int = Field(default=3)
     initial_backoff_ms: int = Field(default=1000)
     max_backoff_ms: int = Field(default=300000)  # 5 minutes
     
+    # Serialization of payloads, results and events
+    payload_codec: str = Field(default="json")  # json, orjson, msgpack
+    payload_compression: str | None = Field(default=None)  # zlib, zstd, lz4
+    payload_compression_threshold: int = Field(default=1024)  # Bytes
+    
+    # Job stream entries: "slim" (job ID and routing metadata only) or
+    # "inline" (also the payload, so workers skip reading it from the job hash)
+    stream_payload_mode: str = Field(default="slim")
+    
+    # Job event logging: "full", "transitions", "failures" or "sampled:<percent>"
+    event_verbosity: str = Field(default="full")
+    event_verbosity_by_task_type: dict[str, str] = Field(default_factory=dict)  # JSON object
+    event_retention_seconds: int = Field(default=86400 * 7)
+    event_stream_maxlen: int = Field(default=100000)
+    
+    # Buffered event writer of the API and workers
+    event_sink_enabled: bool = Field(default=True)
+    event_buffer_size: int = Field(default=10000)  # Events held in memory at most
+    event_batch_size: int = Field(default=500)
+    event_flush_interval_ms: int = Field(default=100)
+    event_overflow_policy: str = Field(default="block")  # block, drop_oldest, drop_newest
+    event_block_timeout_ms: int = Field(default=1000)  # Longest a producer waits under "block" before dropping
+    event_late_threshold_ms: int = Field(default=5000)  # Events written later count as late
+    
+    # Memoized task types: jobs whose payload data equals that of a job that
+    # succeeded before complete with its result without running
+    memoize_task_types: dict[str, int] = Field(default_factory=dict)  # JSON object: task type -> result TTL in seconds
+    memoize_max_entries: int = Field(default=100000)  # Results kept in Redis
+    memoize_local_size: int = Field(default=1000)  # Results kept in each worker's memory
+    
+    # Hedged execution: a second worker may run a job of these task types once
+    # it runs longer than the given percentile of the task type's runtimes
+    hedge_task_types: dict[str, float] = Field(default_factory=dict)  # JSON object: task type -> percentile, e.g. 95
+    hedge_min_samples: int = Field(default=100)  # Runtimes recorded before a task type is hedged
+    hedge_min_delay_seconds: float = Field(default=1.0)  # Never hedge jobs running for less
+    hedge_runtime_window: int = Field(default=10000)  # Runtime histograms are halved beyond this many runtimes
+    hedge_stats_refresh_seconds: float = Field(default=60.0)  # How often workers re-read runtime percentiles
+    hedge_poll_interval_seconds: float = Field(default=1.0)  # How often copies of hedged jobs check the job is still theirs
+    
+    # Worker profiling: per-stage timings of job processing, a log of slow
+    # jobs and an on-demand sampling profiler
+    stage_stats_enabled: bool = Field(default=True)
+    stage_stats_flush_seconds: float = Field(default=10.0)  # How often workers add their timings to Redis
+    slow_job_threshold_seconds: float | None = Field(default=10.0)  # Jobs taking longer are logged (unset: none)
+    slow_job_log_size: int = Field(default=1000)  # Slow jobs kept
+    profile_dir: str = Field(default="profiles")  # Where workers write sampling profiles
+    profile_sample_interval_ms: float = Field(default=5.0)
+    profile_max_duration_seconds: float = Field(default=300.0)
+    
+    # Distributed tracing of jobs (W3C trace context, spans exported as OTLP/JSON)
+    tracing_enabled: bool = Field(default=False)
+    trace_sample_ratio: float = Field(default=1.0)  # Share of new traces recorded
+    trace_exporter: str = Field(default="file")  # file, otlp, or a registered exporter
+    trace_file: str = Field(default="traces/spans.jsonl")  # One OTLP/JSON export request per line
+    trace_otlp_endpoint: str = Field(default="http://localhost:4318/v1/traces")  # OTLP/HTTP (JSON)
+    trace_service_name: str | None = Field(default=None)  # Defaults to dtq-api / dtq-worker / dtq-scheduler
+    trace_flush_interval_seconds: float = Field(default=5.0)
+    trace_buffer_size: int = Field(default=10000)  # Finished spans held at most; more are dropped
+    
+    # Map jobs
+    map_chunk_size: int = Field(default=100)  # Items per chunk job
+    
+    # Admission control of job submission (limits are off when unset)
+    admission_max_queue_depth: int | None = Field(default=None)  # Undelivered + unacked job stream entries
+    admission_mode: str = Field(default="reject")  # reject (429) or defer (accept, enqueue later)
+    admission_partition_quota: int | None = Field(default=None)  # Submissions per partition key per window
+    admission_partition_window_seconds: int = Field(default=60)
+    admission_check_interval_ms: int = Field(default=500)  # How often queue depth is re-read
+    admission_max_retry_after_seconds: int = Field(default=300)
+    admission_release_batch_size: int = Field(default=1000)  # Deferred jobs enqueued per maintenance pass
+    
+    # Embedded mode: API, worker, maintenance and scheduler in one process (python -m app.embedded)
+    embedded_host: str = Field(default="127.0.0.1")
+    embedded_port: int = Field(default=8000)
+    
+    # Maintenance service
+    maintenance_interval_seconds: float = Field(default=5.0)
+    stream_trim_enabled: bool = Field(default=True)  # Trim job stream entries acknowledged by all groups
+    stream_trim_approximate: bool = Field(default=True)  # XTRIM MINID ~ (cheaper, may keep a few more entries)
+    job_migration_enabled: bool = Field(default=True)  # Convert legacy job hashes to the compact layout
+    job_migration_batch_size: int = Field(default=500)
+    
+    # Job hash layout: payloads and results longer than this are stored in
+    # separate keys so job hashes keep the listpack encoding (keep at or below
+    # the server's hash-max-listpack-value, 64 by default)
+    job_hash_max_value_bytes: int = Field(default=64)
+    
+    # Cron scheduler
+    schedules_file: str | None = Field(default=None)  # JSON list of schedule templates
+    scheduler_tick_seconds: float = Field(default=1.0)
+    scheduler_lock_ttl_seconds: int = Field(default=15)
+    
+    # Cold storage of terminal jobs (keep archive_after_seconds below
+    # event_retention_seconds so events are archived before they expire)
+    archive_dir: str = Field(default="archive")
+    archive_after_seconds: int = Field(default=86400)
+    archive_interval_seconds: float = Field(default=300.0)
+    archive_batch_size: int = Field(default=500)
+    
+    # In-process cache of GET /jobs/{job_id} responses, invalidated through
+    # keyspace notifications (enabled with CONFIG SET unless configured on the server)
+    job_cache_enabled: bool = Field(default=True)
+    job_cache_size: int = Field(default=10000)
+    job_cache_ttl_seconds: float = Field(default=1.0)  # Also used for all jobs without notifications
+    job_cache_terminal_ttl_seconds: float = Field(default=300.0)
+    job_cache_configure_notifications: bool = Field(default=True)
+    
+    # Job analytics (hourly rollups written by workers)
+    analytics_retention_days: int = Field(default=400)
+    analytics_max_range_days: int = Field(default=92)  # Longest range per query
+    analytics_flush_seconds: float = Field(default=10.0)  # How often workers add buffered attempts to the rollups
+    
     # Frontend origin for CORS (production deployment)
     frontend_origin: str | None = Field(default=None)
 
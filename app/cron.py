@@ -0,0 +1,107 @@
+"""Minimal five-field cron expression parsing (UTC)."""
+
+from datetime import datetime, timedelta
+from typing import List, Set, Tuple
+
+
+# (name, min, max) of each cron field, in expression order
+_FIELDS: List[Tuple[str, int, int]] = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day_of_month", 1, 31),
+    ("month", 1, 12),
+    ("day_of_week", 0, 7),  # 0 and 7 are both Sunday
+]
+
+
+class CronParseError(ValueError):
+    """Raised when a cron expression is invalid."""
+
+
+def _parse_field(spec: str, name: str, low: int, high: int) -> Set[int]:
+    """Parse one field: ``*``, ``*/n``, ``a``, ``a-b``, ``a-b/n`` and comma lists."""
+    values: Set[int] = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            if not step_str.isdigit() or int(step_str) == 0:
+                raise CronParseError(f"Invalid step in {name}: {spec}")
+            step = int(step_str)
+
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            if not (start_str.isdigit() and end_str.isdigit()):
+                raise CronParseError(f"Invalid range in {name}: {spec}")
+            start, end = int(start_str), int(end_str)
+        elif part.isdigit():
+            start = int(part)
+            end = high if step > 1 else start
+        else:
+            raise CronParseError(f"Invalid {name}: {spec}")
+
+        if start < low or end > high or start > end:
+            raise CronParseError(f"{name} out of range: {spec}")
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+class CronExpression:
+    """A parsed cron expression that can compute its next fire time."""
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise CronParseError(f"Expected 5 fields, got {len(parts)}: {expression!r}")
+
+        self.expression = expression
+        parsed = [_parse_field(part, *field) for part, field in zip(parts, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        # Standard cron: if both day fields are restricted, either may match
+        self._day_restricted = parts[2] != "*"
+        self._weekday_restricted = parts[4] != "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.isoweekday() % 7) in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """
+        Compute the first fire time strictly after a given time.
+
+        Args:
+            after: Reference time (timezone-aware, UTC)
+
+        Returns:
+            Next matching minute
+
+        Raises:
+            CronParseError: If the expression never fires (e.g. 31 February)
+        """
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+
+        while dt < limit:
+            if dt.month not in self.months:
+                # Jump to the first minute of next month
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+
+        raise CronParseError(f"Expression never fires: {self.expression!r}")
@@ -0,0 +1,354 @@
+"""Dead letter queue inspection, replay and purge."""
+
+import asyncio
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.codec import decode, encode
+from app.config import settings
+from app.events import EventType, job_event_records
+from app.job_schema import now_ms
+from app.models import JobStatus
+from app.operations import record_progress
+from app.redis_client import get_redis
+from app.state_machine import Transition, transition_jobs
+
+
+# Placeholders used to fold variable parts out of error messages
+_SIGNATURE_PATTERNS = [
+    (re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"), "<uuid>"),
+    (re.compile(r"0x[0-9a-fA-F]+"), "<hex>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\d+(\.\d+)?"), "<n>"),
+]
+_SIGNATURE_MAX_LENGTH = 120
+
+def _replayed_key() -> str:
+    """Set of DLQ entry IDs that have been replayed and may be purged."""
+    return f"{settings.dlq_stream}:replayed"
+
+
+def error_signature(error: str) -> str:
+    """
+    Reduce an error message to a signature for grouping.
+
+    Variable parts (IDs, numbers, quoted values) are replaced by placeholders.
+
+    Args:
+        error: Raw error message
+
+    Returns:
+        Normalized error signature
+    """
+    signature = error.strip().splitlines()[0] if error.strip() else ""
+    for pattern, placeholder in _SIGNATURE_PATTERNS:
+        signature = pattern.sub(placeholder, signature)
+    return signature[:_SIGNATURE_MAX_LENGTH]
+
+
+def _entry_to_dict(entry_id: str, fields: Dict[str, str]) -> Dict[str, Any]:
+    """Convert a raw DLQ stream entry to its API representation."""
+    error = fields.get("error", "")
+    dead_lettered_ms = int(entry_id.split("-", 1)[0])
+    try:
+        payload = decode(fields.get("payload_json", "{}"))
+    except ValueError:
+        payload = None
+
+    return {
+        "entry_id": entry_id,
+        "job_id": fields.get("job_id"),
+        "task_type": fields.get("task_type", ""),
+        "error": error,
+        "error_signature": error_signature(error),
+        "attempts": int(fields.get("attempts", "0")),
+        "dead_lettered_at": datetime.fromtimestamp(dead_lettered_ms / 1000, timezone.utc).isoformat(),
+        "payload": payload,
+    }
+
+
+def _entry_matches(
+    fields: Dict[str, str],
+    task_type: Optional[str],
+    signature: Optional[str],
+) -> bool:
+    if task_type is not None and fields.get("task_type") != task_type:
+        return False
+    if signature is not None and error_signature(fields.get("error", "")) != signature:
+        return False
+    return True
+
+
+async def iter_dlq_chunks(
+    start: str = "-",
+    end: str = "+",
+    chunk_size: int = 1000,
+) -> AsyncIterator[List[Tuple[str, Dict[str, str]]]]:
+    """
+    Stream the DLQ in chunks using XRANGE, never loading it whole.
+
+    Args:
+        start: First entry ID (inclusive), or "-" for the beginning
+        end: Last entry ID (inclusive), or "+" for the end
+        chunk_size: Entries fetched per XRANGE call
+
+    Yields:
+        Lists of (entry_id, fields) tuples
+    """
+    redis = get_redis()
+    cursor = start
+    while True:
+        chunk = await redis.xrange(settings.dlq_stream, min=cursor, max=end, count=chunk_size)
+        if not chunk:
+            break
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        cursor = f"({chunk[-1][0]}"
+
+
+async def list_dlq_entries(
+    cursor: Optional[str] = None,
+    count: int = 50,
+    task_type: Optional[str] = None,
+    signature: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Page through DLQ entries, optionally filtered.
+
+    Args:
+        cursor: Entry ID returned as ``next_cursor`` by the previous page
+        count: Maximum entries per page
+        task_type: Only entries of this task type
+        signature: Only entries with this error signature
+
+    Returns:
+        Dictionary with ``entries`` and ``next_cursor`` (None at the end)
+    """
+    start = f"({cursor}" if cursor else "-"
+    entries: List[Dict[str, Any]] = []
+
+    async for chunk in iter_dlq_chunks(start=start, chunk_size=max(count, 100)):
+        for entry_id, fields in chunk:
+            if _entry_matches(fields, task_type, signature):
+                entries.append(_entry_to_dict(entry_id, fields))
+                if len(entries) == count:
+                    return {"entries": entries, "next_cursor": entry_id}
+
+    return {"entries": entries, "next_cursor": None}
+
+
+async def summarize_dlq(chunk_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Group DLQ entries by task type and error signature.
+
+    Args:
+        chunk_size: Entries fetched per XRANGE call
+
+    Returns:
+        Groups ordered by entry count, largest first
+    """
+    groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    async for chunk in iter_dlq_chunks(chunk_size=chunk_size):
+        for entry_id, fields in chunk:
+            error = fields.get("error", "")
+            key = (fields.get("task_type", ""), error_signature(error))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "task_type": key[0],
+                    "error_signature": key[1],
+                    "count": 0,
+                    "sample_error": error,
+                    "first_entry_id": entry_id,
+                }
+            group["count"] += 1
+            group["last_entry_id"] = entry_id
+
+    return sorted(groups.values(), key=lambda g: g["count"], reverse=True)
+
+
+def _patch_payload(payload_json: str, payload_patch: Optional[Dict[str, Any]]) -> str:
+    """Shallow-merge a patch into the payload's data."""
+    if not payload_patch:
+        return payload_json
+    payload = decode(payload_json)
+    payload["data"] = {**payload.get("data", {}), **payload_patch}
+    return encode(payload)
+
+
+async def _unreplayed(entries: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, Dict[str, str]]]:
+    """Drop entries that an earlier replay already replayed (and kept)."""
+    if not entries:
+        return entries
+    replayed = await get_redis().smismember(_replayed_key(), [entry_id for entry_id, _ in entries])
+    return [entry for entry, is_replayed in zip(entries, replayed) if not is_replayed]
+
+
+async def count_replayable(
+    task_type: Optional[str] = None,
+    signature: Optional[str] = None,
+    chunk_size: int = 1000,
+) -> int:
+    """Count DLQ entries a replay with these filters would consider."""
+    total = 0
+    async for chunk in iter_dlq_chunks(chunk_size=chunk_size):
+        total += len(await _unreplayed(
+            [(entry_id, fields) for entry_id, fields in chunk if _entry_matches(fields, task_type, signature)]
+        ))
+    return total
+
+
+async def replay_dlq(
+    operation_id: str,
+    *,
+    task_type: Optional[str] = None,
+    signature: Optional[str] = None,
+    limit: Optional[int] = None,
+    rate_per_second: float = 100.0,
+    reset_attempts: bool = True,
+    payload_patch: Optional[Dict[str, Any]] = None,
+    delete_after_replay: bool = False,
+    chunk_size: int = 500,
+) -> None:
+    """
+    Replay dead-lettered jobs back onto the job stream at a bounded rate.
+
+    Entries are streamed from the DLQ in chunks. Replayed entries are deleted
+    or remembered for a later purge; remembered entries are not replayed again.
+
+    Args:
+        operation_id: Operation record to report progress to
+        task_type: Only entries of this task type
+        signature: Only entries with this error signature
+        limit: Maximum number of entries to replay
+        rate_per_second: Maximum jobs re-enqueued per second
+        reset_attempts: Reset the attempt counter so jobs get full retries
+        payload_patch: Keys merged into each payload's data
+        delete_after_replay: XDEL entries once replayed instead of marking them
+        chunk_size: Entries read per XRANGE call
+    """
+    redis = get_redis()
+    # Never send more than one second's worth of jobs per pipeline
+    batch_size = max(1, min(chunk_size, int(rate_per_second)))
+    replayed_total = 0
+    details = {"actor": "dlq_replay", "operation_id": operation_id}
+
+    async for chunk in iter_dlq_chunks(chunk_size=chunk_size):
+        matched = await _unreplayed(
+            [(entry_id, fields) for entry_id, fields in chunk if _entry_matches(fields, task_type, signature)]
+        )
+        await record_progress(operation_id, skipped=len(chunk) - len(matched))
+
+        for i in range(0, len(matched), batch_size):
+            if limit is not None and replayed_total >= limit:
+                return
+            batch = matched[i:i + batch_size]
+            if limit is not None:
+                batch = batch[:limit - replayed_total]
+
+            started = time.monotonic()
+            now = now_ms()
+            transitions = []
+            for entry_id, fields in batch:
+                job_id = fields.get("job_id", "")
+                job_fields: Dict[str, Any] = {
+                    "task_type": fields.get("task_type", ""),
+                    "payload_json": _patch_payload(fields.get("payload_json", "{}"), payload_patch),
+                    "last_status_actor": "dlq_replay",
+                }
+                if reset_attempts:
+                    job_fields["attempts"] = 0
+                transitions.append(Transition(
+                    job_id=job_id,
+                    steps=[JobStatus.PENDING],
+                    # Jobs that were already requeued by other means are skipped
+                    expected=[JobStatus.DEAD_LETTERED],
+                    fields=job_fields,
+                    enqueue=True,
+                    task_type=fields.get("task_type", ""),
+                    # Jobs whose hash has been deleted are recreated from the entry
+                    create={"created_at": now, "attempts": 0, "partition_key": fields.get("partition_key", "")},
+                    events=job_event_records(
+                        [(job_id, EventType.ENQUEUED, JobStatus.PENDING, {**details, "dlq_entry_id": entry_id})]
+                    ),
+                ))
+
+            # Jobs are recreated and enqueued on their shards; the DLQ stays on REDIS_URL
+            results = await transition_jobs(transitions)
+
+            replayed_ids = [entry_id for (entry_id, _), result in zip(batch, results) if result.ok]
+            failed = 0
+            for (entry_id, _), result in zip(batch, results):
+                if result.error is not None:
+                    print(f"Replay of DLQ entry {entry_id} failed: {result.error}")
+                    failed += 1
+            pipe = redis.pipeline(transaction=False)
+            # Entries skipped because their job was requeued by other means stay
+            if replayed_ids and delete_after_replay:
+                pipe.xdel(settings.dlq_stream, *replayed_ids)
+            elif replayed_ids:
+                pipe.sadd(_replayed_key(), *replayed_ids)
+            await pipe.execute()
+
+            replayed_total += len(replayed_ids)
+            # Counted per batch so that entries beyond the limit are not reported as matched
+            await record_progress(
+                operation_id,
+                matched=len(batch),
+                processed=len(batch),
+                succeeded=len(replayed_ids),
+                failed=failed,
+                skipped=len(batch) - len(replayed_ids) - failed,
+            )
+
+            # Rate limit: a batch of N jobs takes at least N / rate seconds
+            elapsed = time.monotonic() - started
+            min_duration = len(batch) / rate_per_second
+            if elapsed < min_duration:
+                await asyncio.sleep(min_duration - elapsed)
+
+
+async def purge_dlq(
+    *,
+    replayed_only: bool = False,
+    before: Optional[datetime] = None,
+    max_len: Optional[int] = None,
+) -> int:
+    """
+    Delete processed or old entries from the DLQ.
+
+    Args:
+        replayed_only: Delete entries that were replayed
+        before: Trim entries dead-lettered before this time
+        max_len: Trim the DLQ to at most this many (newest) entries
+
+    Returns:
+        Number of entries deleted
+    """
+    redis = get_redis()
+    deleted = 0
+
+    if replayed_only:
+        cursor = 0
+        while True:
+            cursor, entry_ids = await redis.sscan(_replayed_key(), cursor=cursor, count=1000)
+            if entry_ids:
+                deleted += await redis.xdel(settings.dlq_stream, *entry_ids)
+                await redis.srem(_replayed_key(), *entry_ids)
+            if cursor == 0:
+                break
+
+    if before is not None:
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+        min_id = f"{int(before.timestamp() * 1000)}-0"
+        deleted += await redis.xtrim(settings.dlq_stream, minid=min_id, approximate=False)
+
+    if max_len is not None:
+        deleted += await redis.xtrim(settings.dlq_stream, maxlen=max_len, approximate=False)
+
+    return deleted
@@ -0,0 +1,64 @@
+"""Single-process deployment of the API, a worker, maintenance and the scheduler.
+
+Runs every service in one event loop. With the memory test backend it needs
+no Redis server, for trying the system out (requirements-dev.txt):
+
+    REDIS_BACKEND=memory python -m app.embedded
+
+With the Redis backend it is a compact deployment for a single box. The API
+listens on EMBEDDED_HOST:EMBEDDED_PORT; stop with SIGINT or SIGTERM.
+"""
+
+import asyncio
+
+import uvicorn
+
+from app.analytics import attempt_rollups
+from app.api.main import app
+from app.config import settings
+from app.profiling import control_listener, stage_stats
+from app.redis_client import RedisClient
+from app.sharding import check_shard_set, shard_count
+from app.tracing import tracer
+from app.worker.cron_scheduler import scheduler_loop
+from app.worker.maintenance import maintenance_loop
+from app.worker.worker_main import CONSUMER_NAME, worker_loop
+
+
+async def main() -> None:
+    """Embedded mode entrypoint."""
+    print(f"Starting embedded DTQ ({settings.redis_backend} backend) on {settings.embedded_host}:{settings.embedded_port}")
+
+    await check_shard_set()
+
+    # The API's lifespan runs the event sink, job cache and tracer for all services
+    if settings.tracing_enabled:
+        tracer.start("dtq-embedded")
+    if settings.stage_stats_enabled:
+        stage_stats.start()
+    attempt_rollups.start()
+
+    shutdown_event = asyncio.Event()
+    services = [
+        *(asyncio.create_task(worker_loop(shard)) for shard in range(shard_count())),
+        asyncio.create_task(maintenance_loop(shutdown_event)),
+        asyncio.create_task(scheduler_loop(shutdown_event)),
+        asyncio.create_task(control_listener(CONSUMER_NAME)),
+    ]
+
+    # uvicorn handles SIGINT/SIGTERM and returns once the API has shut down
+    server = uvicorn.Server(uvicorn.Config(app, host=settings.embedded_host, port=settings.embedded_port))
+    try:
+        await server.serve()
+    finally:
+        shutdown_event.set()
+        for task in services:
+            task.cancel()
+        await asyncio.gather(*services, return_exceptions=True)
+        await stage_stats.stop()
+        await attempt_rollups.stop()
+        await RedisClient.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""In-process buffered writer that takes job event logging off the critical path."""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+# Writes a batch of records; dropped/late are counts to add to persistent metrics
+EventWriter = Callable[..., Awaitable[None]]
+
+
+class EventSink:
+    """
+    Bounded buffer of event records flushed in batches by a background task.
+
+    A batch is written once ``batch_size`` records are buffered or
+    ``flush_interval_seconds`` after the previous flush, whichever comes
+    first. When the buffer is full, ``overflow_policy`` decides whether
+    producers wait for space (``block``) or records are dropped
+    (``drop_oldest`` / ``drop_newest``). Blocked producers wait at most
+    ``block_timeout_seconds`` and then drop their records; until a batch is
+    written again, producers finding the buffer full drop theirs at once.
+    """
+
+    def __init__(
+        self,
+        writer: EventWriter,
+        *,
+        max_buffer: int = 10000,
+        batch_size: int = 500,
+        flush_interval_seconds: float = 0.1,
+        overflow_policy: str = "block",
+        late_threshold_seconds: float = 5.0,
+        block_timeout_seconds: float = 1.0,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown event overflow policy: {overflow_policy}")
+
+        self._writer = writer
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.overflow_policy = overflow_policy
+        self.late_threshold_seconds = late_threshold_seconds
+        self.block_timeout_seconds = block_timeout_seconds
+
+        self._buffer: Deque[Tuple[float, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._block_timed_out = False  # Set until the next successful write
+
+        # Counters since start; dropped/late not yet written are kept separately
+        self.written = 0
+        self.dropped = 0
+        self.late = 0
+        self.write_errors = 0
+        self._unreported_dropped = 0
+
+    @property
+    def running(self) -> bool:
+        """Whether the background flusher is running."""
+        return self._task is not None and not self._stopping
+
+    def start(self) -> None:
+        """Start the background flusher (must be called from a running event loop)."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flusher after writing everything still buffered."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def put(self, records: List[Any]) -> None:
+        """
+        Buffer records for writing.
+
+        Args:
+            records: Event records in the format accepted by the writer
+        """
+        for record in records:
+            if len(self._buffer) >= self.max_buffer:
+                if self.overflow_policy == "drop_newest":
+                    self._record_drops(1)
+                    continue
+                if self.overflow_policy == "drop_oldest":
+                    self._buffer.popleft()
+                    self._record_drops(1)
+                elif not await self._wait_for_space():
+                    self._record_drops(1)
+                    continue
+            self._buffer.append((time.monotonic(), record))
+
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Write all buffered records now."""
+        async with self._flush_lock:
+            while self._buffer or self._unreported_dropped:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._space_available.set()
+
+                now = time.monotonic()
+                late = sum(1 for queued_at, _ in batch if now - queued_at > self.late_threshold_seconds)
+                dropped, self._unreported_dropped = self._unreported_dropped, 0
+                try:
+                    await self._writer([record for _, record in batch], dropped=dropped, late=late)
+                except Exception as e:
+                    print(f"Error writing job events: {e}")
+                    self.write_errors += 1
+                    # Put the batch back in front, as far as the buffer has room
+                    room = max(self.max_buffer - len(self._buffer), 0)
+                    self._buffer.extendleft(reversed(batch[:room]))
+                    self._unreported_dropped += dropped
+                    self._record_drops(len(batch) - min(room, len(batch)))
+                    return
+
+                self.written += len(batch)
+                self.late += late
+                self._block_timed_out = False
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process's sink."""
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "late": self.late,
+            "write_errors": self.write_errors,
+        }
+
+    async def _wait_for_space(self) -> bool:
+        """Backpressure: wait until the flusher made room, for a limited time.
+
+        Returns:
+            Whether there is room in the buffer
+        """
+        if self._block_timed_out:
+            # The writer is failing; do not stall every producer again
+            return False
+        deadline = time.monotonic() + self.block_timeout_seconds
+        while len(self._buffer) >= self.max_buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._block_timed_out = True
+                return False
+            self._space_available.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space_available.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def _record_drops(self, count: int) -> None:
+        self.dropped += count
+        self._unreported_dropped += count
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error in event sink: {e}")
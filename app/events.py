@@ -1,12 +1,40 @@
-"""Job lifecycle event logging."""
+"""Job lifecycle event logging.
 
+Each recorded event is added to the events stream (of the job's shard, see
+app.sharding) and appended to the job's compact event log ``job:{id}:log``, a string of newline-terminated
+encoded ``[timestamp, event_type, status, details]`` records. Jobs created
+before the compact log existed keep their events in the list
+``job:{id}:events``, which is still read.
+
+How much is recorded is configured per task type (see ``event_verbosity``):
+
+- ``full``: every event
+- ``transitions``: events that change or end a job's status (no LEASED,
+  HEDGED or ENQUEUED)
+- ``failures``: only FAILED, RETRIED, DEAD_LETTERED, CANCELLED and SKIPPED
+- ``sampled:<percent>``: full history for that share of jobs (picked by job
+  ID, so a sampled job's history is complete), failures for the others
+
+Processes that start ``event_sink`` (the API and workers) buffer events and
+write them in batches in the background; elsewhere events are written
+immediately. Status transitions write their events atomically with the
+transition itself (see app.state_machine).
+"""
+
+import asyncio
+import zlib
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Any, Dict, Optional
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from app.codec import decode, encode
 from app.config import settings
+from app.event_sink import EventSink
 from app.models import JobStatus
+from app.profiling import time_stage
 from app.redis_client import get_redis
+from app.sharding import get_redis_for, get_shard, shard_index
 
 
 class EventType(str, Enum):
@@ -22,82 +50,284 @@ class EventType(str, Enum):
     DEAD_LETTERED = "DEAD_LETTERED"
     CANCELLED = "CANCELLED"
     STATUS_CHANGED = "STATUS_CHANGED"
+    SKIPPED = "SKIPPED"
+    DEFERRED = "DEFERRED"
+    CACHE_HIT = "CACHE_HIT"  # Completed with a memoized result (see app.memoization)
+    HEDGED = "HEDGED"  # Second copy of a straggling job started (see app.hedging)
 
 
-async def append_job_event(
-    job_id: str,
-    event_type: EventType,
-    status: JobStatus,
-    details: Optional[Dict[str, Any]] = None,
-) -> None:
+# (job_id, event_type, status, details) as accepted by append_job_events
+JobEvent = Tuple[str, EventType, JobStatus, Optional[Dict[str, Any]]]
+
+# JobEvent with the time it happened prepended, as buffered and written
+EventRecord = Tuple[str, str, EventType, JobStatus, Optional[Dict[str, Any]]]
+
+# Events that change or end a job's status
+TRANSITION_EVENTS = frozenset(EventType) - {EventType.LEASED, EventType.HEDGED, EventType.ENQUEUED}
+
+# Events that are recorded at every verbosity level
+FAILURE_EVENTS = frozenset({
+    EventType.FAILED,
+    EventType.RETRIED,
+    EventType.DEAD_LETTERED,
+    EventType.CANCELLED,
+    EventType.SKIPPED,
+})
+
+
+def job_events_key(job_id: str) -> str:
+    """Key of a job's compact event log."""
+    return f"job:{job_id}:log"
+
+
+def legacy_job_events_key(job_id: str) -> str:
+    """Key of a job's event list written before the compact log existed."""
+    return f"job:{job_id}:events"
+
+
+@lru_cache(maxsize=None)
+def _parse_verbosity(level: str) -> Tuple[str, int]:
+    """Parse a verbosity level into (level, sampled percent)."""
+    if level in ("full", "transitions", "failures"):
+        return level, 0
+    if level.startswith("sampled:"):
+        try:
+            percent = int(level[len("sampled:"):])
+        except ValueError:
+            percent = -1
+        if 0 <= percent <= 100:
+            return "sampled", percent
+    raise ValueError(f"Invalid event verbosity: {level!r}")
+
+
+def should_record_event(job_id: str, event_type: EventType, task_type: Optional[str] = None) -> bool:
     """
-    Append a job lifecycle event to both global stream and per-job list.
+    Decide whether an event is recorded under the configured verbosity.
 
     Args:
         job_id: The job identifier
         event_type: Type of event
-        status: Job status after this event
-        details: Optional event details (error message, worker id, etc.)
+        task_type: Task type of the job, if known (otherwise the default
+            verbosity applies)
+
+    Returns:
+        True if the event should be written
+    """
+    level = settings.event_verbosity_by_task_type.get(task_type or "", settings.event_verbosity)
+    level, percent = _parse_verbosity(level)
+
+    if level == "sampled":
+        level = "full" if zlib.crc32(job_id.encode()) % 100 < percent else "failures"
+    if level == "full":
+        return True
+    if level == "transitions":
+        return event_type in TRANSITION_EVENTS
+    return event_type in FAILURE_EVENTS
+
+
+def serialize_job_event(record: EventRecord) -> Tuple[Dict[str, str], str]:
     """
-    redis = await get_redis()
-    now = datetime.now(timezone.utc)
+    Serialize one event for storage.
+
+    Args:
+        record: The event record
+
+    Returns:
+        (fields of the events stream entry, line of the per-job compact log)
+    """
+    timestamp, job_id, event_type, status, details = record
 
     # Prepare event data
     event_data = {
         "job_id": job_id,
         "event_type": event_type.value,
         "status": status.value,
-        "timestamp": now.isoformat(),
+        "timestamp": timestamp,
     }
 
     if details:
-        import json
+        event_data["details"] = encode(details)
+
+    return event_data, encode([timestamp, event_type.value, status.value, details or None]) + "\n"
 
-        event_data["details"] = json.dumps(details)
 
-    # Add to global events stream
-    await redis.xadd(
+def _queue_job_event(pipe: Any, record: EventRecord) -> None:
+    """Queue the commands for one event on a Redis pipeline."""
+    event_data, log_line = serialize_job_event(record)
+
+    # Add to the events stream
+    pipe.xadd(
         settings.job_events_stream,
         event_data,
-        maxlen=100000,  # Keep last 100k events
+        maxlen=settings.event_stream_maxlen,
+        approximate=True,
     )
 
-    # Add to per-job events list
-    job_events_key = f"job:{job_id}:events"
-    import json
+    # Append to the per-job compact log; the TTL is set once, on the first event
+    log_key = job_events_key(record[1])
+    pipe.append(log_key, log_line)
+    pipe.expire(log_key, settings.event_retention_seconds, nx=True)
 
-    event_json = json.dumps(event_data)
-    await redis.rpush(job_events_key, event_json)
-    await redis.expire(job_events_key, 86400 * 7)  # Keep for 7 days
 
+async def write_job_events(records: List[EventRecord], *, dropped: int = 0, late: int = 0) -> None:
+    """
+    Write event records in a single pipelined round trip.
 
-async def get_job_events(job_id: str) -> list[Dict[str, Any]]:
+    Args:
+        records: Event records
+        dropped: Events dropped by the event sink since its last write
+        late: Events in this batch written later than the lateness threshold
     """
-    Retrieve all events for a specific job.
+    # Each event goes to the shard of its job (see app.sharding), one pipeline per shard
+    pipes: Dict[int, Any] = {}
+    for record in records:
+        shard = shard_index(record[1])
+        if shard not in pipes:
+            pipes[shard] = get_shard(shard).pipeline(transaction=False)
+        _queue_job_event(pipes[shard], record)
+    if dropped or late:
+        # The counters live on REDIS_URL, usually written to already
+        primary = get_redis()
+        pipe = next((pipe for shard, pipe in pipes.items() if get_shard(shard) is primary), None)
+        if pipe is None:
+            pipe = pipes[-1] = primary.pipeline(transaction=False)
+        if dropped:
+            pipe.incrby("metrics:events_dropped_total", dropped)
+        if late:
+            pipe.incrby("metrics:events_late_total", late)
+    await asyncio.gather(*(pipe.execute() for pipe in pipes.values()))
+
+
+event_sink = EventSink(
+    write_job_events,
+    max_buffer=settings.event_buffer_size,
+    batch_size=settings.event_batch_size,
+    flush_interval_seconds=settings.event_flush_interval_ms / 1000,
+    overflow_policy=settings.event_overflow_policy,
+    late_threshold_seconds=settings.event_late_threshold_ms / 1000,
+    block_timeout_seconds=settings.event_block_timeout_ms / 1000,
+)
+
+
+async def append_job_event(
+    job_id: str,
+    event_type: EventType,
+    status: JobStatus,
+    details: Optional[Dict[str, Any]] = None,
+    *,
+    task_type: Optional[str] = None,
+) -> None:
+    """
+    Append a job lifecycle event to both the events stream and per-job log.
 
     Args:
         job_id: The job identifier
+        event_type: Type of event
+        status: Job status after this event
+        details: Optional event details (error message, worker id, etc.)
+        task_type: Task type of the job, selects the event verbosity
+    """
+    await append_job_events([(job_id, event_type, status, details)], task_type=task_type)
+
+
+def job_event_records(events: Iterable[JobEvent], *, task_type: Optional[str] = None) -> List[EventRecord]:
+    """
+    Timestamp the events that the configured verbosity records.
+
+    Args:
+        events: Iterable of (job_id, event_type, status, details) tuples
+        task_type: Task type of the jobs, if they all share one
 
     Returns:
-        List of events in chronological order
+        Records of the events to write
+    """
+    with time_stage("events"):
+        timestamp = datetime.now(timezone.utc).isoformat()
+        return [
+            (timestamp, job_id, event_type, status, details)
+            for job_id, event_type, status, details in events
+            if should_record_event(job_id, event_type, task_type)
+        ]
+
+
+async def append_job_events(events: Iterable[JobEvent], *, task_type: Optional[str] = None) -> None:
     """
-    redis = await get_redis()
-    job_events_key = f"job:{job_id}:events"
+    Append several job lifecycle events.
+
+    The events are handed to the event sink if it is running, otherwise they
+    are written in a single pipelined round trip.
+
+    Args:
+        events: Iterable of (job_id, event_type, status, details) tuples
+        task_type: Task type of the jobs, if they all share one; selects the
+            event verbosity
+    """
+    records = job_event_records(events, task_type=task_type)
+    if not records:
+        return
+
+    if event_sink.running:
+        await event_sink.put(records)
+    else:
+        await write_job_events(records)
 
-    events_json = await redis.lrange(job_events_key, 0, -1)
 
-    import json
+def parse_job_events(job_id: str, log: Optional[str], legacy_events: List[str]) -> List[Dict[str, Any]]:
+    """
+    Parse a job's stored events.
+
+    Args:
+        job_id: The job identifier
+        log: Content of the compact event log, if any
+        legacy_events: Entries of the legacy event list
 
+    Returns:
+        List of events in chronological order
+    """
     events = []
-    for event_json in events_json:
+    for record in (log or "").splitlines():
+        try:
+            timestamp, event_type, status, details = decode(record)
+        except ValueError:
+            continue
+        event = {"job_id": job_id, "event_type": event_type, "status": status, "timestamp": timestamp}
+        if details:
+            event["details"] = details
+        events.append(event)
+
+    for event_json in legacy_events:
         try:
-            event = json.loads(event_json)
-            events.append(event)
-        except json.JSONDecodeError:
+            event = decode(event_json)
+            if "details" in event:
+                event["details"] = decode(event["details"])
+        except ValueError:
             continue
+        events.append(event)
 
     # Sort by timestamp
     events.sort(key=lambda e: e.get("timestamp", ""))
 
     return events
 
+
+async def get_job_events(job_id: str) -> list[Dict[str, Any]]:
+    """
+    Retrieve all events for a specific job.
+
+    Args:
+        job_id: The job identifier
+
+    Returns:
+        List of events in chronological order
+    """
+    # Make events buffered by this process visible
+    if event_sink.running:
+        await event_sink.flush()
+
+    redis = get_redis_for(job_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.get(job_events_key(job_id))
+    pipe.lrange(legacy_job_events_key(job_id), 0, -1)
+    log, legacy_events = await pipe.execute()
+
+    return parse_job_events(job_id, log, legacy_events)
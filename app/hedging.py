@@ -0,0 +1,139 @@
+"""Hedged execution of straggling jobs.
+
+For task types in ``hedge_task_types`` (task type -> runtime percentile), a
+worker whose job runs longer than that percentile of the task type's
+successful runtimes adds a ``hedge`` entry for the job to its queue. The
+worker reading it runs a second copy of the job as its hedge owner (see
+app.state_machine.hedge_job) while the first keeps running. Whichever copy
+succeeds first completes the job; the other notices the job is no longer
+held by it and cancels its handler. A copy failing while the other still
+runs withdraws, leaving the job to the other copy.
+
+Runtimes are kept per task type in ``runtime:{task_type}``, a histogram over
+``app.analytics.RUNTIME_BUCKETS`` updated by workers after every success and
+halved once it holds ``hedge_runtime_window`` runtimes, so recent runtimes
+dominate.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from app.analytics import RUNTIME_BUCKETS, runtime_bucket
+from app.config import settings
+from app.job_schema import read_jobs
+from app.redis_client import get_redis
+from app.sharding import get_redis_for
+
+
+HEDGE_FIELD = "hedge"  # Job stream entry field marking a hedge request
+TOTAL_FIELD = "n"  # Histogram field holding the number of runtimes
+
+
+# KEYS[1]: runtime histogram; ARGV: bucket index, window
+RECORD_RUNTIME_SCRIPT = """
+local total = redis.call('HINCRBY', KEYS[1], 'n', 1)
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+if total <= tonumber(ARGV[2]) then
+    return total
+end
+-- Halve every bucket so older runtimes weigh less
+local fields = redis.call('HGETALL', KEYS[1])
+total = 0
+for i = 1, #fields, 2 do
+    if fields[i] ~= 'n' then
+        local count = math.floor(tonumber(fields[i + 1]) / 2)
+        if count > 0 then
+            redis.call('HSET', KEYS[1], fields[i], count)
+            total = total + count
+        else
+            redis.call('HDEL', KEYS[1], fields[i])
+        end
+    end
+end
+redis.call('HSET', KEYS[1], 'n', total)
+return total
+"""
+
+
+def runtime_stats_key(task_type: str) -> str:
+    """Key of a task type's runtime histogram."""
+    return f"runtime:{task_type}"
+
+
+def is_hedged(task_type: Optional[str]) -> bool:
+    """Whether straggling jobs of a task type are hedged."""
+    return bool(task_type) and task_type in settings.hedge_task_types
+
+
+async def record_runtime(task_type: str, runtime_seconds: float) -> None:
+    """
+    Add the runtime of a successful job to its task type's histogram.
+
+    Args:
+        task_type: Task type of the job
+        runtime_seconds: Handler runtime
+    """
+    redis = get_redis()
+    script = redis.register_script(RECORD_RUNTIME_SCRIPT)
+    await script(
+        keys=[runtime_stats_key(task_type)],
+        args=[runtime_bucket(runtime_seconds), settings.hedge_runtime_window],
+    )
+
+
+# task type -> (hedge delay or None, expires at (monotonic))
+_delays: Dict[str, Tuple[Optional[float], float]] = {}
+
+
+async def hedge_delay(task_type: Optional[str]) -> Optional[float]:
+    """
+    Runtime after which a job of a task type is hedged.
+
+    Read from the task type's histogram at most every
+    hedge_stats_refresh_seconds.
+
+    Args:
+        task_type: The task type
+
+    Returns:
+        Seconds (the configured percentile, at least hedge_min_delay_seconds),
+        or None if the task type is not hedged or has too few runtimes
+    """
+    if not is_hedged(task_type):
+        return None
+    cached = _delays.get(task_type)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    histogram = await get_redis().hgetall(runtime_stats_key(task_type))
+    total = int(histogram.pop(TOTAL_FIELD, 0))
+    delay = None
+    if total >= settings.hedge_min_samples:
+        target = total * settings.hedge_task_types[task_type] / 100
+        seen = 0
+        for index in sorted(int(bucket) for bucket in histogram):
+            seen += int(histogram[str(index)])
+            if seen >= target:
+                delay = max(RUNTIME_BUCKETS[index], settings.hedge_min_delay_seconds)
+                break
+    _delays[task_type] = (delay, time.monotonic() + settings.hedge_stats_refresh_seconds)
+    return delay
+
+
+async def request_hedge(stream: str, fields: Dict[str, str]) -> None:
+    """
+    Ask another worker to run a second copy of a job.
+
+    Args:
+        stream: Stream key of the job's queue
+        fields: Fields of the job's stream entry
+    """
+    await get_redis_for(fields["job_id"]).xadd(stream, {**fields, HEDGE_FIELD: "true"})
+
+
+async def holds_job(job_id: str, worker_id: str) -> bool:
+    """Whether a job is still running with a copy held by a worker."""
+    job = (await read_jobs([job_id], ["status", "lease_owner", "hedge_owner"]))[0]
+    if job is None or job.get("status") != "RUNNING":
+        return False
+    return worker_id in (job.get("lease_owner"), job.get("hedge_owner"))
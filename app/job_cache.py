@@ -0,0 +1,219 @@
+"""In-process LRU cache of serialized GET /jobs/{job_id} responses.
+
+Entries are invalidated through Redis keyspace notifications on ``job:*``
+hashes, so any change made by any process (workers, other API instances, Lua
+scripts) evicts the cached response. Terminal jobs rarely change and are kept
+for ``job_cache_terminal_ttl_seconds``. When notifications are unavailable
+every entry falls back to the short ``job_cache_ttl_seconds``.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.sharding import get_blocking_shard, get_shard, shard_count
+
+
+TERMINAL_STATUSES = frozenset({"SUCCEEDED", "FAILED", "DEAD_LETTERED", "CANCELLED"})
+
+# Notification classes needed: keyspace (K), generic (g: DEL), hash (h), expired (x)
+_REQUIRED_NOTIFY_FLAGS = "Kghx"
+
+
+def compute_etag(body: bytes) -> str:
+    """Strong ETag of a response body."""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class JobCache:
+    """LRU of (body, ETag) per job ID, invalidated by keyspace notifications."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, terminal_ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.terminal_ttl_seconds = terminal_ttl_seconds
+
+        # job_id -> (body, etag, expires at (monotonic))
+        self._entries: "OrderedDict[str, Tuple[bytes, str, float]]" = OrderedDict()
+        # job_id -> token of the load in progress; invalidation discards it so
+        # a response read before a change is never cached after it
+        self._loading: Dict[str, int] = {}
+        self._next_token = 0
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed: Set[int] = set()  # Shards whose notifications are being received
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def running(self) -> bool:
+        """Whether the cache is in use."""
+        return self._listener is not None
+
+    @property
+    def _invalidation_active(self) -> bool:
+        # Changes to jobs on a shard not listened to would go unnoticed
+        return len(self._subscribed) == shard_count()
+
+    def start(self) -> None:
+        """Start the invalidation listener (must be called from a running event loop)."""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Stop the invalidation listener and drop all entries."""
+        if self._listener is None:
+            return
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+        self._listener = None
+        self.clear()
+
+    def get(self, job_id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Get a cached response.
+
+        Args:
+            job_id: The job identifier
+
+        Returns:
+            (body, etag), or None on a miss
+        """
+        if not self.running:
+            return None
+        entry = self._entries.get(job_id)
+        if entry is None or entry[2] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(job_id)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def begin_load(self, job_id: str) -> int:
+        """Register a load from Redis; pass the returned token to put()."""
+        if len(self._loading) >= self.max_entries:
+            self._loading.clear()  # Loads that never completed (e.g. unknown jobs)
+        self._next_token += 1
+        self._loading[job_id] = self._next_token
+        return self._next_token
+
+    def put(self, job_id: str, token: int, body: bytes, etag: str, job_status: str) -> None:
+        """
+        Cache a response unless the job changed since begin_load().
+
+        Args:
+            job_id: The job identifier
+            token: Token returned by begin_load()
+            body: Serialized response
+            etag: ETag of the body
+            job_status: Status of the job, selects the TTL
+        """
+        if not self.running or self._loading.get(job_id) != token:
+            return
+        del self._loading[job_id]
+
+        ttl = self.ttl_seconds
+        if self._invalidation_active and job_status in TERMINAL_STATUSES:
+            ttl = self.terminal_ttl_seconds
+        self._entries[job_id] = (body, etag, time.monotonic() + ttl)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, job_id: str) -> None:
+        """Drop a job's cached response."""
+        self.invalidations += 1
+        self._entries.pop(job_id, None)
+        self._loading.pop(job_id, None)
+
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        self._entries.clear()
+        self._loading.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process's cache."""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "invalidation_active": int(self._invalidation_active),
+        }
+
+    async def _enable_notifications(self, redis: Any) -> bool:
+        """Make sure a Redis node publishes the keyspace notifications we need."""
+        if not settings.job_cache_configure_notifications:
+            return True  # Configured on the server by the operator
+        try:
+            config = await redis.config_get("notify-keyspace-events")
+            flags = config.get("notify-keyspace-events", "")
+            missing = "".join(
+                flag for flag in _REQUIRED_NOTIFY_FLAGS
+                if flag not in flags and not (flag != "K" and "A" in flags)
+            )
+            if missing:
+                await redis.config_set("notify-keyspace-events", flags + missing)
+        except Exception as e:
+            print(f"Job cache: keyspace notifications unavailable ({e}), using short TTLs only")
+            return False
+        return True
+
+    async def _listen(self) -> None:
+        # Job hashes change on their shards (see app.sharding)
+        await asyncio.gather(*(self._listen_shard(shard) for shard in range(shard_count())))
+
+    async def _listen_shard(self, shard: int) -> None:
+        if not await self._enable_notifications(get_shard(shard)):
+            return
+
+        while True:
+            redis = get_blocking_shard(shard)
+            db = redis.connection_pool.connection_kwargs.get("db", 0)
+            prefix = f"__keyspace@{db}__:"
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{prefix}job:*")
+                self._subscribed.add(shard)
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    key = message["channel"][len(prefix):]
+                    # Skip per-job sub-keys such as job:{id}:log
+                    if key.count(":") == 1:
+                        self.invalidate(key.split(":", 1)[1])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job cache invalidation listener error: {e}")
+            finally:
+                # Changes may be missed while not subscribed
+                self._subscribed.discard(shard)
+                self.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+
+job_cache = JobCache(
+    max_entries=settings.job_cache_size,
+    ttl_seconds=settings.job_cache_ttl_seconds,
+    terminal_ttl_seconds=settings.job_cache_terminal_ttl_seconds,
+)
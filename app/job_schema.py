@@ -0,0 +1,508 @@
+"""Storage layout of job hashes.
+
+Job hashes are written in a compact layout (version 2) that keeps them in
+Redis' memory-efficient listpack encoding:
+
+- short field codes instead of field names (``FIELD_CODES``)
+- timestamps as epoch milliseconds instead of ISO-8601 strings
+- no placeholders: unset fields (e.g. a released lease) are deleted
+- the job ID is not stored, it is part of the key
+- payloads and results longer than ``job_hash_max_value_bytes`` live in
+  ``job:{id}:payload`` / ``job:{id}:result`` instead of the hash
+
+The task type stays stored next to the payload: Lua scripts route jobs by it
+and payloads may be compressed or binary-encoded (see app.codec).
+
+Readers go through ``decode_job_hash`` / ``read_job`` / ``read_jobs`` (or
+the Lua helpers in ``JOB_HASH_LUA``), which accept both layouts and return
+the original field names and value formats, so hashes written before the
+compact layout keep working until the maintenance service migrates them
+(``migrate_job_hashes``).
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.sharding import get_shard, pipeline_by_shard, shard_count
+
+
+SCHEMA_VERSION = "2"
+VERSION_FIELD = "v"
+
+# Field name -> compact field code
+FIELD_CODES: Dict[str, str] = {
+    "status": "s",
+    "created_at": "c",
+    "updated_at": "u",
+    "attempts": "a",
+    "partition_key": "k",
+    "task_type": "t",
+    "payload_json": "p",
+    "result": "r",
+    "lease_owner": "lo",
+    "lease_expires_at": "le",
+    "hedge_owner": "ho",
+    "workflow_id": "w",
+    "workflow_node": "wn",
+    "parent_job_id": "pj",
+    "next_attempt_at": "n",
+    "last_status_change_reason": "sr",
+    "last_status_actor": "sa",
+    "traceparent": "tp",
+    "deferred": "df",
+}
+FIELD_NAMES: Dict[str, str] = {code: name for name, code in FIELD_CODES.items()}
+
+# ISO-8601 in the legacy layout, epoch milliseconds in the compact one
+TIME_FIELDS = frozenset({"created_at", "updated_at", "next_attempt_at"})
+
+# Fields stored in a separate key when too long for listpack encoding -> key suffix
+LARGE_FIELDS: Dict[str, str] = {"payload_json": "payload", "result": "result"}
+
+
+def job_key(job_id: str) -> str:
+    """Key of a job hash."""
+    return f"job:{job_id}"
+
+
+def large_value_key(job_id: str, field: str) -> str:
+    """Key holding a large payload_json or result of a job."""
+    return f"job:{job_id}:{LARGE_FIELDS[field]}"
+
+
+def job_sub_keys(job_id: str) -> List[str]:
+    """Keys holding large values of a job, to delete along with its hash."""
+    return [large_value_key(job_id, field) for field in LARGE_FIELDS]
+
+
+def to_ms(value: Any) -> str:
+    """Epoch milliseconds of a datetime, ISO-8601 string or number of seconds."""
+    if isinstance(value, str):
+        if value.isdigit():
+            return value  # Already milliseconds
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return str(round(value.timestamp() * 1000))
+    return str(round(float(value) * 1000))
+
+
+def now_ms() -> str:
+    """Current time in epoch milliseconds."""
+    return to_ms(datetime.now(timezone.utc))
+
+
+def from_ms(value: str) -> str:
+    """ISO-8601 string of epoch milliseconds (legacy values are returned as is)."""
+    if not value.isdigit():
+        return value
+    return datetime.fromtimestamp(int(value) / 1000, timezone.utc).isoformat(timespec="microseconds")
+
+
+def _encode_value(name: str, value: Any) -> str:
+    if name in TIME_FIELDS:
+        return to_ms(value)
+    if name == "lease_expires_at":
+        return to_ms(float(value))
+    return str(value)
+
+
+def encode_job_fields(fields: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Encode job field values for the compact layout, keeping field names.
+
+    Used for fields passed to Lua scripts, which map names to codes with job_set.
+
+    Args:
+        fields: Field names and values (timestamps as datetime or ISO-8601);
+            None deletes a field
+
+    Returns:
+        Encoded values by field name ("" for deleted fields)
+    """
+    return {name: "" if value is None or value == "" else _encode_value(name, value) for name, value in fields.items()}
+
+
+def compact_job_fields(job_id: str, fields: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, str], List[str]]:
+    """
+    Convert job fields to the compact layout.
+
+    Args:
+        job_id: The job identifier
+        fields: Field names and values (timestamps as datetime or ISO-8601);
+            None or "" deletes a field
+
+    Returns:
+        (hash fields to set, separate keys to set, hash fields and keys to delete)
+    """
+    hash_fields: Dict[str, str] = {}
+    large_values: Dict[str, str] = {}
+    deleted: List[str] = []
+    for name, value in fields.items():
+        if name == "job_id":
+            continue
+        code = FIELD_CODES.get(name, name)
+        if value is None or value == "":
+            deleted.append(code)
+            if name in LARGE_FIELDS:
+                deleted.append(large_value_key(job_id, name))
+            continue
+        value = _encode_value(name, value)
+        if name in LARGE_FIELDS and len(value.encode()) > settings.job_hash_max_value_bytes:
+            large_values[large_value_key(job_id, name)] = value
+            deleted.append(code)
+        else:
+            hash_fields[code] = value
+            if name in LARGE_FIELDS:
+                deleted.append(large_value_key(job_id, name))
+    return hash_fields, large_values, deleted
+
+
+def queue_job_write(pipe: Any, job_id: str, fields: Dict[str, Any], *, new: bool = False) -> None:
+    """
+    Queue the commands writing job fields on a Redis pipeline.
+
+    Args:
+        pipe: Redis pipeline
+        job_id: The job identifier
+        fields: Field names and values, see compact_job_fields
+        new: The job is being created (nothing to clean up)
+    """
+    key = job_key(job_id)
+    hash_fields, large_values, deleted = compact_job_fields(job_id, fields)
+    if new:
+        hash_fields[VERSION_FIELD] = SCHEMA_VERSION
+    if hash_fields:
+        pipe.hset(key, mapping=hash_fields)
+    for value_key, value in large_values.items():
+        pipe.set(value_key, value)
+    if new:
+        return
+    # Drop stale values: deleted fields, the other storage of large values and
+    # legacy field names superseded by their codes
+    deleted_fields = [name for name in deleted if not name.startswith("job:")]
+    deleted_fields += [name for name in fields if name in FIELD_CODES or name == "job_id"]
+    if deleted_fields:
+        pipe.hdel(key, *deleted_fields)
+    deleted_keys = [name for name in deleted if name.startswith("job:")]
+    if deleted_keys:
+        pipe.delete(*deleted_keys)
+
+
+def decode_job_hash(
+    job_id: str,
+    raw: Dict[str, str],
+    large_values: Optional[Dict[str, Optional[str]]] = None,
+) -> Dict[str, str]:
+    """
+    Read adapter: job fields with their original names and value formats.
+
+    Args:
+        job_id: The job identifier
+        raw: Hash fields as stored, in either layout
+        large_values: Values of separately stored large fields, by field name
+
+    Returns:
+        Fields as in the legacy layout (ISO-8601 timestamps, job_id included,
+        no empty placeholders); empty if the hash is empty
+    """
+    if not raw:
+        return {}
+    job: Dict[str, str] = {}
+    for field, value in raw.items():
+        if field == VERSION_FIELD:
+            continue
+        name = FIELD_NAMES.get(field, field)
+        # Compact fields win over legacy ones left over from before the migration
+        if name in job and field == name:
+            continue
+        if value == "":
+            continue
+        if name in TIME_FIELDS:
+            value = from_ms(value)
+        elif name == "lease_expires_at" and value.isdigit():
+            value = str(int(value) / 1000)
+        job[name] = value
+    for name, value in (large_values or {}).items():
+        if value is not None and name not in job:
+            job[name] = value
+    job["job_id"] = job_id
+    return job
+
+
+def _hmget_fields(names: Sequence[str]) -> List[str]:
+    """Stored field names to HMGET for the given fields, codes first."""
+    return [FIELD_CODES.get(name, name) for name in names] + [name for name in names if name in FIELD_CODES]
+
+
+def _decode_hmget(
+    job_id: str,
+    names: Sequence[str],
+    values: Sequence[Optional[str]],
+    large_values: Dict[str, Optional[str]],
+) -> Dict[str, str]:
+    raw: Dict[str, str] = {}
+    stored = _hmget_fields(names)
+    # Legacy values first so compact ones override them
+    for field, value in reversed(list(zip(stored, values))):
+        if value is not None:
+            raw[field] = value
+    if not raw and not any(large_values.values()):
+        return {}
+    return decode_job_hash(job_id, raw or {"job_id": job_id}, large_values)
+
+
+async def read_job(job_id: str) -> Optional[Dict[str, str]]:
+    """
+    Read a whole job.
+
+    Args:
+        job_id: The job identifier
+
+    Returns:
+        Job fields as in the legacy layout, or None if the job does not exist
+    """
+    jobs = await read_jobs([job_id])
+    return jobs[0]
+
+
+async def read_jobs(job_ids: Sequence[str], fields: Optional[Sequence[str]] = None) -> List[Optional[Dict[str, str]]]:
+    """
+    Read several jobs in one round trip.
+
+    Args:
+        job_ids: Job identifiers
+        fields: Field names to read (all if None)
+
+    Returns:
+        Per job ID, the requested fields as in the legacy layout (missing
+        fields omitted, job_id always included), or None if the job does not
+        exist or has none of the requested fields
+    """
+    large = [name for name in LARGE_FIELDS if fields is None or name in fields]
+
+    def queue_reads(pipe: Any, position: int) -> None:
+        job_id = job_ids[position]
+        if fields is None:
+            pipe.hgetall(job_key(job_id))
+        else:
+            pipe.hmget(job_key(job_id), _hmget_fields(fields))
+        for name in large:
+            pipe.get(large_value_key(job_id, name))
+
+    # One round trip per shard holding any of the jobs
+    results = await pipeline_by_shard(job_ids, queue_reads)
+
+    jobs: List[Optional[Dict[str, str]]] = []
+    for job_id, (stored, *large_values) in zip(job_ids, results):
+        if fields is None:
+            job = decode_job_hash(job_id, stored, dict(zip(large, large_values)))
+        else:
+            job = _decode_hmget(job_id, fields, stored, dict(zip(large, large_values)))
+        jobs.append(job or None)
+    return jobs
+
+
+# Lua helpers reading and writing job hashes in either layout. Prepend to
+# scripts; times passed to job_set must already be epoch milliseconds.
+JOB_HASH_LUA = """
+local JOB_SCHEMA_VERSION = '__SCHEMA_VERSION__'
+local JOB_FIELDS = __FIELD_CODES__
+local JOB_LARGE_FIELDS = __LARGE_FIELDS__
+local JOB_MAX_VALUE_BYTES = __MAX_VALUE_BYTES__
+
+-- Read a job field by name, compact layout first
+local function job_get(key, name)
+    local value = redis.call('HGET', key, JOB_FIELDS[name] or name)
+    if not value and JOB_FIELDS[name] then
+        value = redis.call('HGET', key, name)
+    end
+    if not value and JOB_LARGE_FIELDS[name] then
+        value = redis.call('GET', key .. ':' .. JOB_LARGE_FIELDS[name])
+    end
+    if value == '' then
+        return false
+    end
+    return value
+end
+
+-- Set job fields from name, value pairs; large values go to separate keys and
+-- empty values delete the field
+local function job_set(key, ...)
+    local args = {}
+    local stale = {}
+    for i = 1, select('#', ...), 2 do
+        local name, value = select(i, ...)
+        local code = JOB_FIELDS[name] or name
+        if value == '' then
+            table.insert(stale, code)
+            if JOB_LARGE_FIELDS[name] then
+                redis.call('DEL', key .. ':' .. JOB_LARGE_FIELDS[name])
+            end
+        elseif JOB_LARGE_FIELDS[name] and #value > JOB_MAX_VALUE_BYTES then
+            redis.call('SET', key .. ':' .. JOB_LARGE_FIELDS[name], value)
+            table.insert(stale, code)
+        else
+            table.insert(args, code)
+            table.insert(args, value)
+            if JOB_LARGE_FIELDS[name] then
+                redis.call('DEL', key .. ':' .. JOB_LARGE_FIELDS[name])
+            end
+        end
+        if JOB_FIELDS[name] then
+            table.insert(stale, name)
+        end
+    end
+    if #args > 0 then
+        redis.call('HSET', key, unpack(args))
+    end
+    if #stale > 0 then
+        redis.call('HDEL', key, unpack(stale))
+    end
+end
+
+-- Delete job fields by name
+local function job_del(key, ...)
+    local fields = {}
+    for i = 1, select('#', ...) do
+        local name = select(i, ...)
+        table.insert(fields, name)
+        if JOB_FIELDS[name] then
+            table.insert(fields, JOB_FIELDS[name])
+        end
+        if JOB_LARGE_FIELDS[name] then
+            redis.call('DEL', key .. ':' .. JOB_LARGE_FIELDS[name])
+        end
+    end
+    redis.call('HDEL', key, unpack(fields))
+end
+
+-- Job stream entry of a job (same layout as app.streams.job_stream_entry)
+local function job_stream_entry(key, inline_payload)
+    local entry = {
+        'job_id', string.sub(key, 5),
+        'partition_key', job_get(key, 'partition_key') or '',
+        'task_type', job_get(key, 'task_type') or '',
+    }
+    if inline_payload then
+        table.insert(entry, 'payload_json')
+        table.insert(entry, job_get(key, 'payload_json') or '{}')
+    end
+    local traceparent = job_get(key, 'traceparent')
+    if traceparent then
+        table.insert(entry, 'traceparent')
+        table.insert(entry, traceparent)
+    end
+    return entry
+end
+"""
+
+
+def _lua_table(mapping: Dict[str, str]) -> str:
+    return "{" + ", ".join(f"{name} = '{value}'" for name, value in mapping.items()) + "}"
+
+
+JOB_HASH_LUA = (
+    JOB_HASH_LUA
+    .replace("__SCHEMA_VERSION__", SCHEMA_VERSION)
+    .replace("__FIELD_CODES__", _lua_table(FIELD_CODES))
+    .replace("__LARGE_FIELDS__", _lua_table(LARGE_FIELDS))
+    .replace("__MAX_VALUE_BYTES__", str(settings.job_hash_max_value_bytes))
+)
+
+
+# Lua script replacing a legacy job hash with its compact form, unless the
+# job changed since it was read (compared by its raw updated_at values)
+MIGRATE_IF_UNCHANGED_SCRIPT = """
+local key = KEYS[1]
+if (redis.call('HGET', key, 'updated_at') or '') ~= ARGV[1]
+    or (redis.call('HGET', key, 'u') or '') ~= ARGV[2]
+    or redis.call('HGET', key, 'v') then
+    return 0
+end
+local fields = cjson.decode(ARGV[3])
+local large_values = cjson.decode(ARGV[4])
+redis.call('DEL', key)
+local args = {}
+for field, value in pairs(fields) do
+    table.insert(args, field)
+    table.insert(args, value)
+end
+redis.call('HSET', key, unpack(args))
+for value_key, value in pairs(large_values) do
+    redis.call('SET', value_key, value)
+end
+return 1
+"""
+
+
+def _job_ids(keys: Iterable[str]) -> List[str]:
+    # Skip per-job sub-keys such as job:{id}:log
+    return [key.split(":", 1)[1] for key in keys if key.count(":") == 1]
+
+
+async def scan_job_ids(batch_size: int) -> AsyncIterator[Tuple[int, List[str]]]:
+    """
+    Find all jobs with an incremental SCAN of every shard.
+
+    Args:
+        batch_size: Keys examined per SCAN call
+
+    Yields:
+        (shard index, IDs of jobs stored there) per non-empty SCAN batch
+    """
+    for shard in range(shard_count()):
+        redis = get_shard(shard)
+        cursor = 0
+        while True:
+            cursor, keys = await redis.scan(cursor=cursor, match="job:*", count=batch_size)
+            job_ids = _job_ids(keys)
+            if job_ids:
+                yield shard, job_ids
+            if cursor == 0:
+                break
+
+
+async def migrate_job_hashes(batch_size: Optional[int] = None) -> int:
+    """
+    Convert job hashes written in the legacy layout to the compact layout.
+
+    Args:
+        batch_size: Keys examined per SCAN batch, defaults to
+            settings.job_migration_batch_size
+
+    Returns:
+        Number of jobs converted
+    """
+    batch_size = batch_size or settings.job_migration_batch_size
+    migrated = 0
+    async for shard, job_ids in scan_job_ids(batch_size):
+        redis = get_shard(shard)
+        script = redis.register_script(MIGRATE_IF_UNCHANGED_SCRIPT)
+        pipe = redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hgetall(job_key(job_id))
+        hashes = await pipe.execute()
+
+        pipe = redis.pipeline(transaction=False)
+        queued = 0
+        for job_id, raw in zip(job_ids, hashes):
+            if not raw or VERSION_FIELD in raw:
+                continue
+            hash_fields, large_values, _ = compact_job_fields(job_id, decode_job_hash(job_id, raw))
+            hash_fields[VERSION_FIELD] = SCHEMA_VERSION
+            await script(
+                keys=[job_key(job_id)],
+                args=[
+                    raw.get("updated_at", ""),
+                    raw.get("u", ""),
+                    json.dumps(hash_fields),
+                    json.dumps(large_values) if large_values else "{}",
+                ],
+                client=pipe,
+            )
+            queued += 1
+        if queued:
+            migrated += sum(await pipe.execute())
+    return migrated
@@ -1,12 +1,11 @@
 """Job service layer for status transitions and business logic."""
 
-from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Sequence
 
-from app.events import EventType, append_job_event
+from app.events import EventType, job_event_records
 from app.models import JobStatus
-from app.redis_client import get_redis
-from app.transitions import InvalidTransitionError, can_transition
+from app.state_machine import TransitionOutcome, TransitionResult, transition_job
+from app.transitions import InvalidTransitionError
 
 
 async def transition_job_status(
@@ -15,73 +14,57 @@ async def transition_job_status(
     *,
     reason: Optional[str] = None,
     actor: str = "system",
-) -> JobStatus:
+    expected: Optional[Sequence[JobStatus]] = None,
+    task_type: Optional[str] = None,
+) -> TransitionResult:
     """
     Transition a job to a new status with validation.
 
+    Validation, the update, its event and the job's workflow bookkeeping
+    happen atomically in Redis (see app.state_machine). Jobs moved back to
+    PENDING are re-enqueued.
+
     Args:
         job_id: The job identifier
         to_status: Target status
         reason: Optional reason for the transition
         actor: Who/what triggered the transition (e.g., "system", "user", "ui")
+        expected: Statuses the job must currently have (any allowed if None)
+        task_type: Task type of the job, if known; selects the event verbosity
+            and the queue a requeued job is routed to
 
     Returns:
-        The new status
+        The transition result
 
     Raises:
-        InvalidTransitionError: If transition is not allowed
+        ValueError: If the job does not exist
+        InvalidTransitionError: If the transition is not allowed, or the job
+            does not have an expected status
     """
-    redis = await get_redis()
-    job_key = f"job:{job_id}"
-
-    # Get current job state
-    job_hash = await redis.hgetall(job_key)
-    if not job_hash:
-        raise ValueError(f"Job {job_id} not found")
-
-    current_status_str = job_hash.get("status", "PENDING")
-    
-    # Handle CANCELLED status (stored as string, not in enum)
-    if current_status_str == "CANCELLED":
-        if to_status != JobStatus.PENDING:  # Only allow requeue from CANCELLED
-            raise InvalidTransitionError(JobStatus.PENDING, to_status)  # Approximate
-        # Allow transition from CANCELLED to PENDING (requeue)
-        current_status = JobStatus.PENDING
-    else:
-        try:
-            current_status = JobStatus(current_status_str)
-        except ValueError:
-            current_status = JobStatus.PENDING
-
-    # Validate transition (skip validation for CANCELLED -> PENDING requeue)
-    if current_status_str != "CANCELLED" and not can_transition(current_status, to_status):
-        raise InvalidTransitionError(current_status, to_status)
-
-    # Update status
-    now = datetime.now(timezone.utc)
-    update_fields = {
-        "status": to_status.value,
-        "updated_at": now.isoformat(),
-    }
-
-    # Store transition metadata
+    fields = {"last_status_actor": actor}
     if reason:
-        update_fields["last_status_change_reason"] = reason
-    update_fields["last_status_actor"] = actor
-
-    await redis.hset(job_key, mapping=update_fields)
+        fields["last_status_change_reason"] = reason
 
     # Emit event
-    event_type = EventType.STATUS_CHANGED
-    # Check if transitioning to CANCELLED (stored as string)
-    if to_status.value == "CANCELLED" or (hasattr(to_status, 'name') and to_status.name == "CANCELLED"):
-        event_type = EventType.CANCELLED
-
+    event_type = EventType.CANCELLED if to_status == JobStatus.CANCELLED else EventType.STATUS_CHANGED
     details = {"actor": actor}
     if reason:
         details["reason"] = reason
-
-    await append_job_event(job_id, event_type, to_status, details=details)
-
-    return to_status
-
+    events = [(job_id, event_type, to_status, details)]
+    if to_status == JobStatus.PENDING:
+        events.append((job_id, EventType.ENQUEUED, JobStatus.PENDING, None))
+
+    result = await transition_job(
+        job_id,
+        [to_status],
+        expected=expected,
+        fields=fields,
+        enqueue=to_status == JobStatus.PENDING,
+        task_type=task_type,
+        events=job_event_records(events, task_type=task_type),
+    )
+    if result.outcome == TransitionOutcome.NOT_FOUND:
+        raise ValueError(f"Job {job_id} not found")
+    if not result.ok:
+        raise InvalidTransitionError(JobStatus(result.previous_status), to_status)
+    return result
@@ -0,0 +1,346 @@
+"""Map jobs: one logical job fanned out over many items in chunks.
+
+A ``map`` job is split at submission into ``map_chunk`` jobs that run in
+parallel across workers. Each chunk executes its items and folds their
+results into a per-map accumulator in Redis, so item results are never
+stored individually. The last chunk to finish completes the parent job
+through the state machine, unless it was cancelled in the meantime.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.codec import decode, encode
+from app.config import settings
+from app.events import EventType, JobEvent, append_job_events, job_event_records
+from app.job_schema import queue_job_write
+from app.models import JobCreateRequest, JobPayload, JobResponse, JobStatus, MapJobSpec
+from app.queues import enqueue_job
+from app.sharding import get_redis_for, new_job_id
+from app.state_machine import merge_map_chunk
+
+
+MAP_TASK_TYPE = "map"
+MAP_CHUNK_TASK_TYPE = "map_chunk"
+
+MAP_TTL_SECONDS = 86400 * 7  # Keep items and accumulators for 7 days
+MAX_SAMPLE_ERRORS = 100  # Item errors kept per map job
+
+ItemHandler = Callable[[JobPayload], Awaitable[Dict[str, Any]]]
+
+def _map_keys(parent_job_id: str) -> Dict[str, str]:
+    base = f"map:{parent_job_id}"
+    return {
+        "map": base,
+        "done": f"{base}:done",
+        "items": f"{base}:items",
+        "errors": f"{base}:errors",
+    }
+
+
+def _as_item_data(item: Any) -> Dict[str, Any]:
+    """Wrap non-object items so they fit JobPayload.data."""
+    return item if isinstance(item, dict) else {"item": item}
+
+
+async def submit_map_job(request: JobCreateRequest) -> JobResponse:
+    """
+    Create a map job and enqueue its chunk jobs.
+
+    Inline items are stored once in a Redis list that chunks read by offset;
+    generated sources are expanded by the chunks themselves.
+
+    Args:
+        request: Job creation request whose payload task type is ``map``
+
+    Returns:
+        The parent job, already RUNNING
+
+    Raises:
+        ValueError: If the payload data is not a valid MapJobSpec
+    """
+    spec = MapJobSpec.model_validate(request.payload.data)
+    if spec.item_task_type in (MAP_TASK_TYPE, MAP_CHUNK_TASK_TYPE):
+        raise ValueError(f"item_task_type cannot be {spec.item_task_type}")
+
+    if spec.items is not None:
+        item_count = len(spec.items)
+    else:
+        source = spec.item_source
+        item_count = len(range(source.start, source.stop, source.step))
+    chunk_size = spec.chunk_size or settings.map_chunk_size
+    chunk_count = (item_count + chunk_size - 1) // chunk_size
+
+    # The map keys and chunk jobs share the parent's shard, so merges update them together
+    job_id = new_job_id()
+    parent_id = str(job_id)
+    redis = get_redis_for(parent_id)
+    keys = _map_keys(parent_id)
+    now = datetime.now(timezone.utc)
+
+    # The parent keeps the spec without inline items; they live in the items list
+    parent_data = spec.model_dump(exclude={"items"}, exclude_none=True)
+    parent_data["item_count"] = item_count
+    parent_payload = JobPayload(task_type=MAP_TASK_TYPE, data=parent_data)
+    status = JobStatus.RUNNING if chunk_count else JobStatus.SUCCEEDED
+
+    pipe = redis.pipeline(transaction=True)
+    parent_hash = {
+        "status": status.value,
+        "created_at": now,
+        "updated_at": now,
+        "attempts": "0",
+        "partition_key": request.partition_key,
+        "task_type": MAP_TASK_TYPE,
+        "payload_json": encode(parent_payload.model_dump(mode="json")),
+    }
+    if not chunk_count:
+        parent_hash["result"] = encode({
+            "reducer": spec.reducer,
+            "value": 0 if spec.reducer == "count" else None,
+            "items_succeeded": 0,
+            "items_failed": 0,
+        })
+    queue_job_write(pipe, parent_id, parent_hash, new=True)
+    pipe.hset(keys["map"], mapping={
+        "status": status.value,
+        "reducer": spec.reducer,
+        "fail_on_item_error": "1" if spec.fail_on_item_error else "0",
+        "item_count": str(item_count),
+        "chunks_total": str(chunk_count),
+        "chunks_done": "0",
+        "items_succeeded": "0",
+        "items_failed": "0",
+    })
+    # Merged chunks and errors are only written by chunk merges, which give them the map's TTL
+    pipe.expire(keys["map"], MAP_TTL_SECONDS)
+
+    if spec.items:
+        for i in range(0, item_count, 1000):
+            pipe.rpush(keys["items"], *[encode(_as_item_data(item)) for item in spec.items[i:i + 1000]])
+        pipe.expire(keys["items"], MAP_TTL_SECONDS)
+
+    events: List[JobEvent] = [
+        (parent_id, EventType.CREATED, JobStatus.PENDING, {"item_count": item_count, "chunks": chunk_count}),
+    ]
+    for chunk_index in range(chunk_count):
+        chunk_id = str(new_job_id(colocate_with=parent_id))
+        offset = chunk_index * chunk_size
+        chunk_payload = JobPayload(
+            task_type=MAP_CHUNK_TASK_TYPE,
+            data={
+                "parent_job_id": parent_id,
+                "chunk_index": chunk_index,
+                "offset": offset,
+                "count": min(chunk_size, item_count - offset),
+                "item_task_type": spec.item_task_type,
+                "result_field": spec.result_field,
+                "item_source": spec.item_source.model_dump() if spec.item_source else None,
+            },
+        )
+        chunk_payload_json = encode(chunk_payload.model_dump(mode="json"))
+        queue_job_write(pipe, chunk_id, {
+            "status": JobStatus.PENDING.value,
+            "created_at": now,
+            "updated_at": now,
+            "attempts": "0",
+            "partition_key": request.partition_key,
+            "task_type": MAP_CHUNK_TASK_TYPE,
+            "payload_json": chunk_payload_json,
+            "parent_job_id": parent_id,
+        }, new=True)
+        enqueue_job(pipe, chunk_id, request.partition_key or "", MAP_CHUNK_TASK_TYPE, chunk_payload_json)
+        events.append((chunk_id, EventType.CREATED, JobStatus.PENDING, {"parent_job_id": parent_id}))
+        events.append((chunk_id, EventType.ENQUEUED, JobStatus.PENDING, None))
+
+    pipe.incrby("metrics:jobs_created_total", 1 + chunk_count)
+    await pipe.execute()
+
+    if chunk_count:
+        events.append((parent_id, EventType.STARTED, JobStatus.RUNNING, {"chunks": chunk_count}))
+    else:
+        events.append((parent_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, {"item_count": 0}))
+    await append_job_events(events)
+
+    return JobResponse(
+        job_id=job_id,
+        status=status,
+        created_at=now,
+        updated_at=now,
+        payload=parent_payload,
+        attempts=0,
+        partition_key=request.partition_key,
+    )
+
+
+async def _load_chunk_items(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Load the items of one chunk from the items list or generated source."""
+    offset = data["offset"]
+    count = data["count"]
+    source = data.get("item_source")
+    if source:
+        start = source["start"] + offset * source["step"]
+        return [{"item": start + i * source["step"]} for i in range(count)]
+
+    redis = get_redis_for(data["parent_job_id"])
+    keys = _map_keys(data["parent_job_id"])
+    raw_items = await redis.lrange(keys["items"], offset, offset + count - 1)
+    return [decode(raw) for raw in raw_items]
+
+
+def _extract_field(result: Any, result_field: str) -> Any:
+    """Read a dotted path such as ``output.total`` from an item result."""
+    value = result
+    for part in result_field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _fold_results(
+    results: List[Any],
+    offset: int,
+    result_field: str,
+    reducer: str,
+) -> Tuple[int, int, Optional[float], List[str]]:
+    """Fold item results of a chunk into (succeeded, failed, partial, errors)."""
+    succeeded = 0
+    errors: List[str] = []
+    values: List[float] = []
+
+    for index, result in enumerate(results, start=offset):
+        if isinstance(result, Exception):
+            errors.append(f"item {index}: {result}")
+            continue
+        if reducer != "count":
+            value = _extract_field(result, result_field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"item {index}: non-numeric result field {result_field!r}")
+                continue
+            values.append(value)
+        succeeded += 1
+
+    partial: Optional[float] = None
+    if values:
+        if reducer == "sum":
+            partial = sum(values)
+        elif reducer == "min":
+            partial = min(values)
+        elif reducer == "max":
+            partial = max(values)
+    return succeeded, len(errors), partial, errors
+
+
+async def _merge_chunk(
+    parent_job_id: str,
+    chunk_index: int,
+    succeeded: int,
+    failed: int,
+    partial: Optional[float],
+    errors: List[str],
+) -> Optional[str]:
+    """Merge a chunk aggregate; returns the parent's final status if it completed."""
+    keys = _map_keys(parent_job_id)
+    details = {"chunks_merged": chunk_index + 1}
+    final_status = await merge_map_chunk(
+        parent_job_id,
+        [keys["map"], keys["done"], keys["items"], keys["errors"]],
+        chunk_index,
+        succeeded=succeeded,
+        failed=failed,
+        partial=partial,
+        errors=errors[:MAX_SAMPLE_ERRORS],
+        max_errors=MAX_SAMPLE_ERRORS,
+        events={
+            JobStatus.SUCCEEDED: job_event_records(
+                [(parent_job_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, details)], task_type=MAP_TASK_TYPE
+            ),
+            JobStatus.FAILED: job_event_records(
+                [(parent_job_id, EventType.FAILED, JobStatus.FAILED, details)], task_type=MAP_TASK_TYPE
+            ),
+        },
+    )
+    return final_status.value if final_status else None
+
+
+async def run_map_chunk(payload: JobPayload, item_handler: ItemHandler) -> Dict[str, Any]:
+    """
+    Execute one chunk of a map job and merge its aggregate into the parent.
+
+    Items run concurrently; an item failure is counted, not raised.
+
+    Args:
+        payload: The ``map_chunk`` payload
+        item_handler: Handler executing a single item payload
+
+    Returns:
+        Chunk summary stored as the chunk job's result
+    """
+    data = payload.data
+    parent_job_id = data["parent_job_id"]
+    redis = get_redis_for(parent_job_id)
+    reducer = await redis.hget(_map_keys(parent_job_id)["map"], "reducer") or "count"
+
+    items = await _load_chunk_items(data)
+    results = await asyncio.gather(
+        *(item_handler(JobPayload(task_type=data["item_task_type"], data=item)) for item in items),
+        return_exceptions=True,
+    )
+    succeeded, failed, partial, errors = _fold_results(
+        list(results),
+        data["offset"],
+        data.get("result_field", "output"),
+        reducer,
+    )
+    await _merge_chunk(parent_job_id, data["chunk_index"], succeeded, failed, partial, errors)
+
+    return {"status": "success", "output": {"items": len(items), "succeeded": succeeded, "failed": failed}}
+
+
+async def on_map_chunk_dead_lettered(payload: JobPayload, error: str) -> None:
+    """
+    Count all items of a dead-lettered chunk as failed so the parent can finish.
+
+    Args:
+        payload: The ``map_chunk`` payload
+        error: Error that dead-lettered the chunk
+    """
+    data = payload.data
+    await _merge_chunk(
+        data["parent_job_id"],
+        data["chunk_index"],
+        0,
+        data["count"],
+        None,
+        [f"chunk {data['chunk_index']} dead-lettered: {error}"],
+    )
+
+
+async def get_map_progress(parent_job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get chunk and item progress of a map job.
+
+    Args:
+        parent_job_id: The map job identifier
+
+    Returns:
+        Progress record, or None if the job is not a map job
+    """
+    redis = get_redis_for(parent_job_id)
+    keys = _map_keys(parent_job_id)
+    map_hash = await redis.hgetall(keys["map"])
+    if not map_hash:
+        return None
+
+    errors = await redis.lrange(keys["errors"], 0, MAX_SAMPLE_ERRORS - 1)
+    progress: Dict[str, Any] = {
+        "status": map_hash.get("status"),
+        "reducer": map_hash.get("reducer"),
+        "partial_value": float(map_hash["acc"]) if "acc" in map_hash else None,
+        "sample_errors": errors,
+    }
+    for field in ("item_count", "chunks_total", "chunks_done", "items_succeeded", "items_failed"):
+        progress[field] = int(map_hash.get(field, "0"))
+    return progress
@@ -0,0 +1,161 @@
+"""Memoization of results of deterministic task types.
+
+Task types listed in ``memoize_task_types`` (task type -> TTL in seconds) are
+treated as pure: jobs with equal ``JobPayload.data`` produce equal results.
+Their results are stored in Redis under ``memo:{task_type}:{digest}``, the
+digest being a hash of the canonical JSON of the data, and in an LRU in each
+worker. Workers look a job's result up before leasing it and complete hits
+right away with a CACHE_HIT event (see app.worker.worker_main).
+
+Redis keeps at most ``memoize_max_entries`` results: an index sorted by
+expiry time is trimmed on every store, evicting the results closest to
+expiring.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.map_jobs import MAP_CHUNK_TASK_TYPE
+from app.redis_client import get_redis
+
+
+MEMO_INDEX_KEY = "memo:index"  # Sorted set: result key -> expiry (epoch ms)
+
+
+# KEYS[1]: result key, KEYS[2]: index
+# ARGV: encoded result, TTL (ms), now (epoch ms), max entries
+STORE_RESULT_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) + tonumber(ARGV[2]), KEYS[1])
+-- Results that expired on their own
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess <= 0 then
+    return 0
+end
+local evicted = redis.call('ZPOPMIN', KEYS[2], excess)
+for i = 1, #evicted, 2 do
+    redis.call('DEL', evicted[i])
+end
+return excess
+"""
+
+
+def is_memoized(task_type: Optional[str]) -> bool:
+    """Whether results of a task type are memoized."""
+    # Map chunks update their parent job as they run, so they always run
+    if not task_type or task_type == MAP_CHUNK_TASK_TYPE:
+        return False
+    return task_type in settings.memoize_task_types
+
+
+def memo_key(task_type: str, data: Dict[str, Any]) -> str:
+    """
+    Key of the memoized result of a task type for some payload data.
+
+    Args:
+        task_type: The task type
+        data: The payload data (JobPayload.data)
+
+    Returns:
+        Redis key, equal for payload data that is equal as JSON regardless
+        of key order
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+    return f"memo:{task_type}:{digest}"
+
+
+class ResultMemo:
+    """Memoized results: a local LRU in front of Redis."""
+
+    def __init__(self, local_size: int):
+        self.local_size = local_size
+
+        # memo key -> (encoded result, expires at (monotonic))
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _get_local(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put_local(self, key: str, value: str, ttl_seconds: float) -> None:
+        if self.local_size <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.local_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Look a result up, locally first.
+
+        Args:
+            key: Key from memo_key()
+
+        Returns:
+            The encoded result, or None on a miss
+        """
+        value = self._get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        redis = get_redis()
+        pipe = redis.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        value, ttl_ms = await pipe.execute()
+        if value is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        if ttl_ms > 0:
+            # Never keep a result locally past its expiry in Redis
+            self._put_local(key, value, ttl_ms / 1000)
+        return value
+
+    async def put(self, task_type: str, key: str, value: str) -> None:
+        """
+        Store a result.
+
+        Args:
+            task_type: Task type of the job, selects the TTL
+            key: Key from memo_key()
+            value: The encoded result, as stored in the job hash
+        """
+        ttl_seconds = settings.memoize_task_types[task_type]
+        self._put_local(key, value, ttl_seconds)
+        redis = get_redis()
+        script = redis.register_script(STORE_RESULT_SCRIPT)
+        await script(
+            keys=[key, MEMO_INDEX_KEY],
+            args=[value, int(ttl_seconds * 1000), int(time.time() * 1000), settings.memoize_max_entries],
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process's lookups."""
+        return {
+            "local_entries": len(self._entries),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+
+result_memo = ResultMemo(local_size=settings.memoize_local_size)
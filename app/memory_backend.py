@@ -0,0 +1,103 @@
+"""In-process test backend.
+
+With ``REDIS_BACKEND=memory`` the clients of app.redis_client talk to an
+in-process fakeredis server instead of a Redis server (one per Redis URL, so
+shards stay separate nodes, see app.sharding). It is a test double, not a
+storage engine: commands are still encoded and parsed as RESP, scripts run in
+fakeredis' Lua emulation and blocked stream reads re-check the server every
+memory_block_poll_ms. Use it for the tests and for trying the system out in
+one process (see app.embedded), never for throughput or production data.
+
+It needs the development requirements (``fakeredis[lua]``, see
+requirements-dev.txt). Data lives as long as the process and is never
+persisted. Keyspace notifications are not available, so the job cache falls
+back to its short TTLs.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+import redis.asyncio as aioredis
+
+try:
+    from fakeredis import FakeServer
+    from fakeredis.aioredis import FakeAsyncRedisConnection
+    import lupa  # noqa: F401  # Lua scripting of the server
+except ImportError as e:  # pragma: no cover - optional dependency
+    raise ImportError("REDIS_BACKEND=memory requires the development requirements: pip install -r requirements-dev.txt") from e
+
+from app.config import settings
+from app.redis_client import ClientBackend
+
+SERVER_VERSION = (7,)
+
+
+class MemoryClient(aioredis.Redis):
+    """Client of an in-process server.
+
+    The server cannot block, so stream reads with BLOCK poll it every
+    memory_block_poll_ms until entries arrive or the block time ends.
+    """
+
+    async def _blocking_read(self, read: Any, block: Optional[int]) -> Any:
+        deadline = time.monotonic() + block / 1000 if block else None  # BLOCK 0 waits forever
+        while True:
+            result = await read()
+            if result or block is None:
+                return result
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return result
+            poll = settings.memory_block_poll_ms / 1000
+            await asyncio.sleep(poll if remaining is None else min(poll, remaining))
+
+    async def xreadgroup(
+        self,
+        groupname: str,
+        consumername: str,
+        streams: Any,
+        count: Optional[int] = None,
+        block: Optional[int] = None,
+        **kwargs: Any,
+    ) -> Any:
+        return await self._blocking_read(
+            lambda: super(MemoryClient, self).xreadgroup(groupname, consumername, streams, count=count, **kwargs),
+            block,
+        )
+
+    async def xread(
+        self,
+        streams: Any,
+        count: Optional[int] = None,
+        block: Optional[int] = None,
+        **kwargs: Any,
+    ) -> Any:
+        return await self._blocking_read(
+            lambda: super(MemoryClient, self).xread(streams, count=count, **kwargs),
+            block,
+        )
+
+
+class MemoryBackend(ClientBackend):
+    """In-process servers, one per Redis URL, shared by all their clients."""
+
+    def __init__(self) -> None:
+        self._servers: Dict[str, FakeServer] = {}
+
+    def create_client(self, url: Optional[str], *, blocking: bool) -> aioredis.Redis:
+        url = url or settings.redis_url
+        server = self._servers.get(url)
+        if server is None:
+            server = self._servers[url] = FakeServer(version=SERVER_VERSION)
+        pool = aioredis.ConnectionPool(
+            connection_class=FakeAsyncRedisConnection,
+            server=server,
+            version=SERVER_VERSION,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+        return MemoryClient(connection_pool=pool)
+
+
+backend = MemoryBackend()
@@ -2,10 +2,10 @@
 
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Literal, Optional
 from uuid import UUID
 
-from pydantic import BaseModel, Field, field_serializer, ConfigDict
+from pydantic import BaseModel, Field, field_serializer, model_validator, ConfigDict
 
 
 class JobStatus(str, Enum):
@@ -16,6 +16,7 @@ class JobStatus(str, Enum):
     SUCCEEDED = "SUCCEEDED"
     FAILED = "FAILED"
     DEAD_LETTERED = "DEAD_LETTERED"
+    CANCELLED = "CANCELLED"
 
 
 class JobPayload(BaseModel):
@@ -72,3 +73,146 @@ class JobResponse(BaseModel):
         """Serialize datetime to ISO format."""
         return dt.isoformat()
 
+
+
+class BulkJobFilter(BaseModel):
+    """Selection criteria for bulk job operations.
+
+    All given criteria must match. When ``job_ids`` is set, only those jobs
+    are considered; otherwise every job in Redis is scanned. A filter without
+    any criterion must set ``all`` to select every job.
+    """
+
+    job_ids: Optional[List[UUID]] = Field(
+        default=None,
+        description="Explicit list of job IDs to operate on"
+    )
+    status: Optional[List[str]] = Field(
+        default=None,
+        description="Only jobs currently in one of these statuses"
+    )
+    task_type: Optional[str] = Field(default=None, description="Only jobs of this task type")
+    partition_key: Optional[str] = Field(default=None, description="Only jobs with this partition key")
+    created_after: Optional[datetime] = Field(
+        default=None,
+        description="Only jobs created at or after this time"
+    )
+    created_before: Optional[datetime] = Field(
+        default=None,
+        description="Only jobs created before this time"
+    )
+    all: bool = Field(default=False, description="Select every job (required when no criterion is given)")
+
+    @model_validator(mode="after")
+    def check_selection(self) -> "BulkJobFilter":
+        """Reject an empty filter unless every job is explicitly selected."""
+        criteria = (
+            self.job_ids, self.status, self.task_type, self.partition_key,
+            self.created_after, self.created_before,
+        )
+        if not self.all and all(value is None for value in criteria):
+            raise ValueError("Specify job_ids or at least one criterion, or set all to true to select every job")
+        return self
+
+
+class WorkflowNode(BaseModel):
+    """A single job within a workflow DAG."""
+
+    key: str = Field(..., min_length=1, description="Node key, unique within the workflow")
+    payload: JobPayload = Field(..., description="Job payload")
+    partition_key: Optional[str] = Field(
+        default=None,
+        description="Optional partition key for job routing"
+    )
+    depends_on: List[str] = Field(
+        default_factory=list,
+        description="Keys of nodes that must succeed before this node runs"
+    )
+
+
+class WorkflowCreateRequest(BaseModel):
+    """Request model for submitting a workflow DAG."""
+
+    name: Optional[str] = Field(default=None, description="Optional workflow name")
+    nodes: List[WorkflowNode] = Field(..., min_length=1, description="Workflow nodes")
+
+
+class MapItemSource(BaseModel):
+    """Generated item source for map jobs (items are not stored up front)."""
+
+    type: Literal["range"] = Field(default="range", description="Source type")
+    start: int = Field(default=0, description="First value")
+    stop: int = Field(..., description="End value (exclusive)")
+    step: int = Field(default=1, description="Increment between values")
+
+    @model_validator(mode="after")
+    def check_step(self) -> "MapItemSource":
+        """Reject a zero step."""
+        if self.step == 0:
+            raise ValueError("step must not be zero")
+        return self
+
+
+class MapJobSpec(BaseModel):
+    """Data of a ``map`` job: one logical job over many independent items.
+
+    Each item is executed as a ``JobPayload`` of ``item_task_type``; items
+    that are not objects are wrapped as ``{"item": value}``.
+    """
+
+    item_task_type: str = Field(..., description="Task type used for each item")
+    items: Optional[List[Any]] = Field(default=None, description="Inline items")
+    item_source: Optional[MapItemSource] = Field(default=None, description="Generated items")
+    chunk_size: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=10000,
+        description="Items per chunk job (defaults to MAP_CHUNK_SIZE)"
+    )
+    reducer: Literal["count", "sum", "min", "max"] = Field(
+        default="count",
+        description="How item results are aggregated"
+    )
+    result_field: str = Field(
+        default="output",
+        description="Dotted path of the item result value fed to the reducer"
+    )
+    fail_on_item_error: bool = Field(default=False, description="Fail the map job if any item fails")
+
+    @model_validator(mode="after")
+    def check_items(self) -> "MapJobSpec":
+        """Require exactly one of items and item_source."""
+        if (self.items is None) == (self.item_source is None):
+            raise ValueError("Specify exactly one of items or item_source")
+        return self
+
+
+class ScheduleTemplate(BaseModel):
+    """A recurring job definition run by the cron scheduler."""
+
+    name: str = Field(..., min_length=1, pattern=r"^[A-Za-z0-9_.-]+$", description="Unique schedule name")
+    payload: JobPayload = Field(..., description="Payload of each scheduled job")
+    partition_key: Optional[str] = Field(default=None, description="Partition key of each scheduled job")
+    cron: Optional[str] = Field(
+        default=None,
+        description="Five-field cron expression (minute hour day-of-month month day-of-week), UTC"
+    )
+    interval_seconds: Optional[int] = Field(default=None, ge=1, description="Fixed interval between runs")
+    misfire_policy: Literal["skip", "fire_once", "catch_up"] = Field(
+        default="fire_once",
+        description="What to do with runs missed while no scheduler was active"
+    )
+    misfire_grace_seconds: int = Field(
+        default=60,
+        ge=0,
+        description="Runs later than this are treated as missed"
+    )
+    max_catch_up: int = Field(default=100, ge=1, description="Maximum missed runs fired by catch_up")
+    enabled: bool = Field(default=True, description="Whether the schedule fires")
+
+    @model_validator(mode="after")
+    def check_trigger(self) -> "ScheduleTemplate":
+        """Require exactly one of cron and interval_seconds."""
+        if (self.cron is None) == (self.interval_seconds is None):
+            raise ValueError("Specify exactly one of cron or interval_seconds")
+        return self
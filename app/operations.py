@@ -0,0 +1,189 @@
+"""Tracking for long-running server-side operations (bulk actions, replays).
+
+Operations run as tasks of the API process that accepted them. While one runs
+its record gets a heartbeat; a running operation whose heartbeat stopped (the
+process exited or crashed) is reported and stored as failed when read.
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Dict, Optional, Set
+from uuid import uuid4
+
+from app.redis_client import get_redis
+
+
+OPERATION_TTL_SECONDS = 86400 * 7  # Keep progress records for 7 days
+OPERATION_HEARTBEAT_SECONDS = 10  # Heartbeat interval of running operations
+OPERATION_STALE_SECONDS = 60  # Running operations without a heartbeat for this long are failed
+
+# Lua script failing an operation only if it is still running without a newer heartbeat
+FAIL_ORPHANED_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') == 'running'
+    and redis.call('HGET', KEYS[1], 'heartbeat_at') == ARGV[1] then
+    redis.call('HSET', KEYS[1], 'state', 'failed', 'error', ARGV[2], 'updated_at', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Strong references to running operation tasks so they are not garbage collected
+_running_tasks: Set[asyncio.Task] = set()
+
+
+def _operation_key(operation_id: str) -> str:
+    return f"op:{operation_id}"
+
+
+async def create_operation(kind: str, params: Dict[str, Any]) -> str:
+    """
+    Register a new operation and return its identifier.
+
+    Args:
+        kind: Operation kind (e.g., "bulk_cancel", "dlq_replay")
+        params: Request parameters, stored for later inspection
+
+    Returns:
+        The operation identifier
+    """
+    redis = get_redis()
+    operation_id = str(uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    key = _operation_key(operation_id)
+
+    await redis.hset(key, mapping={
+        "operation_id": operation_id,
+        "kind": kind,
+        "state": "running",
+        "params_json": json.dumps(params, default=str),
+        "matched": "0",
+        "processed": "0",
+        "succeeded": "0",
+        "skipped": "0",
+        "failed": "0",
+        "created_at": now,
+        "updated_at": now,
+        "heartbeat_at": str(time.time()),
+    })
+    await redis.expire(key, OPERATION_TTL_SECONDS)
+    return operation_id
+
+
+async def record_progress(operation_id: str, **counts: int) -> None:
+    """
+    Increment progress counters of an operation.
+
+    Args:
+        operation_id: The operation identifier
+        **counts: Counter increments (matched, processed, succeeded, skipped, failed)
+    """
+    redis = get_redis()
+    key = _operation_key(operation_id)
+    pipe = redis.pipeline(transaction=False)
+    for field, amount in counts.items():
+        if amount:
+            pipe.hincrby(key, field, amount)
+    pipe.hset(key, "updated_at", datetime.now(timezone.utc).isoformat())
+    await pipe.execute()
+
+
+async def finish_operation(operation_id: str, error: Optional[str] = None) -> None:
+    """
+    Mark an operation as completed, or failed if an error is given.
+
+    Args:
+        operation_id: The operation identifier
+        error: Optional error message
+    """
+    redis = get_redis()
+    fields = {
+        "state": "failed" if error else "completed",
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if error:
+        fields["error"] = error
+    await redis.hset(_operation_key(operation_id), mapping=fields)
+
+
+async def get_operation(operation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the current state and progress of an operation.
+
+    Args:
+        operation_id: The operation identifier
+
+    Returns:
+        Operation record, or None if unknown or expired
+    """
+    redis = get_redis()
+    op_hash = await redis.hgetall(_operation_key(operation_id))
+    if not op_hash:
+        return None
+
+    if op_hash.get("state") == "running" and _is_orphaned(op_hash):
+        error = "Interrupted: the process running the operation stopped"
+        now = datetime.now(timezone.utc).isoformat()
+        key = _operation_key(operation_id)
+        if await redis.eval(FAIL_ORPHANED_SCRIPT, 1, key, op_hash.get("heartbeat_at", ""), error, now):
+            op_hash.update({"state": "failed", "error": error, "updated_at": now})
+        else:
+            op_hash = await redis.hgetall(key)
+
+    operation: Dict[str, Any] = dict(op_hash)
+    operation["params"] = json.loads(operation.pop("params_json", "{}"))
+    operation.pop("heartbeat_at", None)
+    for field in ("matched", "processed", "succeeded", "skipped", "failed"):
+        operation[field] = int(operation.get(field, "0"))
+    return operation
+
+
+def _is_orphaned(op_hash: Dict[str, str]) -> bool:
+    """Whether a running operation's heartbeat is missing or too old."""
+    try:
+        heartbeat = float(op_hash.get("heartbeat_at", ""))
+    except ValueError:
+        # Records written before heartbeats existed
+        heartbeat = datetime.fromisoformat(op_hash["updated_at"]).timestamp()
+    return time.time() - heartbeat > OPERATION_STALE_SECONDS
+
+
+async def _heartbeat(operation_id: str) -> None:
+    """Refresh the heartbeat of a running operation until cancelled."""
+    redis = get_redis()
+    while True:
+        await asyncio.sleep(OPERATION_HEARTBEAT_SECONDS)
+        try:
+            await redis.hset(_operation_key(operation_id), "heartbeat_at", str(time.time()))
+        except Exception as e:
+            print(f"Operation {operation_id} heartbeat failed: {e}")
+
+
+def run_operation(operation_id: str, work: Awaitable[None]) -> None:
+    """
+    Run an operation coroutine in the background and record its outcome.
+
+    The operation's heartbeat is refreshed while it runs, so that it is
+    failed rather than left running if this process stops.
+
+    Args:
+        operation_id: The operation identifier
+        work: Coroutine performing the operation and reporting progress
+    """
+
+    async def runner() -> None:
+        heartbeat = asyncio.create_task(_heartbeat(operation_id))
+        try:
+            await work
+        except Exception as e:
+            print(f"Operation {operation_id} failed: {e}")
+            await finish_operation(operation_id, error=str(e))
+        else:
+            await finish_operation(operation_id)
+        finally:
+            heartbeat.cancel()
+
+    task = asyncio.create_task(runner())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
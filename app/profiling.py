@@ -0,0 +1,344 @@
+"""Profiling of job processing in workers.
+
+- Stage timings: workers time each job's stages (``STAGES``) and add them up
+  per task type, flushing the totals to Redis (``profile:stages``) every
+  ``stage_stats_flush_seconds``. Stages are exclusive: time spent in a stage
+  entered inside another (e.g. serializing events during a transition) is
+  only counted for the inner one.
+- Slow-job log: jobs whose stages took ``slow_job_threshold_seconds`` or more
+  in total are printed and kept with their breakdown in ``profile:slow_jobs``
+  (the latest ``slow_job_log_size``).
+- Sampling profiler: ``request_profile`` asks workers through the control
+  channel to sample their main thread's stack for a while and write the
+  counted stacks to ``profile_dir`` in the folded format read by flame graph
+  tools.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+from app.config import settings
+from app.redis_client import get_blocking_redis, get_redis
+
+
+# Stages of processing a job, in order
+STAGES = ("fetch", "lease", "parse", "execute", "persist", "events", "ack")
+
+STAGE_STATS_KEY = "profile:stages"  # Hash: "{task_type}|{stage}|seconds" / "{task_type}|{stage}|count"
+SLOW_JOBS_KEY = "profile:slow_jobs"  # List of JSON records, newest first
+CONTROL_CHANNEL = "control:workers"  # Pub/sub channel of worker control commands
+
+_SEP = "|"
+
+
+class StageTimings:
+    """Time spent in each stage of processing one job."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.started_ns = time.time_ns()
+        # [stage, start, end, index of the enclosing interval or None] of each
+        # stage block (epoch nanoseconds), kept for traced jobs (see app.tracing)
+        self.intervals: Optional[List[list]] = None
+        self._current: Optional[str] = None
+        self._since = 0.0
+        self._open: List[int] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Count the time spent inside the block for a stage."""
+        now = time.perf_counter()
+        outer = self._current
+        if outer is not None:
+            self.seconds[outer] += now - self._since
+        self._current, self._since = name, now
+        interval = None
+        if self.intervals is not None:
+            interval = [name, time.time_ns(), None, self._open[-1] if self._open else None]
+            self._open.append(len(self.intervals))
+            self.intervals.append(interval)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.seconds[name] += now - self._since
+            self._current, self._since = outer, now
+            if interval is not None:
+                interval[2] = time.time_ns()
+                self._open.pop()
+
+    def add(self, name: str, seconds: float, start_ns: Optional[int] = None) -> None:
+        """Count time measured elsewhere for a stage.
+
+        Args:
+            name: The stage
+            seconds: Time spent in it
+            start_ns: When it started (epoch nanoseconds), to keep its interval
+        """
+        self.seconds[name] += seconds
+        if self.intervals is not None and start_ns is not None:
+            self.intervals.append([name, start_ns, start_ns + int(seconds * 1e9), None])
+
+    @property
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+
+# Timings of the job the current task is processing, if any
+current_timings: ContextVar[Optional[StageTimings]] = ContextVar("current_timings", default=None)
+
+
+def time_stage(name: str) -> ContextManager[None]:
+    """Count the block for a stage of the job being processed, if any."""
+    timings = current_timings.get()
+    if timings is None:
+        return nullcontext()
+    return timings.stage(name)
+
+
+class StageStats:
+    """Stage timings added up per task type, flushed to Redis in the background."""
+
+    def __init__(self) -> None:
+        # (task type, stage) -> [seconds, count] not yet flushed
+        self._totals: Dict[tuple, List[float]] = defaultdict(lambda: [0.0, 0])
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, task_type: str, timings: StageTimings) -> None:
+        """Add a job's timings."""
+        for name, seconds in timings.seconds.items():
+            total = self._totals[(task_type, name)]
+            total[0] += seconds
+            total[1] += 1
+
+    async def flush(self) -> None:
+        """Add the totals recorded since the last flush to Redis."""
+        if not self._totals:
+            return
+        totals, self._totals = self._totals, defaultdict(lambda: [0.0, 0])
+        pipe = get_redis().pipeline(transaction=False)
+        for (task_type, name), (seconds, count) in totals.items():
+            prefix = f"{task_type}{_SEP}{name}{_SEP}"
+            pipe.hincrbyfloat(STAGE_STATS_KEY, prefix + "seconds", seconds)
+            pipe.hincrby(STAGE_STATS_KEY, prefix + "count", count)
+        await pipe.execute()
+
+    def start(self) -> None:
+        """Start flushing every stage_stats_flush_seconds (must be called from a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop flushing, after a final flush."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing stage timings: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.stage_stats_flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing stage timings: {e}")
+
+
+stage_stats = StageStats()
+
+
+async def record_job_timings(job_id: str, task_type: Optional[str], worker_id: str, timings: StageTimings) -> None:
+    """
+    Add a processed job's timings to the statistics and log it if slow.
+
+    Args:
+        job_id: The job identifier
+        task_type: Task type of the job
+        worker_id: Worker that processed it
+        timings: Its stage timings
+    """
+    if not settings.stage_stats_enabled:
+        return
+    task_type = task_type or ""
+    stage_stats.record(task_type, timings)
+
+    threshold = settings.slow_job_threshold_seconds
+    if threshold is None or timings.total < threshold:
+        return
+    stages_ms = {name: round(timings.seconds[name] * 1000, 3) for name in STAGES if name in timings.seconds}
+    print(f"Slow job {job_id} ({task_type}): {timings.total:.3f}s {stages_ms}")
+    record = {
+        "job_id": job_id,
+        "task_type": task_type,
+        "worker_id": worker_id,
+        "at": datetime.now(timezone.utc).isoformat(),
+        "total_ms": round(timings.total * 1000, 3),
+        "stages_ms": stages_ms,
+    }
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.lpush(SLOW_JOBS_KEY, json.dumps(record))
+        pipe.ltrim(SLOW_JOBS_KEY, 0, settings.slow_job_log_size - 1)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Error logging slow job {job_id}: {e}")
+
+
+async def get_stage_stats() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Stage timings of all workers since the last reset.
+
+    Returns:
+        Per task type and stage: jobs, total_seconds and mean_ms
+    """
+    raw = await get_redis().hgetall(STAGE_STATS_KEY)
+    stats: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(dict)
+    for field, value in raw.items():
+        task_type, name, metric = field.rsplit(_SEP, 2)
+        if metric != "count":
+            continue
+        count = int(value)
+        seconds = float(raw.get(f"{task_type}{_SEP}{name}{_SEP}seconds", 0))
+        stats[task_type][name] = {
+            "jobs": count,
+            "total_seconds": round(seconds, 6),
+            "mean_ms": round(seconds / count * 1000, 3) if count else 0.0,
+        }
+    return {
+        task_type: {name: stages[name] for name in STAGES if name in stages}
+        for task_type, stages in sorted(stats.items())
+    }
+
+
+async def reset_stage_stats() -> None:
+    """Drop the stage timings recorded so far."""
+    await get_redis().delete(STAGE_STATS_KEY)
+
+
+async def get_slow_jobs(limit: int) -> List[Dict[str, Any]]:
+    """The latest slow jobs, newest first."""
+    return [json.loads(record) for record in await get_redis().lrange(SLOW_JOBS_KEY, 0, limit - 1)]
+
+
+class SamplingProfiler:
+    """Samples the main thread's stack from a background thread."""
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration_seconds: float, name: str) -> bool:
+        """
+        Profile for a while, then write the profile to profile_dir.
+
+        Args:
+            duration_seconds: How long to sample
+            name: Prefix of the profile's file name
+
+        Returns:
+            False if a profile is already being taken
+        """
+        if self.running:
+            return False
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.main_thread().ident, duration_seconds, name),
+            name="sampling-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+        return True
+
+    def _sample(self, thread_id: int, duration_seconds: float, name: str) -> None:
+        interval = settings.profile_sample_interval_ms / 1000
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration_seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                stacks[";".join(reversed(names))] += 1
+            time.sleep(interval)
+
+        os.makedirs(settings.profile_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(settings.profile_dir, f"{name}-{stamp}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Wrote profile of {sum(stacks.values())} samples to {path}")
+
+
+profiler = SamplingProfiler()
+
+
+async def request_profile(duration_seconds: float, worker_id: Optional[str] = None) -> int:
+    """
+    Ask workers to take a sampling profile.
+
+    Args:
+        duration_seconds: How long to sample
+        worker_id: Only this worker (all workers if None)
+
+    Returns:
+        Number of workers that received the request
+    """
+    command = {"command": "profile", "duration_seconds": duration_seconds, "worker_id": worker_id}
+    return await get_redis().publish(CONTROL_CHANNEL, json.dumps(command))
+
+
+async def control_listener(worker_id: str) -> None:
+    """Run control commands addressed to a worker until cancelled."""
+    while True:
+        pubsub = get_blocking_redis().pubsub()
+        try:
+            await pubsub.subscribe(CONTROL_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    command = json.loads(message["data"])
+                except ValueError:
+                    continue
+                if command.get("worker_id") not in (None, worker_id):
+                    continue
+                if command.get("command") == "profile":
+                    duration = min(float(command.get("duration_seconds", 10)), settings.profile_max_duration_seconds)
+                    if profiler.start(duration, worker_id):
+                        print(f"Profiling for {duration:g}s")
+                    else:
+                        print("Profile request ignored: already profiling")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Control listener error: {e}")
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(1)
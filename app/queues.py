@@ -0,0 +1,232 @@
+"""Job queues: routing of jobs to job streams by task type.
+
+Every queue is a stream with its own consumer group. Task types use the
+default queue (``settings.job_stream``) unless ``job_queue_routes`` routes them
+to a named queue, stored in ``{job_stream}:{queue}``; with
+``job_queue_per_task_type`` every other task type gets a queue named after
+it. Workers read the queues they declare (``worker_queues`` /
+``worker_task_types``), so a slow task type cannot hold up the others and
+each worker pool can be scaled on its own queue's lag.
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.sharding import get_shards
+from app.streams import job_stream_entry
+
+
+DEFAULT_QUEUE = "default"
+QUEUES_KEY = "dtq:queues"  # Set of queue names jobs were enqueued to
+LEGACY_QUEUES_KEY = "queues"  # Its name before the dtq: prefix, still read
+
+
+def queue_for_task_type(task_type: Optional[str]) -> str:
+    """Name of the queue jobs of a task type are routed to."""
+    queue = settings.job_queue_routes.get(task_type or "")
+    if queue is None and settings.job_queue_per_task_type and task_type:
+        queue = task_type
+    return queue or DEFAULT_QUEUE
+
+
+def queue_stream(queue: str) -> str:
+    """Stream key of a queue."""
+    if queue == DEFAULT_QUEUE:
+        return settings.job_stream
+    return f"{settings.job_stream}:{queue}"
+
+
+def job_stream_for(task_type: Optional[str]) -> str:
+    """Stream key of the queue of a task type."""
+    return queue_stream(queue_for_task_type(task_type))
+
+
+def enqueue_job(
+    pipe: Any,
+    job_id: str,
+    partition_key: str,
+    task_type: str,
+    payload_json: str,
+    traceparent: Optional[str] = None,
+) -> None:
+    """
+    Queue the commands adding a job to its queue on a Redis pipeline.
+
+    Args:
+        pipe: Redis pipeline
+        job_id: The job identifier
+        partition_key: Partition key ("" if none)
+        task_type: Task type, selects the queue
+        payload_json: Encoded payload, included in inline mode
+        traceparent: Trace context of the job, if traced
+    """
+    queue = queue_for_task_type(task_type)
+    pipe.xadd(queue_stream(queue), job_stream_entry(job_id, partition_key, task_type, payload_json, traceparent))
+    if queue != DEFAULT_QUEUE:
+        pipe.sadd(QUEUES_KEY, queue)
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def served_queues() -> Optional[List[str]]:
+    """
+    Queues this worker declared to serve.
+
+    Returns:
+        Queue names from worker_queues and the queues of worker_task_types,
+        or None if the worker serves all queues
+    """
+    queues = _split(settings.worker_queues)
+    queues += [queue_for_task_type(task_type) for task_type in _split(settings.worker_task_types)]
+    if not queues:
+        return None
+    return list(dict.fromkeys(queues))
+
+
+async def list_queues() -> List[str]:
+    """
+    All queues: the default one, routed ones and those jobs were enqueued to.
+
+    Returns:
+        Queue names, the default queue first
+    """
+    # Each shard records the queues of the jobs enqueued on it
+    known = await asyncio.gather(*(redis.sunion(QUEUES_KEY, LEGACY_QUEUES_KEY) for redis in get_shards()))
+    named = set(settings.job_queue_routes.values()).union(*known)
+    named.discard(DEFAULT_QUEUE)
+    return [DEFAULT_QUEUE] + sorted(named)
+
+
+async def ensure_consumer_groups(queues: Iterable[str]) -> None:
+    """
+    Create the consumer group of each queue on every shard if it does not exist.
+
+    The default queue's group starts at new entries, as it always has; groups
+    of named queues start at the beginning, since their streams are created by
+    the first job routed to them, possibly before any worker subscribed.
+
+    Args:
+        queues: Queue names
+    """
+    queues = list(queues)
+    for redis in get_shards():
+        for queue in queues:
+            try:
+                await redis.xgroup_create(
+                    name=queue_stream(queue),
+                    groupname=settings.consumer_group,
+                    id="$" if queue == DEFAULT_QUEUE else "0",
+                    mkstream=True,  # Create stream if it doesn't exist
+                )
+            except Exception as e:
+                # Ignore "group already exists" errors
+                if "BUSYGROUP" not in str(e) and "already exists" not in str(e).lower():
+                    raise
+
+
+async def queue_stats(stream: str) -> Dict[str, int]:
+    """
+    Backlog of one queue's consumer group, summed over the shards.
+
+    Args:
+        stream: Stream key of the queue
+
+    Returns:
+        lag (entries not yet delivered), pending (delivered, not yet
+        acknowledged), entries (stream length) and delivered (entries ever
+        delivered to the group)
+    """
+    totals = {"lag": 0, "pending": 0, "entries": 0, "delivered": 0}
+    for stats in await asyncio.gather(*(_shard_queue_stats(redis, stream) for redis in get_shards())):
+        for name, value in stats.items():
+            totals[name] += value
+    return totals
+
+
+async def _shard_queue_stats(redis: Any, stream: str) -> Dict[str, int]:
+    entries = await redis.xlen(stream)
+    try:
+        groups = await redis.xinfo_groups(stream)
+    except Exception:
+        groups = []  # Stream does not exist yet
+    for group in groups:
+        if group.get("name") == settings.consumer_group:
+            lag = group.get("lag")
+            # Lag is unknown after some deletions; count the whole stream
+            return {
+                "lag": entries if lag is None else int(lag),
+                "pending": int(group.get("pending", 0)),
+                "entries": entries,
+                "delivered": int(group.get("entries-read") or 0),
+            }
+    return {"lag": entries, "pending": 0, "entries": entries, "delivered": 0}
+
+
+async def all_queue_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Backlog of every queue, for monitoring and scaling worker pools.
+
+    Returns:
+        Per queue name: stream, lag, pending, entries and delivered
+    """
+    stats: Dict[str, Dict[str, Any]] = {}
+    for queue in await list_queues():
+        stream = queue_stream(queue)
+        stats[queue] = {"stream": stream, **await queue_stats(stream)}
+    return stats
+
+
+def _lua_string(value: str) -> str:
+    # JSON string literals are valid Lua string literals for printable text
+    return json.dumps(value, ensure_ascii=False)
+
+
+# Lua helpers routing jobs to queues, with the same rules as the functions
+# above. Requires JOB_HASH_LUA (app.job_schema) before it.
+QUEUE_LUA = """
+local QUEUE_ROUTES = __ROUTES__
+local QUEUE_PER_TASK_TYPE = __PER_TASK_TYPE__
+local DEFAULT_JOB_STREAM = __JOB_STREAM__
+
+-- Stream key of the queue of a task type (see job_stream_for)
+local function job_stream_for(task_type)
+    local queue = QUEUE_ROUTES[task_type or '']
+    if not queue and QUEUE_PER_TASK_TYPE and task_type then
+        queue = task_type
+    end
+    if not queue or queue == '__DEFAULT_QUEUE__' then
+        return DEFAULT_JOB_STREAM
+    end
+    return DEFAULT_JOB_STREAM .. ':' .. queue
+end
+
+-- Add a job to a queue stream, recording named queues in queues_key;
+-- extra: additional entry fields. A job deferred by admission control is no
+-- longer released once enqueued (see app.admission).
+local function job_enqueue(key, stream, queues_key, inline_payload, extra)
+    job_set(key, 'deferred', '')
+    local entry = job_stream_entry(key, inline_payload)
+    for _, item in ipairs(extra or {}) do
+        table.insert(entry, item)
+    end
+    if stream ~= DEFAULT_JOB_STREAM then
+        redis.call('SADD', queues_key, string.sub(stream, #DEFAULT_JOB_STREAM + 2))
+    end
+    return redis.call('XADD', stream, '*', unpack(entry))
+end
+"""
+
+QUEUE_LUA = (
+    QUEUE_LUA
+    .replace("__ROUTES__", "{" + ", ".join(
+        f"[{_lua_string(task_type)}] = {_lua_string(queue)}"
+        for task_type, queue in sorted(settings.job_queue_routes.items())
+    ) + "}")
+    .replace("__PER_TASK_TYPE__", "true" if settings.job_queue_per_task_type else "false")
+    .replace("__JOB_STREAM__", _lua_string(settings.job_stream))
+    .replace("__DEFAULT_QUEUE__", DEFAULT_QUEUE)
+)
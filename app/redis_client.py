@@ -1,37 +1,198 @@
-"""Shared async Redis client singleton."""
+"""Shared async Redis clients.
+
+Two clients with separate connection pools are kept per process: one for
+regular commands and one for blocking reads (XREADGROUP with BLOCK, pub/sub),
+so connections parked in blocking calls never starve regular commands.
+Connections are opened lazily, so the clients can be created outside of an
+event loop and ``get_redis()`` is a plain function. Clients are created by
+the ClientBackend selected with REDIS_BACKEND: RedisBackend connects to Redis
+servers, app.memory_backend.MemoryBackend (tests and embedded mode only) to
+in-process test servers. Nodes holding
+job data besides REDIS_URL (see app.sharding) get a pair of clients each,
+created on first use.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
 
 import redis.asyncio as aioredis
-from typing import Optional
+from redis.asyncio.connection import parse_url
+from redis.asyncio.retry import Retry
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import ConnectionError
 
 from app.config import settings
 
 
+def _parse_sentinels(value: str) -> List[Tuple[str, int]]:
+    """Parse "host:port,host:port" into sentinel addresses."""
+    sentinels = []
+    for address in value.split(","):
+        host, _, port = address.strip().rpartition(":")
+        sentinels.append((host, int(port)))
+    return sentinels
+
+
+def _connection_kwargs(*, blocking: bool) -> Dict[str, Any]:
+    """Connection and pool options of the regular or the blocking client."""
+    kwargs: Dict[str, Any] = {
+        "encoding": "utf-8",
+        "decode_responses": True,
+        "max_connections": (
+            settings.redis_blocking_max_connections if blocking else settings.redis_max_connections
+        ),
+        "socket_connect_timeout": settings.redis_connect_timeout_seconds,
+        # Blocking reads wait up to their BLOCK time for a reply
+        "socket_timeout": (
+            settings.redis_blocking_socket_timeout_seconds if blocking else settings.redis_socket_timeout_seconds
+        ),
+        "socket_keepalive": True,
+        "health_check_interval": settings.redis_health_check_interval_seconds,
+        # Only connection errors are retried: after a read timeout the command
+        # may already have been applied, and retrying a write could repeat it
+        "retry": Retry(
+            EqualJitterBackoff(
+                cap=settings.redis_retry_backoff_cap_ms / 1000,
+                base=settings.redis_retry_backoff_base_ms / 1000,
+            ),
+            settings.redis_retry_attempts,
+            supported_errors=(ConnectionError,),
+        ),
+    }
+    if not settings.redis_hiredis:
+        # hiredis is used automatically when installed; fall back to the pure Python parser
+        from redis._parsers import _AsyncRESP2Parser
+        kwargs["parser_class"] = _AsyncRESP2Parser
+    return kwargs
+
+
+class ClientBackend(ABC):
+    """Where the Redis clients connect to.
+
+    Every backend hands out redis.asyncio clients: the rest of the code always
+    speaks Redis commands, scripts and functions, whatever the backend.
+    """
+
+    @abstractmethod
+    def create_client(self, url: Optional[str], *, blocking: bool) -> aioredis.Redis:
+        """
+        Create a client with its own connection pool.
+
+        Args:
+            url: Node to connect to; None for REDIS_URL
+            blocking: Configure the client for blocking reads
+
+        Returns:
+            The client; connections are opened on first use
+        """
+
+
+class RedisBackend(ClientBackend):
+    """Redis servers over the network."""
+
+    def create_client(self, url: Optional[str], *, blocking: bool) -> aioredis.Redis:
+        kwargs = _connection_kwargs(blocking=blocking)
+
+        if settings.redis_sentinels and url is None:
+            # The master is discovered through Sentinel; credentials and database come from REDIS_URL
+            url_kwargs = parse_url(settings.redis_url)
+            for key in ("host", "port"):
+                url_kwargs.pop(key, None)
+            sentinel = aioredis.Sentinel(
+                _parse_sentinels(settings.redis_sentinels),
+                socket_connect_timeout=settings.redis_connect_timeout_seconds,
+                socket_timeout=settings.redis_connect_timeout_seconds,
+            )
+            return sentinel.master_for(settings.redis_sentinel_master, **url_kwargs, **kwargs)
+
+        # Wait up to redis_pool_timeout_seconds for a free connection instead of
+        # failing when all connections are in use
+        pool = aioredis.BlockingConnectionPool.from_url(
+            url or settings.redis_url,
+            timeout=settings.redis_pool_timeout_seconds,
+            **kwargs,
+        )
+        return aioredis.Redis(connection_pool=pool)
+
+
+redis_backend = RedisBackend()
+
+
+def get_backend() -> ClientBackend:
+    """The storage backend selected by REDIS_BACKEND."""
+    if settings.redis_backend == "memory":
+        # Imported on use: it needs the optional fakeredis package
+        from app import memory_backend
+        return memory_backend.backend
+    if settings.redis_backend != "redis":
+        raise ValueError(f"Unknown Redis backend: {settings.redis_backend}")
+    return redis_backend
+
+
+def create_client(*, blocking: bool = False, url: Optional[str] = None) -> aioredis.Redis:
+    """
+    Create a Redis client of the selected backend with its own connection pool.
+
+    Args:
+        blocking: Configure the client for blocking reads (longer socket
+            timeout, separate pool size)
+        url: Node to connect to; defaults to REDIS_URL (or the master
+            discovered through Sentinel)
+
+    Returns:
+        The client; connections are opened on first use
+    """
+    return get_backend().create_client(url, blocking=blocking)
+
+
 class RedisClient:
-    """Singleton async Redis client."""
-    
+    """Per-process Redis clients."""
+
     _instance: Optional[aioredis.Redis] = None
-    
+    _blocking_instance: Optional[aioredis.Redis] = None
+    _node_instances: Dict[Tuple[str, bool], aioredis.Redis] = {}  # (url, blocking) -> client
+
     @classmethod
-    async def get_client(cls) -> aioredis.Redis:
-        """Get or create the Redis client instance."""
+    def get_client(cls) -> aioredis.Redis:
+        """Get or create the client for regular commands."""
         if cls._instance is None:
-            cls._instance = aioredis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
+            cls._instance = create_client()
         return cls._instance
-    
+
+    @classmethod
+    def get_blocking_client(cls) -> aioredis.Redis:
+        """Get or create the client for blocking reads and subscriptions."""
+        if cls._blocking_instance is None:
+            cls._blocking_instance = create_client(blocking=True)
+        return cls._blocking_instance
+
+    @classmethod
+    def get_node_client(cls, url: str, *, blocking: bool = False) -> aioredis.Redis:
+        """Get or create a client of the node at a URL (REDIS_URL's are the clients above)."""
+        if url == settings.redis_url:
+            return cls.get_blocking_client() if blocking else cls.get_client()
+        client = cls._node_instances.get((url, blocking))
+        if client is None:
+            client = cls._node_instances[(url, blocking)] = create_client(blocking=blocking, url=url)
+        return client
+
     @classmethod
     async def close(cls) -> None:
-        """Close the Redis client connection."""
-        if cls._instance is not None:
-            await cls._instance.aclose()
-            cls._instance = None
+        """Close the Redis client connections."""
+        for client in (cls._instance, cls._blocking_instance, *cls._node_instances.values()):
+            if client is not None:
+                await client.aclose()
+        cls._instance = None
+        cls._blocking_instance = None
+        cls._node_instances = {}
+
 
+# Convenience functions
+def get_redis() -> aioredis.Redis:
+    """Get the Redis client for regular commands."""
+    return RedisClient.get_client()
 
-# Convenience function
-async def get_redis() -> aioredis.Redis:
-    """Get the Redis client instance."""
-    return await RedisClient.get_client()
 
+def get_blocking_redis() -> aioredis.Redis:
+    """Get the Redis client for blocking reads (XREADGROUP BLOCK, pub/sub)."""
+    return RedisClient.get_blocking_client()
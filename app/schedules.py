@@ -0,0 +1,178 @@
+"""Recurring job templates and fire-time computation for the cron scheduler."""
+
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cron import CronExpression
+from app.models import ScheduleTemplate
+from app.redis_client import get_redis
+
+
+SCHEDULES_KEY = "schedules"  # name -> template JSON
+NEXT_RUN_KEY = "schedules:next_run"  # name -> next fire time (epoch ms)
+
+
+def _to_ms(dt: datetime) -> int:
+    return int(dt.timestamp() * 1000)
+
+
+def _from_ms(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc)
+
+
+def next_fire_after(template: ScheduleTemplate, after: datetime) -> datetime:
+    """
+    Compute the first fire time of a schedule strictly after a given time.
+
+    Interval schedules fire on multiples of the interval since the epoch so
+    that every scheduler instance computes the same times.
+
+    Args:
+        template: The schedule
+        after: Reference time (UTC)
+
+    Returns:
+        Next fire time
+    """
+    if template.cron is not None:
+        return CronExpression(template.cron).next_after(after)
+
+    interval_ms = template.interval_seconds * 1000
+    next_ms = (math.floor(_to_ms(after) / interval_ms) + 1) * interval_ms
+    return _from_ms(next_ms)
+
+
+def due_runs(
+    template: ScheduleTemplate,
+    next_run: Optional[datetime],
+    now: datetime,
+) -> Tuple[List[datetime], datetime]:
+    """
+    Decide which runs to fire now, applying the misfire policy.
+
+    Args:
+        template: The schedule
+        next_run: Stored next fire time, or None if never scheduled
+        now: Current time
+
+    Returns:
+        (scheduled times to fire, new next fire time)
+    """
+    if next_run is None:
+        return [], next_fire_after(template, now)
+    if now < next_run:
+        return [], next_run
+
+    # Collect missed fire times, bounded so long outages stay cheap
+    missed = [next_run]
+    while len(missed) < template.max_catch_up:
+        following = next_fire_after(template, missed[-1])
+        if following > now:
+            break
+        missed.append(following)
+    new_next_run = next_fire_after(template, now)
+
+    grace = timedelta(seconds=template.misfire_grace_seconds)
+    on_time = [t for t in missed if now - t <= grace]
+
+    if template.misfire_policy == "catch_up":
+        return missed, new_next_run
+    if template.misfire_policy == "fire_once":
+        return missed[-1:], new_next_run
+    # skip: only runs within the grace period fire
+    return on_time[-1:], new_next_run
+
+
+async def save_schedule(template: ScheduleTemplate, *, preserve_next_run: bool = False) -> Dict[str, Any]:
+    """
+    Create or replace a schedule.
+
+    Args:
+        template: The schedule
+        preserve_next_run: Keep the stored next fire time if the template is
+            unchanged, so runs missed during downtime are still caught up
+
+    Returns:
+        The stored schedule with its next fire time
+
+    Raises:
+        ValueError: If the cron expression is invalid or never fires
+    """
+    now = datetime.now(timezone.utc)
+    next_run = next_fire_after(template, now)
+    template_json = template.model_dump_json()
+
+    redis = get_redis()
+    if preserve_next_run:
+        pipe = redis.pipeline(transaction=False)
+        pipe.hget(SCHEDULES_KEY, template.name)
+        pipe.hget(NEXT_RUN_KEY, template.name)
+        stored_json, stored_next_run = await pipe.execute()
+        if stored_json == template_json and stored_next_run is not None:
+            return {**template.model_dump(mode="json"), "next_run": _from_ms(int(stored_next_run)).isoformat()}
+
+    pipe = redis.pipeline(transaction=True)
+    pipe.hset(SCHEDULES_KEY, template.name, template_json)
+    pipe.hset(NEXT_RUN_KEY, template.name, _to_ms(next_run))
+    await pipe.execute()
+
+    return {**template.model_dump(mode="json"), "next_run": next_run.isoformat()}
+
+
+async def load_schedules() -> List[Tuple[ScheduleTemplate, Optional[datetime]]]:
+    """
+    Load all schedules with their stored next fire time.
+
+    Returns:
+        List of (template, next fire time or None)
+    """
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(SCHEDULES_KEY)
+    pipe.hgetall(NEXT_RUN_KEY)
+    templates_json, next_runs = await pipe.execute()
+
+    schedules = []
+    for name, template_json in sorted(templates_json.items()):
+        try:
+            template = ScheduleTemplate(**json.loads(template_json))
+        except Exception:
+            # Skip invalid templates
+            continue
+        next_run = _from_ms(int(next_runs[name])) if name in next_runs else None
+        schedules.append((template, next_run))
+    return schedules
+
+
+async def list_schedules() -> List[Dict[str, Any]]:
+    """List all schedules with their next fire time."""
+    return [
+        {**template.model_dump(mode="json"), "next_run": next_run.isoformat() if next_run else None}
+        for template, next_run in await load_schedules()
+    ]
+
+
+async def set_next_run(name: str, next_run: datetime) -> None:
+    """Store the next fire time of a schedule."""
+    redis = get_redis()
+    await redis.hset(NEXT_RUN_KEY, name, _to_ms(next_run))
+
+
+async def delete_schedule(name: str) -> bool:
+    """
+    Delete a schedule.
+
+    Args:
+        name: Schedule name
+
+    Returns:
+        True if the schedule existed
+    """
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=True)
+    pipe.hdel(SCHEDULES_KEY, name)
+    pipe.hdel(NEXT_RUN_KEY, name)
+    deleted, _ = await pipe.execute()
+    return bool(deleted)
@@ -0,0 +1,221 @@
+"""Placement of job data across several Redis nodes.
+
+With ``REDIS_SHARDS`` set, job data is spread over those nodes by consistent
+hashing of the job ID. A shard is a self-contained cell: a job's hash and large values, its event
+log, the job queue streams with their consumer group, the job events stream,
+the completion counter and the deferred set all live on the job's node, so
+every Lua script and MULTI touching a job still runs on a single node.
+Workflows and map jobs live on the node of their own ID, and their jobs are
+given IDs that hash to the same node (``new_job_id``).
+
+Everything else (memoized results, schedules, operations, analytics, stage
+timings, the DLQ, the control channel and locks) stays on ``REDIS_URL``,
+which may also be one of the shards. Workers read the queues of every shard;
+``/metrics`` and ``/jobs`` aggregate over all of them.
+
+Without ``REDIS_SHARDS`` there is a single shard, served by the REDIS_URL
+clients, and every helper here resolves to ``get_redis()``.
+
+The shard set is fixed once there is job data: nothing moves data between
+nodes, so with other shards (or vnodes) some jobs would be looked up on a
+node that does not hold them, and workflows and map jobs would be split
+from their jobs. ``check_shard_set`` records the shard set on first start
+and refuses to run with another one.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import inspect
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID, uuid4
+
+import redis.asyncio as aioredis
+
+from app.config import settings
+from app.redis_client import RedisClient, get_blocking_redis, get_redis
+
+
+SHARD_SET_KEY = "dtq:shard_set"  # Shard set job data was placed with (see check_shard_set), on REDIS_URL
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping identifiers to node indexes.
+
+    Each node is placed at ``vnodes`` points derived from its name, so load
+    spreads evenly and a node's removal only moves the identifiers it held.
+    """
+
+    def __init__(self, nodes: Sequence[str], vnodes: int):
+        points = sorted(
+            (_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(nodes)
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [index for _, index in points]
+
+    def node_for(self, identifier: str) -> int:
+        """Index of the node owning an identifier: the first point clockwise of its hash."""
+        position = bisect.bisect(self._hashes, _hash(identifier)) % len(self._hashes)
+        return self._nodes[position]
+
+
+# (REDIS_SHARDS, vnodes) the ring was built for, shard URLs, ring
+_ring: Optional[Tuple[Tuple[Optional[str], int], List[str], Optional[HashRing]]] = None
+
+
+def _placement() -> Tuple[List[str], Optional[HashRing]]:
+    global _ring
+    config = (settings.redis_shards, settings.redis_shard_vnodes)
+    if _ring is None or _ring[0] != config:
+        urls = list(dict.fromkeys(url.strip() for url in (settings.redis_shards or "").split(",") if url.strip()))
+        if urls and settings.redis_sentinels:
+            raise ValueError("REDIS_SHARDS cannot be combined with REDIS_SENTINELS")
+        _ring = (config, urls, HashRing(urls, settings.redis_shard_vnodes) if len(urls) > 1 else None)
+    return _ring[1], _ring[2]
+
+
+def _shard_set() -> str:
+    urls = _placement()[0]
+    if len(urls) <= 1:
+        return json.dumps({"shards": urls})
+    return json.dumps({"shards": sorted(urls), "vnodes": settings.redis_shard_vnodes})
+
+
+async def check_shard_set() -> None:
+    """
+    Record the shard set on first start and check it on every later one.
+
+    With REDIS_SHARDS_ACCEPT_CHANGE the current shard set replaces the
+    recorded one, for when the job data was moved by hand or discarded.
+
+    Raises:
+        RuntimeError: If REDIS_SHARDS or REDIS_SHARD_VNODES differ from those
+            the job data was placed with
+    """
+    current = _shard_set()
+    redis = get_redis()
+    if settings.redis_shards_accept_change:
+        await redis.set(SHARD_SET_KEY, current)
+        return
+    if await redis.set(SHARD_SET_KEY, current, nx=True):
+        return
+    recorded = await redis.get(SHARD_SET_KEY)
+    if recorded != current:
+        raise RuntimeError(
+            f"Job data was placed on shard set {recorded}, not {current}: the shard set cannot change "
+            "once there is job data (set REDIS_SHARDS_ACCEPT_CHANGE=true after moving or discarding it)"
+        )
+
+
+def shard_count() -> int:
+    """Number of shards (1 without REDIS_SHARDS)."""
+    return max(1, len(_placement()[0]))
+
+
+def shard_index(identifier: str) -> int:
+    """Shard holding the data of a job, workflow or map job ID."""
+    ring = _placement()[1]
+    return ring.node_for(identifier) if ring is not None else 0
+
+
+def get_shard(index: int) -> aioredis.Redis:
+    """Client for regular commands on a shard."""
+    urls = _placement()[0]
+    return RedisClient.get_node_client(urls[index]) if urls else get_redis()
+
+
+def get_blocking_shard(index: int) -> aioredis.Redis:
+    """Client for blocking reads on a shard."""
+    urls = _placement()[0]
+    return RedisClient.get_node_client(urls[index], blocking=True) if urls else get_blocking_redis()
+
+
+def get_shards() -> List[aioredis.Redis]:
+    """Clients of all shards, by shard index."""
+    return [get_shard(index) for index in range(shard_count())]
+
+
+def get_redis_for(identifier: str) -> aioredis.Redis:
+    """Client of the shard holding the data of a job, workflow or map job ID."""
+    return get_shard(shard_index(identifier))
+
+
+def get_nodes() -> List[aioredis.Redis]:
+    """Clients of every node, REDIS_URL's first, each once; for summing counters."""
+    nodes = [get_redis()]
+    for client in get_shards():
+        if all(client is not node for node in nodes):
+            nodes.append(client)
+    return nodes
+
+
+def new_job_id(colocate_with: Optional[str] = None) -> UUID:
+    """
+    Generate a job ID.
+
+    Args:
+        colocate_with: ID whose shard the job must live on, e.g. its
+            workflow's, so scripts can touch both atomically
+
+    Returns:
+        A random UUID (redrawn until it hashes to that shard)
+    """
+    job_id = uuid4()
+    if colocate_with is not None and shard_count() > 1:
+        target = shard_index(colocate_with)
+        while shard_index(str(job_id)) != target:
+            job_id = uuid4()
+    return job_id
+
+
+def group_by_shard(identifiers: Iterable[str]) -> Dict[int, List[int]]:
+    """Positions of identifiers per shard index."""
+    groups: Dict[int, List[int]] = {}
+    for position, identifier in enumerate(identifiers):
+        groups.setdefault(shard_index(identifier), []).append(position)
+    return groups
+
+
+async def pipeline_by_shard(
+    identifiers: Sequence[str],
+    queue: Callable[[Any, int], Any],
+    *,
+    transaction: bool = False,
+) -> List[List[Any]]:
+    """
+    Run per-identifier commands in one pipeline per shard, all shards concurrently.
+
+    Args:
+        identifiers: Job IDs (or other IDs placed by shard_index)
+        queue: Called with the pipeline of an identifier's shard and the
+            identifier's position to queue its commands (may be a coroutine
+            function, e.g. for scripts called with client=pipe)
+        transaction: Wrap each shard's commands in MULTI/EXEC
+
+    Returns:
+        Per identifier, in order, the replies of the commands queued for it
+    """
+    replies: List[List[Any]] = [[] for _ in identifiers]
+
+    async def run(index: int, positions: List[int]) -> None:
+        pipe = get_shard(index).pipeline(transaction=transaction)
+        spans = []
+        for position in positions:
+            start = len(pipe)
+            queued = queue(pipe, position)
+            if inspect.isawaitable(queued):
+                await queued
+            spans.append((position, start, len(pipe)))
+        results = await pipe.execute()
+        for position, start, end in spans:
+            replies[position] = results[start:end]
+
+    await asyncio.gather(*(run(index, positions) for index, positions in group_by_shard(identifiers).items()))
+    return replies
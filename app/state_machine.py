@@ -0,0 +1,974 @@
+"""Atomic job status transitions executed inside Redis.
+
+``ALLOWED_TRANSITIONS`` is compiled into a Redis Function library that
+validates a transition, updates the job hash, counters and job queue, and
+writes the transition's events in one atomic call, so concurrent transitions
+(e.g. a cancel racing a worker finishing the job) cannot interleave. The
+library is versioned by its source, so processes running different versions
+during a deploy each call their own functions. Where FUNCTION is unavailable
+the same Lua code runs as a cached script (EVALSHA). Libraries of older
+versions are deleted once no process has loaded them for
+STALE_LIBRARY_SECONDS; a process still calling one loads it again.
+"""
+
+import asyncio
+import hashlib
+import json
+import weakref
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.events import EventRecord, job_events_key, serialize_job_event
+from app.job_schema import (
+    JOB_HASH_LUA,
+    decode_job_hash,
+    encode_job_fields,
+    job_key,
+    job_sub_keys,
+    now_ms,
+    read_jobs,
+    to_ms,
+)
+from app.models import JobStatus
+from app.profiling import time_stage
+from app.queues import QUEUE_LUA, QUEUES_KEY, job_stream_for
+from app.sharding import get_shard, group_by_shard
+from app.streams import inline_payloads
+from app.transitions import ALLOWED_TRANSITIONS
+from app.workflows import WORKFLOW_LUA, workflow_plan
+
+
+class TransitionOutcome(str, Enum):
+    """Result of a transition call."""
+
+    OK = "OK"
+    NOT_FOUND = "NOT_FOUND"
+    INVALID = "INVALID"  # Not allowed by ALLOWED_TRANSITIONS
+    UNEXPECTED = "UNEXPECTED"  # Current status not among the expected ones
+    LEASE_HELD = "LEASE_HELD"  # Another worker holds an unexpired lease
+    LEASE_LOST = "LEASE_LOST"  # The caller no longer holds the lease
+    ERROR = "ERROR"  # The call failed (see TransitionResult.error); nothing was changed
+
+
+@dataclass
+class TransitionResult:
+    """Outcome of a transition and the job's state after it."""
+
+    outcome: TransitionOutcome
+    previous_status: Optional[str]
+    fields: Dict[str, Optional[str]] = field(default_factory=dict)  # Requested return fields
+    error: Optional[Exception] = None  # Error of the call, with outcome ERROR
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome == TransitionOutcome.OK
+
+
+_LIBRARY_BODY = """
+local ALLOWED = __ALLOWED__
+
+local function contains(list, value)
+    for _, item in ipairs(list) do
+        if item == value then
+            return true
+        end
+    end
+    return false
+end
+
+local function set_args(status, fields)
+    local args = {'status', status}
+    for name, value in pairs(fields or {}) do
+        table.insert(args, name)
+        table.insert(args, value)
+    end
+    return args
+end
+
+-- Move a job to a status if ALLOWED permits it; false if it does not
+local function change_status(key, current, target, fields)
+    if not contains(ALLOWED[current] or {}, target) then
+        return false
+    end
+    job_set(key, unpack(set_args(target, fields)))
+    return true
+end
+
+-- Events are pre-serialized by the caller: {compact log line, stream entry fields}
+local function write_events(stream_key, log_key, events, request)
+    for _, event in ipairs(events or {}) do
+        redis.call('XADD', stream_key, 'MAXLEN', '~', request.stream_maxlen, '*', unpack(event[2]))
+        redis.call('APPEND', log_key, event[1])
+    end
+    if events and #events > 0 then
+        redis.call('EXPIRE', log_key, request.retention_seconds, 'NX')
+    end
+end
+
+local function reply(outcome, previous, job_key, request)
+    local result = {outcome, previous}
+    local names = request.return_fields or {}
+    if #names > 0 then
+        for i = 1, #names do
+            result[2 + i] = job_get(job_key, names[i])
+        end
+    end
+    return result
+end
+
+"""
+
+_FUNCTIONS_BODY = """
+-- Job keys, as passed by every function: job hash, large payload, large
+-- result, job event log, events stream
+
+-- KEYS: job keys
+-- ARGV[1]: JSON request {worker_id, now, expires_at, fields, return_fields, events, ...}
+local function start_job(keys, args)
+    local request = cjson.decode(args[1])
+    local current = job_get(keys[1], 'status')
+    if not current then
+        return {'NOT_FOUND', false}
+    end
+
+    local owner = job_get(keys[1], 'lease_owner') or ''
+    local expires = tonumber(job_get(keys[1], 'lease_expires_at') or '')
+    if expires ~= nil and expires < 1e11 then
+        expires = expires * 1000  -- Seconds, written before the compact layout
+    end
+    local lease_free = owner == '' or (expires ~= nil and expires < tonumber(request.now))
+    -- A running job whose lease expired was abandoned by its worker and may run again
+    local reclaim = current == 'RUNNING' and owner ~= '' and lease_free
+    if not reclaim and not contains(ALLOWED[current] or {}, 'RUNNING') then
+        return reply('INVALID', current, keys[1], request)
+    end
+    if not lease_free then
+        return reply('LEASE_HELD', current, keys[1], request)
+    end
+
+    local fields = request.fields or {}
+    fields['attempts'] = tostring(tonumber(job_get(keys[1], 'attempts') or '0') + 1)
+    fields['lease_owner'] = request.worker_id
+    fields['lease_expires_at'] = request.expires_at
+    job_set(keys[1], unpack(set_args('RUNNING', fields)))
+    write_events(keys[5], keys[4], request.events, request)
+    return reply('OK', current, keys[1], request)
+end
+
+-- KEYS: job keys, completed counter, queue stream of the job, queues set,
+--       then the keys of the job's workflow plan if any (see app.workflows)
+-- ARGV[1]: JSON request {steps, expected, create, lease_owner, release_lease,
+--          fields, enqueue, workflow, return_fields, events, ...}
+local function transition_job(keys, args)
+    local request = cjson.decode(args[1])
+    local current = job_get(keys[1], 'status')
+    local create = false
+    if not current then
+        if not request.create then
+            return {'NOT_FOUND', false}
+        end
+        -- Recreated (e.g. from a dead letter entry) as if in the first expected status
+        current = request.expected[1]
+        create = true
+    end
+    if request.expected and not contains(request.expected, current) then
+        return reply('UNEXPECTED', current, keys[1], request)
+    end
+    -- Either copy of a hedged job may complete it
+    if request.lease_owner and job_get(keys[1], 'lease_owner') ~= request.lease_owner
+        and job_get(keys[1], 'hedge_owner') ~= request.lease_owner then
+        return reply('LEASE_LOST', current, keys[1], request)
+    end
+
+    local status = current
+    for _, target in ipairs(request.steps) do
+        if not contains(ALLOWED[status] or {}, target) then
+            return reply('INVALID', current, keys[1], request)
+        end
+        status = target
+    end
+
+    -- A workflow job's transition updates its workflow; the caller must declare
+    -- the workflow's keys, so it is told the workflow to call again with them
+    local job_id = string.sub(keys[1], 5)
+    local workflow_id = job_get(keys[1], 'workflow_id')
+    local role = workflow_id and workflow_role(current, status)
+    local workflow = false
+    if role then
+        if not request.workflow then
+            return {'WORKFLOW', current, workflow_id}
+        end
+        workflow = workflow_prepare(keys, 8, workflow_id, job_id, role, request.workflow)
+        if not workflow then
+            return redis.error_reply('ERR workflow plan does not match workflow ' .. workflow_id)
+        end
+        if workflow == 'expired' then
+            workflow = false
+        end
+    end
+
+    local fields = request.fields or {}
+    if request.enqueue then
+        if job_stream_for(fields['task_type'] or job_get(keys[1], 'task_type')) ~= keys[7] then
+            return redis.error_reply('ERR queue stream ' .. keys[7] .. ' does not match the task type')
+        end
+    end
+    if request.release_lease or request.enqueue then
+        fields['lease_owner'] = ''
+        fields['lease_expires_at'] = ''
+        fields['hedge_owner'] = ''
+    end
+    if create then
+        local args = {'v', JOB_SCHEMA_VERSION}
+        for name, value in pairs(request.create) do
+            table.insert(args, name)
+            table.insert(args, value)
+        end
+        job_set(keys[1], unpack(args))
+    end
+    job_set(keys[1], unpack(set_args(status, fields)))
+    if status == 'SUCCEEDED' then
+        redis.call('INCR', keys[6])
+    end
+    if request.enqueue then
+        job_enqueue(keys[1], keys[7], keys[8], request.enqueue.inline, request.enqueue.fields)
+    end
+    write_events(keys[5], keys[4], request.events, request)
+    if workflow then
+        workflow_record(workflow, job_id, role, request)
+    end
+    return reply('OK', current, keys[1], request)
+end
+
+-- Merge one chunk's partial aggregate into its map job (see app.map_jobs);
+-- each chunk is merged at most once, and the last one completes the parent
+-- job if it is still RUNNING
+-- KEYS: parent job keys, completed counter, map hash, merged chunks, items, errors
+-- ARGV[1]: JSON request {chunk_index, succeeded, failed, partial, errors,
+--          max_errors, now, events (by final status), ...}
+local function merge_map_chunk(keys, args)
+    local request = cjson.decode(args[1])
+    local map_key, done_key, items_key, errors_key = keys[7], keys[8], keys[9], keys[10]
+    if redis.call('EXISTS', map_key) == 0 then
+        return false  -- Expired
+    end
+    if redis.call('SADD', done_key, request.chunk_index) == 0 then
+        return false  -- Chunk already merged
+    end
+    -- Created by the first merges, these keys expire with the map
+    local ttl = redis.call('PTTL', map_key)
+    if ttl > 0 then
+        redis.call('PEXPIRE', done_key, ttl)
+    end
+
+    redis.call('HINCRBY', map_key, 'items_succeeded', request.succeeded)
+    redis.call('HINCRBY', map_key, 'items_failed', request.failed)
+
+    local reducer = redis.call('HGET', map_key, 'reducer')
+    if request.partial ~= '' then
+        if reducer == 'sum' then
+            redis.call('HINCRBYFLOAT', map_key, 'acc', request.partial)
+        elseif reducer == 'min' or reducer == 'max' then
+            local current = redis.call('HGET', map_key, 'acc')
+            local value = tonumber(request.partial)
+            if not current
+                or (reducer == 'min' and value < tonumber(current))
+                or (reducer == 'max' and value > tonumber(current)) then
+                redis.call('HSET', map_key, 'acc', request.partial)
+            end
+        end
+    end
+
+    for _, err in ipairs(request.errors) do
+        redis.call('LPUSH', errors_key, err)
+    end
+    if #request.errors > 0 then
+        redis.call('LTRIM', errors_key, 0, request.max_errors - 1)
+        if ttl > 0 then
+            redis.call('PEXPIRE', errors_key, ttl)
+        end
+    end
+
+    local chunks_done = redis.call('HINCRBY', map_key, 'chunks_done', 1)
+    if chunks_done < tonumber(redis.call('HGET', map_key, 'chunks_total')) then
+        return false
+    end
+    redis.call('DEL', items_key)
+
+    -- Last chunk: complete the parent job
+    local m = redis.call('HMGET', map_key, 'items_succeeded', 'items_failed', 'acc', 'fail_on_item_error')
+    local value = cjson.null
+    if reducer == 'count' then
+        value = tonumber(m[1])
+    elseif m[3] then
+        value = tonumber(m[3])
+    end
+    local status = 'SUCCEEDED'
+    if m[4] == '1' and tonumber(m[2]) > 0 then
+        status = 'FAILED'
+    end
+    local result = cjson.encode({
+        reducer = reducer,
+        value = value,
+        items_succeeded = tonumber(m[1]),
+        items_failed = tonumber(m[2]),
+    })
+
+    local current = job_get(keys[1], 'status')
+    if current ~= 'RUNNING' or not change_status(keys[1], current, status, {updated_at = request.now, result = result}) then
+        -- Cancelled (or otherwise settled) while its chunks ran: left as it is
+        redis.call('HSET', map_key, 'status', current or 'UNKNOWN')
+        return false
+    end
+    if status == 'SUCCEEDED' then
+        redis.call('INCR', keys[6])
+    end
+    write_events(keys[5], keys[4], request.events[status], request)
+    redis.call('HSET', map_key, 'status', status)
+    return status
+end
+
+-- Start a second copy of a running job (see app.hedging)
+-- KEYS: job keys
+-- ARGV[1]: JSON request {worker_id, now, return_fields, events, ...}
+local function hedge_job(keys, args)
+    local request = cjson.decode(args[1])
+    local current = job_get(keys[1], 'status')
+    if not current then
+        return {'NOT_FOUND', false}
+    end
+    if current ~= 'RUNNING' then
+        return reply('UNEXPECTED', current, keys[1], request)
+    end
+    local owner = job_get(keys[1], 'lease_owner') or ''
+    if owner == '' or owner == request.worker_id or job_get(keys[1], 'hedge_owner') then
+        return reply('LEASE_HELD', current, keys[1], request)
+    end
+    job_set(keys[1], 'hedge_owner', request.worker_id, 'updated_at', request.now)
+    write_events(keys[5], keys[4], request.events, request)
+    return reply('OK', current, keys[1], request)
+end
+
+-- Give up one copy of a hedged job whose other copy is still running
+-- KEYS: job keys
+-- ARGV[1]: JSON request {worker_id, now, expires_at, return_fields, events, ...}
+local function withdraw_copy(keys, args)
+    local request = cjson.decode(args[1])
+    local current = job_get(keys[1], 'status')
+    if not current then
+        return {'NOT_FOUND', false}
+    end
+    local owner = job_get(keys[1], 'lease_owner') or ''
+    local hedge_owner = job_get(keys[1], 'hedge_owner') or ''
+    if current ~= 'RUNNING' or hedge_owner == '' then
+        return reply('UNEXPECTED', current, keys[1], request)
+    end
+    if hedge_owner == request.worker_id then
+        job_set(keys[1], 'hedge_owner', '', 'updated_at', request.now)
+    elseif owner == request.worker_id then
+        -- The other copy takes over the lease
+        job_set(keys[1], 'lease_owner', hedge_owner, 'lease_expires_at', request.expires_at,
+            'hedge_owner', '', 'updated_at', request.now)
+    else
+        return reply('LEASE_LOST', current, keys[1], request)
+    end
+    write_events(keys[5], keys[4], request.events, request)
+    return reply('OK', current, keys[1], request)
+end
+
+-- Enqueue a job deferred by admission control (see app.admission), unless it
+-- was released, cancelled, deleted or enqueued by other means meanwhile
+-- KEYS: job keys, deferred set, queue stream of the job, queues set
+-- ARGV[1]: JSON request {job_id, inline, events, ...}
+local function release_deferred(keys, args)
+    local request = cjson.decode(args[1])
+    if job_stream_for(job_get(keys[1], 'task_type')) ~= keys[7] then
+        return redis.error_reply('ERR queue stream ' .. keys[7] .. ' does not match the task type')
+    end
+    if redis.call('ZREM', keys[6], request.job_id) == 0 then
+        return 0
+    end
+    if job_get(keys[1], 'status') ~= 'PENDING' or not job_get(keys[1], 'deferred') then
+        return 0
+    end
+    job_enqueue(keys[1], keys[7], keys[8], request.inline)
+    write_events(keys[5], keys[4], request.events, request)
+    return 1
+end
+
+-- Release the lease (or hedge) of a worker, if it still holds it
+-- KEYS: job keys
+-- ARGV[1]: JSON request {worker_id, return_fields, ...}
+local function release_lease(keys, args)
+    local request = cjson.decode(args[1])
+    local current = job_get(keys[1], 'status')
+    if not current then
+        return {'NOT_FOUND', false}
+    end
+    if job_get(keys[1], 'hedge_owner') == request.worker_id then
+        job_set(keys[1], 'hedge_owner', '')
+    elseif job_get(keys[1], 'lease_owner') == request.worker_id then
+        job_set(keys[1], 'lease_owner', '', 'lease_expires_at', '')
+    else
+        return reply('LEASE_LOST', current, keys[1], request)
+    end
+    return reply('OK', current, keys[1], request)
+end
+"""
+
+# ALLOWED_TRANSITIONS as a Lua table literal
+_ALLOWED_LUA = "{" + ", ".join(
+    f"{source.value} = {{" + ", ".join(f"'{target.value}'" for target in sorted(targets)) + "}"
+    for source, targets in sorted(ALLOWED_TRANSITIONS.items())
+) + "}"
+_BODY = JOB_HASH_LUA + QUEUE_LUA + _LIBRARY_BODY.replace("__ALLOWED__", _ALLOWED_LUA) + WORKFLOW_LUA + _FUNCTIONS_BODY
+LIBRARY_VERSION = hashlib.sha1(_BODY.encode()).hexdigest()[:12]
+
+START_FUNCTION = f"dtq_start_job_{LIBRARY_VERSION}"
+TRANSITION_FUNCTION = f"dtq_transition_job_{LIBRARY_VERSION}"
+HEDGE_FUNCTION = f"dtq_hedge_job_{LIBRARY_VERSION}"
+WITHDRAW_FUNCTION = f"dtq_withdraw_copy_{LIBRARY_VERSION}"
+RELEASE_FUNCTION = f"dtq_release_lease_{LIBRARY_VERSION}"
+MERGE_MAP_CHUNK_FUNCTION = f"dtq_merge_map_chunk_{LIBRARY_VERSION}"
+RELEASE_DEFERRED_FUNCTION = f"dtq_release_deferred_{LIBRARY_VERSION}"
+
+# Registered function name -> Lua function
+_FUNCTIONS = {
+    START_FUNCTION: "start_job",
+    TRANSITION_FUNCTION: "transition_job",
+    HEDGE_FUNCTION: "hedge_job",
+    WITHDRAW_FUNCTION: "withdraw_copy",
+    RELEASE_FUNCTION: "release_lease",
+    MERGE_MAP_CHUNK_FUNCTION: "merge_map_chunk",
+    RELEASE_DEFERRED_FUNCTION: "release_deferred",
+}
+
+LIBRARY_NAME = f"dtq_{LIBRARY_VERSION}"
+LIBRARY_SOURCE = (
+    f"#!lua name={LIBRARY_NAME}\n"
+    + _BODY
+    + "".join(f"redis.register_function('{name}', {function})\n" for name, function in _FUNCTIONS.items())
+)
+
+# Fallback without FUNCTION support: ARGV[1] names the function to run
+SCRIPT_SOURCE = (
+    _BODY
+    + "local functions = {"
+    + ", ".join(f"['{name}'] = {function}" for name, function in _FUNCTIONS.items())
+    + "}\n"
+    + "return functions[ARGV[1]](KEYS, {ARGV[2]})\n"
+)
+
+COMPLETED_COUNTER_KEY = "metrics:jobs_completed_total"
+LIBRARIES_KEY = "dtq:function_libraries"  # Hash per node: library name -> last load (epoch ms)
+STALE_LIBRARY_SECONDS = 3600
+
+_library_loaded: "weakref.WeakSet[Any]" = weakref.WeakSet()  # Clients of the nodes the library was loaded on
+_use_script = False
+
+
+async def _load_library(redis: Any) -> None:
+    global _use_script
+    try:
+        await redis.function_load(LIBRARY_SOURCE, replace=True)
+        _library_loaded.add(redis)
+    except ResponseError as e:
+        # Redis < 7, or FUNCTION LOAD not permitted for this user
+        print(f"Job state machine: cannot load Redis function library ({e}), using EVALSHA")
+        _use_script = True
+        return
+    try:
+        await _delete_stale_libraries(redis)
+    except ResponseError as e:
+        print(f"Job state machine: cannot delete stale function libraries ({e})")
+
+
+async def _delete_stale_libraries(redis: Any) -> None:
+    """Delete libraries of other versions that no process loaded for STALE_LIBRARY_SECONDS."""
+    now = int(now_ms())
+    await redis.hset(LIBRARIES_KEY, LIBRARY_NAME, now)
+    loaded = await redis.hgetall(LIBRARIES_KEY)
+    for library in await redis.function_list(library="dtq_*"):
+        name = dict(zip(library[::2], library[1::2]))["library_name"]
+        if name != LIBRARY_NAME and now - int(loaded.get(name, 0)) > STALE_LIBRARY_SECONDS * 1000:
+            await redis.function_delete(name)
+            await redis.hdel(LIBRARIES_KEY, name)
+
+
+def _job_keys(job_id: str) -> List[str]:
+    """Keys of a job passed to every library function."""
+    return [job_key(job_id), *job_sub_keys(job_id), job_events_key(job_id), settings.job_events_stream]
+
+
+def _library_error(reply: Any) -> bool:
+    # The library is gone, e.g. after a failover to a replica that never had it
+    return isinstance(reply, ResponseError) and "function not found" in str(reply).lower()
+
+
+async def _call_many(
+    function: str,
+    calls: Sequence[Tuple[str, List[str], Dict[str, Any]]],
+) -> List[List[Any]]:
+    """
+    Call a library function once per (job_id, keys, request), in one
+    pipeline per shard.
+
+    All keys of a job live on its shard (see app.sharding). A call that fails
+    (e.g. a script error) has the exception as its reply, so the others are
+    still reported.
+    """
+    replies: List[Any] = [[] for _ in calls]
+    arguments = [json.dumps(request, separators=(",", ":")) for _, _, request in calls]
+
+    async def run(index: int, positions: List[int]) -> None:
+        redis = get_shard(index)
+        if not _use_script and redis not in _library_loaded:
+            await _load_library(redis)
+        for attempt in range(2):
+            pipe = redis.pipeline(transaction=False)
+            if _use_script:
+                script = redis.register_script(SCRIPT_SOURCE)
+                for position in positions:
+                    await script(keys=calls[position][1], args=[function, arguments[position]], client=pipe)
+            else:
+                for position in positions:
+                    keys = calls[position][1]
+                    pipe.fcall(function, len(keys), *keys, arguments[position])
+            results = await pipe.execute(raise_on_error=False)
+
+            missing = []
+            for position, result in zip(positions, results):
+                if attempt == 0 and _library_error(result):
+                    missing.append(position)
+                else:
+                    replies[position] = result
+            if not missing:
+                return
+            await _load_library(redis)
+            positions = missing
+
+    await asyncio.gather(*(
+        run(index, positions) for index, positions in group_by_shard(job_id for job_id, _, _ in calls).items()
+    ))
+    return replies
+
+
+async def _call(function: str, job_id: str, keys: List[str], request: Dict[str, Any]) -> List[Any]:
+    reply = (await _call_many(function, [(job_id, keys, request)]))[0]
+    if isinstance(reply, Exception):
+        raise reply
+    return reply
+
+
+def _serialize_events(events: Sequence[EventRecord]) -> List[List[Any]]:
+    """Pre-serialize events as [log line, stream entry fields]."""
+    serialized = []
+    with time_stage("events"):
+        for record in events:
+            stream_fields, log_line = serialize_job_event(record)
+            serialized.append([log_line, [item for pair in stream_fields.items() for item in pair]])
+    return serialized
+
+
+def _event_arguments(events: Sequence[EventRecord], request: Dict[str, Any]) -> None:
+    """Add pre-serialized events to a request."""
+    request["stream_maxlen"] = str(settings.event_stream_maxlen)
+    request["retention_seconds"] = str(settings.event_retention_seconds)
+    if events:
+        request["events"] = _serialize_events(events)
+
+
+def _result(job_id: str, reply: Any, return_fields: Sequence[str]) -> TransitionResult:
+    if isinstance(reply, Exception):
+        return TransitionResult(outcome=TransitionOutcome.ERROR, previous_status=None, error=reply)
+    if reply[0] == TransitionOutcome.NOT_FOUND.value:
+        return TransitionResult(outcome=TransitionOutcome.NOT_FOUND, previous_status=None)
+    values = list(reply[2:]) + [None] * (len(return_fields) - len(reply[2:]))
+    # Return values as stored, in the original field formats
+    decoded = decode_job_hash(job_id, {name: value for name, value in zip(return_fields, values) if value})
+    return TransitionResult(
+        outcome=TransitionOutcome(reply[0]),
+        previous_status=reply[1],
+        fields={name: decoded.get(name) for name in return_fields},
+    )
+
+
+async def start_job(
+    job_id: str,
+    worker_id: str,
+    *,
+    lease_ttl_seconds: int = 30,
+    events: Sequence[EventRecord] = (),
+    return_fields: Sequence[str] = (),
+) -> TransitionResult:
+    """
+    Lease a job and mark it RUNNING, incrementing its attempts.
+
+    Args:
+        job_id: The job identifier
+        worker_id: Unique identifier of the worker
+        lease_ttl_seconds: Lease duration in seconds
+        events: Event records written if the job is started
+        return_fields: Job fields to return (read after the change)
+
+    Returns:
+        The transition result
+    """
+    now = datetime.now(timezone.utc)
+    request: Dict[str, Any] = {
+        "worker_id": worker_id,
+        "now": to_ms(now),
+        "expires_at": to_ms(now + timedelta(seconds=lease_ttl_seconds)),
+        "fields": {"updated_at": to_ms(now)},
+        "return_fields": list(return_fields),
+    }
+    _event_arguments(events, request)
+    return _result(job_id, await _call(START_FUNCTION, job_id, _job_keys(job_id), request), return_fields)
+
+
+@dataclass
+class Transition:
+    """A transition of one job; see transition_job for the fields."""
+
+    job_id: str
+    steps: Sequence[JobStatus]
+    expected: Optional[Sequence[JobStatus]] = None
+    lease_owner: Optional[str] = None
+    release_lease: bool = False
+    fields: Optional[Dict[str, Any]] = None
+    enqueue: bool = False
+    enqueue_fields: Optional[Dict[str, str]] = None
+    task_type: Optional[str] = None
+    create: Optional[Dict[str, Any]] = None
+    workflow_id: Optional[str] = None
+    events: Sequence[EventRecord] = ()
+    return_fields: Sequence[str] = ()
+
+
+def _transition_request(transition: Transition) -> Dict[str, Any]:
+    request: Dict[str, Any] = {
+        "steps": [step.value for step in transition.steps],
+        "fields": {"updated_at": now_ms(), **encode_job_fields(transition.fields or {})},
+        "return_fields": list(transition.return_fields),
+    }
+    if transition.expected is not None:
+        request["expected"] = [status.value for status in transition.expected]
+    if transition.create is not None:
+        request["create"] = encode_job_fields(transition.create)
+    if transition.lease_owner is not None:
+        request["lease_owner"] = transition.lease_owner
+    if transition.release_lease:
+        request["release_lease"] = True
+    if transition.enqueue:
+        request["enqueue"] = {
+            "inline": inline_payloads(),
+            "fields": [item for pair in (transition.enqueue_fields or {}).items() for item in pair],
+        }
+    _event_arguments(transition.events, request)
+    return request
+
+
+async def _with_workflow(
+    call: Tuple[str, List[str], Dict[str, Any]],
+    transition: Transition,
+    workflow_id: str,
+) -> Tuple[str, List[str], Dict[str, Any]]:
+    """Add the workflow plan of a transition to its library call."""
+    job_id, keys, request = call
+    plan_keys, plan, nodes = await workflow_plan(workflow_id, job_id, transition.steps[-1])
+    plan["nodes"] = [[node_id, _serialize_events(events)] for node_id, events in nodes]
+    plan["inline"] = inline_payloads()
+    return job_id, keys + plan_keys, {**request, "workflow": plan}
+
+
+async def transition_jobs(transitions: Sequence[Transition]) -> List[TransitionResult]:
+    """
+    Apply transitions to many jobs in one pipelined round trip per shard.
+
+    Each transition is atomic on its own; they are not applied as a group.
+    A transition whose call fails has outcome ERROR and does not stop the
+    others.
+
+    Args:
+        transitions: The transitions, at most one per job
+
+    Returns:
+        The transition results, in order
+    """
+    # Enqueued jobs go to the queue of their task type, which must be known up front
+    unrouted = [t.job_id for t in transitions if t.enqueue and t.task_type is None]
+    task_types: Dict[str, Optional[str]] = {}
+    if unrouted:
+        for job_id, job in zip(unrouted, await read_jobs(unrouted, ["task_type"])):
+            task_types[job_id] = (job or {}).get("task_type")
+
+    calls = []
+    for transition in transitions:
+        task_type = transition.task_type
+        if task_type is None:
+            task_type = task_types.get(transition.job_id)
+        keys = _job_keys(transition.job_id) + [COMPLETED_COUNTER_KEY, job_stream_for(task_type), QUEUES_KEY]
+        calls.append((transition.job_id, keys, _transition_request(transition)))
+
+    # Workflow jobs known up front carry their workflow's plan in the first call
+    planned = [
+        position for position, transition in enumerate(transitions)
+        if transition.workflow_id and transition.steps[-1] != JobStatus.PENDING
+    ]
+    for position, call in zip(planned, await asyncio.gather(*(
+        _with_workflow(calls[position], transitions[position], transitions[position].workflow_id)
+        for position in planned
+    ))):
+        calls[position] = call
+
+    replies = await _call_many(TRANSITION_FUNCTION, calls)
+
+    # Others are refused before any change, naming the workflow to plan for
+    unplanned = [
+        position for position, reply in enumerate(replies)
+        if not isinstance(reply, Exception) and reply[0] == "WORKFLOW"
+    ]
+    if unplanned:
+        retried = await asyncio.gather(*(
+            _with_workflow(calls[position], transitions[position], replies[position][2])
+            for position in unplanned
+        ))
+        for position, reply in zip(unplanned, await _call_many(TRANSITION_FUNCTION, retried)):
+            replies[position] = reply
+
+    return [_result(t.job_id, reply, t.return_fields) for t, reply in zip(transitions, replies)]
+
+
+async def transition_job(
+    job_id: str,
+    steps: Sequence[JobStatus],
+    *,
+    expected: Optional[Sequence[JobStatus]] = None,
+    lease_owner: Optional[str] = None,
+    release_lease: bool = False,
+    fields: Optional[Dict[str, Any]] = None,
+    enqueue: bool = False,
+    enqueue_fields: Optional[Dict[str, str]] = None,
+    task_type: Optional[str] = None,
+    create: Optional[Dict[str, Any]] = None,
+    workflow_id: Optional[str] = None,
+    events: Sequence[EventRecord] = (),
+    return_fields: Sequence[str] = (),
+) -> TransitionResult:
+    """
+    Atomically move a job through one or more status transitions.
+
+    Every step must be allowed by ALLOWED_TRANSITIONS; the job only ends up
+    in the last status, e.g. [FAILED, PENDING] for a retry. A workflow job's
+    success enqueues its ready dependents, its failure skips its descendants
+    and its requeue restores them (see app.workflows).
+
+    Args:
+        job_id: The job identifier
+        steps: Statuses the job passes through, in order
+        expected: Statuses the job must currently have (any allowed if None)
+        lease_owner: Require the lease to be held by this worker
+        release_lease: Clear the lease
+        fields: Additional job fields to set (updated_at is always set); None
+            or "" deletes a field
+        enqueue: Add the job to its queue (also clears the lease)
+        enqueue_fields: Additional fields of the queue entry
+        task_type: The job's task type, routing an enqueued job (read from
+            the job if None)
+        create: Fields to recreate the job with if it no longer exists; it
+            is then treated as being in the first expected status
+        workflow_id: The job's workflow, if known; saves a round trip when
+            the transition updates the workflow (done in the same atomic
+            call either way)
+        events: Event records written if the transition is applied
+        return_fields: Job fields to return (read after the change, or
+            as they are if the transition is refused)
+
+    Returns:
+        The transition result
+
+    Raises:
+        ResponseError: If the call fails
+    """
+    transition = Transition(
+        job_id=job_id,
+        steps=steps,
+        expected=expected,
+        lease_owner=lease_owner,
+        release_lease=release_lease,
+        fields=fields,
+        enqueue=enqueue,
+        enqueue_fields=enqueue_fields,
+        task_type=task_type,
+        create=create,
+        workflow_id=workflow_id,
+        events=events,
+        return_fields=return_fields,
+    )
+    result = (await transition_jobs([transition]))[0]
+    if result.error is not None:
+        raise result.error
+    return result
+
+
+async def hedge_job(
+    job_id: str,
+    worker_id: str,
+    *,
+    events: Sequence[EventRecord] = (),
+    return_fields: Sequence[str] = (),
+) -> TransitionResult:
+    """
+    Start a second copy of a running job held by another worker.
+
+    The job stays RUNNING with its attempts unchanged; the worker becomes its
+    hedge owner and may complete it like the lease owner.
+
+    Args:
+        job_id: The job identifier
+        worker_id: Unique identifier of the worker running the copy
+        events: Event records written if the copy may start
+        return_fields: Job fields to return (read after the change)
+
+    Returns:
+        The transition result (UNEXPECTED if the job is no longer running,
+        LEASE_HELD if it is not leased by another worker or already hedged)
+    """
+    request: Dict[str, Any] = {
+        "worker_id": worker_id,
+        "now": now_ms(),
+        "return_fields": list(return_fields),
+    }
+    _event_arguments(events, request)
+    return _result(job_id, await _call(HEDGE_FUNCTION, job_id, _job_keys(job_id), request), return_fields)
+
+
+async def withdraw_copy(
+    job_id: str,
+    worker_id: str,
+    *,
+    lease_ttl_seconds: int = 30,
+    events: Sequence[EventRecord] = (),
+) -> TransitionResult:
+    """
+    Give up this worker's copy of a hedged job, leaving the job to the other copy.
+
+    Args:
+        job_id: The job identifier
+        worker_id: Lease or hedge owner giving up its copy
+        lease_ttl_seconds: Lease duration of the other copy if it takes over
+            the lease
+        events: Event records written if the copy is withdrawn
+
+    Returns:
+        The transition result (UNEXPECTED if no other copy is running)
+    """
+    now = datetime.now(timezone.utc)
+    request: Dict[str, Any] = {
+        "worker_id": worker_id,
+        "now": to_ms(now),
+        "expires_at": to_ms(now + timedelta(seconds=lease_ttl_seconds)),
+    }
+    _event_arguments(events, request)
+    return _result(job_id, await _call(WITHDRAW_FUNCTION, job_id, _job_keys(job_id), request), ())
+
+
+async def release_lease(job_id: str, worker_id: str) -> TransitionResult:
+    """
+    Release a worker's lease on a job, or its hedged copy, if it still holds it.
+
+    Args:
+        job_id: The job identifier
+        worker_id: Unique identifier of the worker
+
+    Returns:
+        The transition result (LEASE_LOST if the worker no longer holds it)
+    """
+    request: Dict[str, Any] = {"worker_id": worker_id}
+    return _result(job_id, await _call(RELEASE_FUNCTION, job_id, _job_keys(job_id), request), ())
+
+
+async def merge_map_chunk(
+    parent_job_id: str,
+    map_keys: Sequence[str],
+    chunk_index: int,
+    *,
+    succeeded: int,
+    failed: int,
+    partial: Optional[float],
+    errors: Sequence[str],
+    max_errors: int,
+    events: Dict[JobStatus, Sequence[EventRecord]],
+) -> Optional[JobStatus]:
+    """
+    Merge a map chunk's aggregate into its map job; the last chunk completes
+    the parent job, unless it is no longer RUNNING (e.g. it was cancelled).
+
+    Args:
+        parent_job_id: The map job
+        map_keys: Keys of the map hash, merged chunks, items and errors (see
+            app.map_jobs)
+        chunk_index: The chunk
+        succeeded: Items of the chunk that succeeded
+        failed: Items of the chunk that failed
+        partial: The chunk's partial aggregate, if any
+        errors: Sample item errors of the chunk
+        max_errors: Sample errors kept per map job
+        events: Event records written if the parent job completes, by its
+            final status (SUCCEEDED or FAILED)
+
+    Returns:
+        The parent job's final status if this merge completed it
+    """
+    request: Dict[str, Any] = {
+        "chunk_index": str(chunk_index),
+        "succeeded": succeeded,
+        "failed": failed,
+        "partial": "" if partial is None else repr(partial),
+        "errors": list(errors),
+        "max_errors": max_errors,
+        "now": now_ms(),
+        "events": {status.value: _serialize_events(records) for status, records in events.items()},
+    }
+    _event_arguments((), request)
+    keys = _job_keys(parent_job_id) + [COMPLETED_COUNTER_KEY, *map_keys]
+    status = await _call(MERGE_MAP_CHUNK_FUNCTION, parent_job_id, keys, request)
+    return JobStatus(status) if status else None
+
+
+async def release_deferred(
+    deferred_key: str,
+    jobs: Sequence[Tuple[str, Optional[str], Sequence[EventRecord]]],
+) -> List[bool]:
+    """
+    Enqueue jobs deferred by admission control, in one pipelined round trip per shard.
+
+    Each job is removed from the deferred set and enqueued in one atomic
+    call, and only if it is still deferred and PENDING, so a job is never
+    enqueued twice nor lost between the two.
+
+    Args:
+        deferred_key: Sorted set the jobs were deferred in (on each job's shard)
+        jobs: (job_id, task_type, event records written if it is enqueued)
+
+    Returns:
+        Per job, whether it was enqueued (False if it was no longer deferred
+        or its call failed)
+    """
+    calls = []
+    for job_id, task_type, events in jobs:
+        request: Dict[str, Any] = {"job_id": job_id, "inline": inline_payloads()}
+        _event_arguments(events, request)
+        keys = _job_keys(job_id) + [deferred_key, job_stream_for(task_type), QUEUES_KEY]
+        calls.append((job_id, keys, request))
+    released = []
+    for (job_id, _, _), reply in zip(jobs, await _call_many(RELEASE_DEFERRED_FUNCTION, calls)):
+        if isinstance(reply, Exception):
+            print(f"Error releasing deferred job {job_id}: {reply}")
+        released.append(reply == 1)
+    return released
@@ -0,0 +1,120 @@
+"""Retention of consumed job queue entries and stream memory reporting.
+
+Entries of a job queue's stream are never read again once every consumer group has
+acknowledged them, so the stream is trimmed with ``XTRIM MINID`` up to the
+oldest entry some group still needs: its oldest pending (delivered, not yet
+acknowledged) entry, or the first entry after its last delivered one.
+"""
+
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+from app.queues import list_queues, queue_stream
+from app.redis_client import get_redis
+from app.sharding import get_shard, get_shards, shard_count
+
+
+def _parse_id(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _next_id(entry_id: str) -> str:
+    ms, seq = _parse_id(entry_id)
+    return f"{ms}-{seq + 1}"
+
+
+async def oldest_needed_id(stream: str, shard: int = 0) -> Optional[str]:
+    """
+    Oldest entry ID still needed by a consumer group of a stream.
+
+    Args:
+        stream: Stream key
+        shard: Shard holding the stream (see app.sharding)
+
+    Returns:
+        Entry ID below which all entries were consumed by every group, or None
+        if the stream has no consumer groups (nothing is known to be consumed)
+    """
+    redis = get_shard(shard)
+    try:
+        groups = await redis.xinfo_groups(stream)
+    except Exception:
+        return None  # Stream does not exist yet
+    if not groups:
+        return None
+
+    needed = []
+    for group in groups:
+        needed.append(_next_id(group["last-delivered-id"]))
+        if int(group.get("pending", 0)):
+            pending = await redis.xpending(stream, group["name"])
+            if pending.get("min"):
+                needed.append(pending["min"])
+    return min(needed, key=_parse_id)
+
+
+async def trim_consumed_entries(stream: Optional[str] = None) -> int:
+    """
+    Remove stream entries that every consumer group has acknowledged, on every shard.
+
+    Args:
+        stream: Stream key, defaults to settings.job_stream
+
+    Returns:
+        Number of entries removed
+    """
+    stream = stream or settings.job_stream
+    removed = 0
+    for shard in range(shard_count()):
+        min_id = await oldest_needed_id(stream, shard)
+        if min_id is None:
+            continue
+        # Approximate trimming only removes whole radix tree nodes, which is much
+        # cheaper and never removes more than exact trimming would
+        removed += await get_shard(shard).xtrim(stream, minid=min_id, approximate=settings.stream_trim_approximate)
+    return removed
+
+
+async def trim_all_queues() -> Dict[str, int]:
+    """
+    Remove acknowledged entries from the stream of every job queue.
+
+    Returns:
+        Entries removed per stream key (streams with none removed omitted)
+    """
+    trimmed: Dict[str, int] = {}
+    for queue in await list_queues():
+        stream = queue_stream(queue)
+        removed = await trim_consumed_entries(stream)
+        if removed:
+            trimmed[stream] = removed
+    return trimmed
+
+
+async def stream_memory_usage() -> Dict[str, Dict[str, Optional[int]]]:
+    """
+    Length and memory usage of the job queue, DLQ and job event streams.
+
+    Job queue and event streams are summed over the shards; the DLQ lives on
+    REDIS_URL.
+
+    Returns:
+        Per stream key: entries and bytes (None where MEMORY USAGE is unavailable)
+    """
+    usage: Dict[str, Dict[str, Optional[int]]] = {}
+    streams = [queue_stream(queue) for queue in await list_queues()]
+    for stream in (*streams, settings.dlq_stream, settings.job_events_stream):
+        nodes = [get_redis()] if stream == settings.dlq_stream else get_shards()
+        entries, memory = 0, None
+        for redis in nodes:
+            try:
+                # SAMPLES 0 measures every entry rather than extrapolating from a few
+                node_memory = await redis.memory_usage(stream, samples=0)
+            except Exception:
+                node_memory = None
+            if node_memory is not None:
+                memory = (memory or 0) + node_memory
+            entries += await redis.xlen(stream)
+        usage[stream] = {"entries": entries, "bytes": memory}
+    return usage
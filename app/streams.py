@@ -0,0 +1,59 @@
+"""Job stream entry layout.
+
+The job hash is the source of truth for a job's payload. Depending on
+``settings.stream_payload_mode`` stream entries either carry only the job ID
+and routing metadata (``slim``, workers read the payload from the hash) or
+also carry the payload (``inline``, workers skip reading it from the hash).
+Either way a worker fetches the payload exactly once.
+"""
+
+from typing import Dict, Optional
+
+from app.config import settings
+
+
+STREAM_PAYLOAD_MODES = ("slim", "inline")
+
+
+def inline_payloads() -> bool:
+    """Whether job stream entries carry the payload."""
+    if settings.stream_payload_mode not in STREAM_PAYLOAD_MODES:
+        raise ValueError(f"Unknown stream payload mode: {settings.stream_payload_mode}")
+    return settings.stream_payload_mode == "inline"
+
+
+def job_stream_entry(
+    job_id: str,
+    partition_key: str,
+    task_type: str,
+    payload_json: str,
+    traceparent: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Build the fields of a job stream entry.
+
+    Args:
+        job_id: The job identifier
+        partition_key: Partition key ("" if none)
+        task_type: Task type
+        payload_json: Encoded payload, included only in inline mode
+        traceparent: Trace context of the job, if traced
+
+    Returns:
+        Stream entry fields
+    """
+    fields = {
+        "job_id": job_id,
+        "partition_key": partition_key,
+        "task_type": task_type,
+    }
+    if inline_payloads():
+        fields["payload_json"] = payload_json
+    if traceparent:
+        fields["traceparent"] = traceparent
+    return fields
+
+
+def inline_flag() -> str:
+    """Inline mode as a Lua script argument ("1" or "0")."""
+    return "1" if inline_payloads() else "0"
@@ -0,0 +1,358 @@
+"""Distributed tracing of jobs from submission to completion.
+
+Trace context uses the W3C ``traceparent`` format. ``create_job`` starts a
+``job.create`` span (continuing the caller's ``traceparent`` header, if any)
+and stores its context in the job hash and the job's stream entries, so
+re-enqueues by Lua scripts (retries, requeues, replays) carry it too.
+Workers continue the trace with ``job.queue_wait``, from the stream entry's
+creation (the timestamp of its ID) to the start of processing, and
+``job.process``, with a child span per stage of processing (see
+app.profiling).
+
+Whether a trace is recorded is decided at its root from ``trace_sample_ratio``
+and carried in the context's sampled flag; unsampled jobs record nothing.
+Finished spans are buffered and exported in the background by the configured
+exporter: ``file`` (OTLP/JSON export requests, one per line, works offline),
+``otlp`` (OTLP/HTTP with JSON encoding) or one added with
+``register_exporter``.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import settings
+from app.profiling import StageTimings
+
+
+# Span kinds (OTLP enum values)
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass(frozen=True)
+class TraceContext:
+    """Identifies a span within a trace."""
+
+    trace_id: str  # 32 hex digits
+    span_id: str  # 16 hex digits
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        """The context as a W3C traceparent value."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[TraceContext]:
+    """Parse a W3C traceparent value (None if missing or invalid)."""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return TraceContext(
+        trace_id=match.group(1),
+        span_id=match.group(2),
+        sampled=bool(int(match.group(3), 16) & 1),
+    )
+
+
+def _sample(trace_id: str) -> bool:
+    # Decided from the trace ID, like OpenTelemetry's TraceIdRatioBased sampler
+    return int(trace_id[16:], 16) < settings.trace_sample_ratio * 2 ** 64
+
+
+@dataclass
+class Span:
+    """A timed operation of a trace."""
+
+    name: str
+    context: TraceContext
+    parent_span_id: Optional[str]
+    start_ns: int
+    kind: int = SPAN_KIND_INTERNAL
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        """End the span and queue it for export if its trace is sampled."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        if self.context.sampled:
+            tracer.record(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OTLP/JSON form."""
+        span: Dict[str, Any] = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.error is not None:
+            span["status"] = {"code": 2, "message": self.error}  # STATUS_CODE_ERROR
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def start_span(
+    name: str,
+    parent: Optional[TraceContext] = None,
+    *,
+    kind: int = SPAN_KIND_INTERNAL,
+    attributes: Optional[Dict[str, Any]] = None,
+    start_ns: Optional[int] = None,
+) -> Span:
+    """
+    Start a span.
+
+    Args:
+        name: Span name
+        parent: Context of the parent span; None starts a new trace, sampled
+            according to trace_sample_ratio
+        kind: Span kind (SPAN_KIND_*)
+        attributes: Span attributes
+        start_ns: Start time (epoch nanoseconds), now if None
+
+    Returns:
+        The span; call end() when the operation is done
+    """
+    span_id = os.urandom(8).hex()
+    if parent is None:
+        trace_id = os.urandom(16).hex()
+        context = TraceContext(trace_id=trace_id, span_id=span_id, sampled=_sample(trace_id))
+    else:
+        context = TraceContext(trace_id=parent.trace_id, span_id=span_id, sampled=parent.sampled)
+    return Span(
+        name=name,
+        context=context,
+        parent_span_id=parent.span_id if parent else None,
+        start_ns=start_ns if start_ns is not None else time.time_ns(),
+        kind=kind,
+        attributes=dict(attributes or {}),
+    )
+
+
+def is_sampled(traceparent: Optional[str]) -> bool:
+    """Whether spans are recorded for a trace context (and tracing is enabled)."""
+    if not settings.tracing_enabled:
+        return False
+    context = parse_traceparent(traceparent)
+    return context is not None and context.sampled
+
+
+def record_job_trace(
+    msg_id: str,
+    fields: Dict[str, str],
+    timings: StageTimings,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Record the spans of a processed job stream message.
+
+    ``job.queue_wait`` runs from the entry's creation (the timestamp of its
+    ID, taken from the Redis server's clock) until processing started;
+    ``job.process`` from then until now, with a child span per stage block
+    in the timings' intervals.
+
+    Args:
+        msg_id: Stream message ID
+        fields: Fields of the stream entry
+        timings: Stage timings of processing it, with intervals kept
+        attributes: Further attributes of the job.process span
+    """
+    parent = parse_traceparent(fields.get("traceparent"))
+    if parent is None or not parent.sampled or timings.intervals is None:
+        return
+    job_attributes = {"job.id": fields.get("job_id", ""), "job.task_type": fields.get("task_type", "")}
+
+    enqueued_ns = int(msg_id.split("-", 1)[0]) * 1_000_000
+    start_span(
+        "job.queue_wait",
+        parent,
+        attributes={**job_attributes, "messaging.message.id": msg_id},
+        start_ns=min(enqueued_ns, timings.started_ns),
+    ).end(timings.started_ns)
+
+    process = start_span(
+        "job.process",
+        parent,
+        kind=SPAN_KIND_CONSUMER,
+        attributes={**job_attributes, "messaging.message.id": msg_id, **(attributes or {})},
+        start_ns=timings.started_ns,
+    )
+    spans: List[Span] = []
+    for name, start_ns, end_ns, outer in timings.intervals:
+        span = start_span(
+            f"job.{name}",
+            (spans[outer] if outer is not None else process).context,
+            start_ns=start_ns,
+        )
+        spans.append(span)
+        span.end(end_ns if end_ns is not None else time.time_ns())
+    process.end()
+
+
+class SpanExporter:
+    """Sends finished spans somewhere. export() may block; it runs in a thread."""
+
+    def export(self, resource_spans: Dict[str, Any]) -> None:
+        """
+        Export spans.
+
+        Args:
+            resource_spans: An OTLP/JSON ExportTraceServiceRequest
+        """
+        raise NotImplementedError
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends export requests as JSON lines to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, resource_spans: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resource_spans, separators=(",", ":")) + "\n")
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Posts export requests to an OTLP/HTTP endpoint (JSON encoding)."""
+
+    def __init__(self, endpoint: str, timeout_seconds: float = 10.0):
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+
+    def export(self, resource_spans: Dict[str, Any]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(resource_spans).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+            response.read()
+
+
+# Exporter name -> factory
+EXPORTERS: Dict[str, Callable[[], SpanExporter]] = {
+    "file": lambda: FileSpanExporter(settings.trace_file),
+    "otlp": lambda: OtlpHttpSpanExporter(settings.trace_otlp_endpoint),
+}
+
+
+def register_exporter(name: str, factory: Callable[[], SpanExporter]) -> None:
+    """Make an exporter available to the trace_exporter setting."""
+    EXPORTERS[name] = factory
+
+
+class Tracer:
+    """Buffers finished spans and exports them in the background."""
+
+    def __init__(self) -> None:
+        self.service_name = "dtq"
+        self._spans: List[Span] = []
+        self._exporter: Optional[SpanExporter] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self, service_name: str) -> None:
+        """Start exporting (must be called from a running event loop)."""
+        if self._task is not None:
+            return
+        if settings.trace_exporter not in EXPORTERS:
+            raise ValueError(f"Unknown trace exporter: {settings.trace_exporter}")
+        self.service_name = settings.trace_service_name or service_name
+        self._exporter = EXPORTERS[settings.trace_exporter]()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop exporting, after exporting the buffered spans."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def record(self, span: Span) -> None:
+        """Queue a finished span for export."""
+        if not self.running:
+            return
+        if len(self._spans) >= settings.trace_buffer_size:
+            self.dropped += 1
+            return
+        self._spans.append(span)
+
+    async def flush(self) -> None:
+        """Export the buffered spans."""
+        if not self._spans or self._exporter is None:
+            return
+        spans, self._spans = self._spans, []
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "dtq"}, "spans": [span.to_otlp() for span in spans]}],
+            }]
+        }
+        try:
+            await asyncio.to_thread(self._exporter.export, request)
+            self.exported += len(spans)
+        except Exception as e:
+            self.export_errors += 1
+            print(f"Error exporting {len(spans)} spans: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.trace_flush_interval_seconds)
+            await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process's tracer."""
+        return {
+            "buffered": len(self._spans),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }
+
+
+tracer = Tracer()
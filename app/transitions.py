@@ -4,13 +4,14 @@ from app.models import JobStatus
 
 
 # Define allowed status transitions
-# Note: CANCELLED is stored as string "CANCELLED" in Redis but not in JobStatus enum
+# Enforced atomically in Redis by the state machine library (app.state_machine)
 ALLOWED_TRANSITIONS: dict[JobStatus, set[JobStatus]] = {
-    JobStatus.PENDING: {JobStatus.RUNNING},  # CANCELLED handled separately
-    JobStatus.RUNNING: {JobStatus.SUCCEEDED, JobStatus.FAILED},  # CANCELLED handled separately
+    JobStatus.PENDING: {JobStatus.RUNNING, JobStatus.CANCELLED},
+    JobStatus.RUNNING: {JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED},
     JobStatus.FAILED: {JobStatus.PENDING, JobStatus.DEAD_LETTERED},
     JobStatus.SUCCEEDED: set(),  # Terminal state
-    JobStatus.DEAD_LETTERED: set(),  # Terminal state
+    JobStatus.DEAD_LETTERED: {JobStatus.PENDING},  # Requeue
+    JobStatus.CANCELLED: {JobStatus.PENDING},  # Requeue
 }
 
 
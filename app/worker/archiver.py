@@ -0,0 +1,58 @@
+"""Archiver service moving old terminal jobs from Redis to cold storage.
+
+Run a single instance per archive directory; the archive files live on its
+local disk (see app.archive).
+"""
+
+import asyncio
+import signal
+
+from app.archive import archive_terminal_jobs
+from app.config import settings
+from app.redis_client import RedisClient
+from app.sharding import check_shard_set
+
+
+async def archiver_loop(shutdown_event: asyncio.Event) -> None:
+    """Archive eligible jobs every archive_interval_seconds."""
+    while not shutdown_event.is_set():
+        try:
+            archived = await archive_terminal_jobs()
+            if archived:
+                print(f"Archived {archived} jobs to {settings.archive_dir}")
+        except Exception as e:
+            print(f"Error archiving jobs: {e}")
+
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=settings.archive_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main() -> None:
+    """Archiver entrypoint."""
+    print(f"Starting archiver (archive dir: {settings.archive_dir})")
+
+    loop = asyncio.get_event_loop()
+    shutdown_event = asyncio.Event()
+
+    def signal_handler():
+        print("Shutdown signal received")
+        shutdown_event.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, signal_handler)
+        except NotImplementedError:
+            # Windows does not support add_signal_handler
+            pass
+
+    await check_shard_set()
+    try:
+        await archiver_loop(shutdown_event)
+    finally:
+        await RedisClient.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+"""Cron/interval scheduler service with Redis-lock leader election.
+
+Any number of scheduler processes may run; only the one holding the leader
+lock fires schedules. Each run is additionally fenced by a per-run key, so a
+leader that lost its lock mid-tick cannot double-fire a run the new leader
+already enqueued.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.api.routes_jobs import create_job
+from app.config import settings
+from app.models import JobCreateRequest, ScheduleTemplate
+from app.redis_client import RedisClient, get_redis
+from app.schedules import due_runs, load_schedules, save_schedule, set_next_run
+from app.sharding import check_shard_set
+from app.tracing import tracer
+
+
+LEADER_KEY = "schedules:leader"
+FIRED_KEY_TTL_SECONDS = 86400  # Fencing keys for fired runs
+
+# Scheduler instance identity (unique per process)
+SCHEDULER_ID = f"scheduler-{socket.gethostname()}-{os.getpid()}"
+
+# Lua script extending the lock only if we still own it
+RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Lua script releasing the lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def acquire_or_renew_leadership() -> bool:
+    """
+    Become or stay the active scheduler.
+
+    Returns:
+        True if this process holds the leader lock
+    """
+    redis = get_redis()
+    ttl_ms = settings.scheduler_lock_ttl_seconds * 1000
+
+    if await redis.set(LEADER_KEY, SCHEDULER_ID, nx=True, px=ttl_ms):
+        print(f"{SCHEDULER_ID} became scheduler leader")
+        return True
+
+    renewed = await redis.eval(RENEW_LOCK_SCRIPT, 1, LEADER_KEY, SCHEDULER_ID, str(ttl_ms))
+    return renewed == 1
+
+
+async def release_leadership() -> None:
+    """Give up the leader lock so a standby can take over immediately."""
+    redis = get_redis()
+    await redis.eval(RELEASE_LOCK_SCRIPT, 1, LEADER_KEY, SCHEDULER_ID)
+
+
+async def load_config_schedules(path: Optional[str] = None) -> int:
+    """
+    Upsert schedule templates from a JSON file (a list of templates).
+
+    Args:
+        path: File path, defaults to settings.schedules_file
+
+    Returns:
+        Number of schedules loaded
+    """
+    path = path or settings.schedules_file
+    if not path:
+        return 0
+
+    with open(path, encoding="utf-8") as f:
+        templates = [ScheduleTemplate(**entry) for entry in json.load(f)]
+    for template in templates:
+        await save_schedule(template, preserve_next_run=True)
+    return len(templates)
+
+
+async def fire_run(template: ScheduleTemplate, scheduled_for: datetime) -> bool:
+    """
+    Enqueue one run of a schedule through the normal job creation path.
+
+    Args:
+        template: The schedule
+        scheduled_for: Fire time this run belongs to
+
+    Returns:
+        True if the run was enqueued, False if it had already been fired
+    """
+    redis = get_redis()
+    fired_key = f"schedules:fired:{template.name}:{int(scheduled_for.timestamp())}"
+    if not await redis.set(fired_key, SCHEDULER_ID, nx=True, ex=FIRED_KEY_TTL_SECONDS):
+        return False
+
+    job = await create_job(JobCreateRequest(payload=template.payload, partition_key=template.partition_key))
+    print(f"Schedule {template.name} fired for {scheduled_for.isoformat()}: job {job.job_id}")
+    return True
+
+
+async def scheduler_tick() -> int:
+    """
+    Fire all due runs once.
+
+    Returns:
+        Number of runs enqueued
+    """
+    fired = 0
+    now = datetime.now(timezone.utc)
+
+    for template, next_run in await load_schedules():
+        if not template.enabled:
+            continue
+        try:
+            run_times, new_next_run = due_runs(template, next_run, now)
+            for scheduled_for in run_times:
+                if await fire_run(template, scheduled_for):
+                    fired += 1
+            if new_next_run != next_run:
+                await set_next_run(template.name, new_next_run)
+        except Exception as e:
+            # One broken schedule must not block the others
+            print(f"Error firing schedule {template.name}: {e}")
+
+    return fired
+
+
+async def scheduler_loop(shutdown_event: asyncio.Event) -> None:
+    """Run scheduler ticks while leader, standing by otherwise."""
+    await load_config_schedules()
+    is_leader = False
+
+    while not shutdown_event.is_set():
+        try:
+            was_leader = is_leader
+            is_leader = await acquire_or_renew_leadership()
+            if was_leader and not is_leader:
+                print(f"{SCHEDULER_ID} lost scheduler leadership")
+            if is_leader:
+                await scheduler_tick()
+        except Exception as e:
+            print(f"Error in scheduler loop: {e}")
+            is_leader = False
+
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=settings.scheduler_tick_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    if is_leader:
+        await release_leadership()
+
+
+async def main() -> None:
+    """Scheduler entrypoint."""
+    print(f"Starting scheduler {SCHEDULER_ID}")
+
+    loop = asyncio.get_event_loop()
+    shutdown_event = asyncio.Event()
+
+    def signal_handler():
+        print("Shutdown signal received")
+        shutdown_event.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, signal_handler)
+        except NotImplementedError:
+            # Windows does not support add_signal_handler
+            pass
+
+    await check_shard_set()
+    if settings.tracing_enabled:
+        tracer.start("dtq-scheduler")
+    try:
+        await scheduler_loop(shutdown_event)
+    finally:
+        await tracer.stop()
+        await RedisClient.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
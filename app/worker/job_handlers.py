@@ -1,10 +1,54 @@
 """Task execution handlers."""
 
-from typing import Any, Dict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Union
 
+from app.map_jobs import MAP_CHUNK_TASK_TYPE, run_map_chunk
 from app.models import JobPayload
 
 
+# Result of one item of a batch: the job's result, or the exception it failed with
+BatchItemResult = Union[Dict[str, Any], Exception]
+
+
+@dataclass(frozen=True)
+class BatchHandler:
+    """Handler executing many jobs of one task type in a single call."""
+
+    # Receives the payloads of a batch, returns one result per payload, in order
+    handler: Callable[[List[JobPayload]], Awaitable[List[BatchItemResult]]]
+    max_size: int = 100  # Jobs per call
+    max_wait_ms: int = 50  # Longest a ready job waits for the batch to fill
+
+
+# Task type -> batch handler
+BATCH_HANDLERS: Dict[str, BatchHandler] = {}
+
+
+def register_batch_handler(
+    task_type: str,
+    handler: Callable[[List[JobPayload]], Awaitable[List[BatchItemResult]]],
+    *,
+    max_size: int = 100,
+    max_wait_ms: int = 50,
+) -> None:
+    """
+    Declare batch support for a task type.
+
+    Workers then collect up to max_size ready jobs of the task type, waiting
+    at most max_wait_ms after the first one, and run them with one call.
+
+    Args:
+        task_type: The task type
+        handler: Batch handler; an item failing alone is reported by returning
+            its exception in place of its result, an exception raised by the
+            handler fails every job of the batch
+        max_size: Maximum jobs per call
+        max_wait_ms: Maximum time to wait for a batch to fill
+    """
+    BATCH_HANDLERS[task_type] = BatchHandler(handler=handler, max_size=max_size, max_wait_ms=max_wait_ms)
+
+
 async def handle_job(payload: JobPayload) -> Dict[str, Any]:
     """Handle job execution based on task type.
     
@@ -17,6 +61,17 @@ async def handle_job(payload: JobPayload) -> Dict[str, Any]:
     Raises:
         Exception: If job execution fails
     """
+    # Map chunks run each of their items through this same dispatcher
+    if payload.task_type == MAP_CHUNK_TASK_TYPE:
+        return await run_map_chunk(payload, handle_job)
+    
+    # Batch-capable task types run single jobs as a batch of one
+    if payload.task_type in BATCH_HANDLERS:
+        result = (await handle_batch(payload.task_type, [payload]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
     # Simple echo implementation for now
     # Later can dispatch on task_type
     if payload.task_type == "echo":
@@ -31,3 +86,21 @@ async def handle_job(payload: JobPayload) -> Dict[str, Any]:
         "output": payload.data
     }
 
+
+async def handle_batch(task_type: str, payloads: List[JobPayload]) -> List[BatchItemResult]:
+    """Handle a batch of jobs of a batch-capable task type.
+
+    Args:
+        task_type: Task type of every payload
+        payloads: Job payloads
+
+    Returns:
+        One result or exception per payload, in order
+
+    Raises:
+        Exception: If the whole batch fails
+    """
+    results = await BATCH_HANDLERS[task_type].handler(payloads)
+    if len(results) != len(payloads):
+        raise ValueError(f"Batch handler for {task_type} returned {len(results)} results for {len(payloads)} jobs")
+    return results
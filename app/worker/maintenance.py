@@ -0,0 +1,83 @@
+"""Maintenance service for periodic queue housekeeping.
+
+Enqueues jobs deferred by admission control once the job queue has room (see
+app.admission), trims job queue entries that every consumer group has
+acknowledged (see app.stream_retention) and converts job hashes written in
+the legacy layout (see app.job_schema). Safe to run several instances.
+"""
+
+import asyncio
+import signal
+
+from app.admission import release_deferred_jobs
+from app.config import settings
+from app.job_schema import migrate_job_hashes
+from app.redis_client import RedisClient
+from app.sharding import check_shard_set
+from app.stream_retention import trim_all_queues
+
+
+async def maintenance_loop(shutdown_event: asyncio.Event) -> None:
+    """Run maintenance tasks every maintenance_interval_seconds."""
+    # Legacy job hashes are only written by processes not yet upgraded, so the
+    # migration stops after the first pass that finds none
+    migration_done = not settings.job_migration_enabled
+    while not shutdown_event.is_set():
+        try:
+            released = await release_deferred_jobs()
+            if released:
+                print(f"Enqueued {released} deferred jobs")
+        except Exception as e:
+            print(f"Error releasing deferred jobs: {e}")
+
+        if settings.stream_trim_enabled:
+            try:
+                for stream, trimmed in (await trim_all_queues()).items():
+                    print(f"Trimmed {trimmed} consumed entries from {stream}")
+            except Exception as e:
+                print(f"Error trimming job queues: {e}")
+
+        if not migration_done:
+            try:
+                migrated = await migrate_job_hashes()
+                if migrated:
+                    print(f"Converted {migrated} job hashes to the compact layout")
+                else:
+                    migration_done = True
+                    print("No job hashes left in the legacy layout")
+            except Exception as e:
+                print(f"Error converting job hashes: {e}")
+
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=settings.maintenance_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main() -> None:
+    """Maintenance service entrypoint."""
+    print("Starting maintenance service")
+
+    loop = asyncio.get_event_loop()
+    shutdown_event = asyncio.Event()
+
+    def signal_handler():
+        print("Shutdown signal received")
+        shutdown_event.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, signal_handler)
+        except NotImplementedError:
+            # Windows does not support add_signal_handler
+            pass
+
+    await check_shard_set()
+    try:
+        await maintenance_loop(shutdown_event)
+    finally:
+        await RedisClient.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
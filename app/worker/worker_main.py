@@ -1,230 +1,656 @@
-"""Worker main loop for processing jobs from Redis Streams."""
+"""Worker main loop for processing jobs from Redis Streams.
+
+A worker reads the job queues it declares with WORKER_QUEUES and
+WORKER_TASK_TYPES, or every queue (see app.queues), on every shard (see
+app.sharding) with one read loop per shard.
+"""
 
 import asyncio
-import json
 import os
 import signal
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+from app.analytics import attempt_rollups, record_attempt
+from app.codec import decode, encode
 from app.config import settings
-from app.events import EventType, append_job_event
+from app.events import EventType, event_sink, job_event_records
+from app.hedging import HEDGE_FIELD, hedge_delay, holds_job, is_hedged, record_runtime, request_hedge
+from app.job_schema import read_jobs
+from app.map_jobs import MAP_CHUNK_TASK_TYPE, on_map_chunk_dead_lettered
+from app.memoization import is_memoized, memo_key, result_memo
 from app.models import JobPayload, JobStatus
-from app.redis_client import get_redis
-from app.worker.job_handlers import handle_job
-from app.worker.lease import acquire_lease, release_lease
+from app.profiling import StageTimings, control_listener, current_timings, record_job_timings, stage_stats, time_stage
+from app.queues import ensure_consumer_groups, list_queues, queue_stream, served_queues
+from app.redis_client import RedisClient, get_redis
+from app.sharding import check_shard_set, get_blocking_shard, get_shard, shard_count
+from app.state_machine import TransitionResult, hedge_job, start_job, transition_job, withdraw_copy
+from app.tracing import is_sampled, record_job_trace, tracer
+from app.worker.job_handlers import BATCH_HANDLERS, BatchItemResult, handle_batch, handle_job
+from app.worker.lease import release_lease
 from app.worker.scheduler import compute_next_attempt_time
 
 
 # Consumer name (unique per worker instance)
 CONSUMER_NAME = f"worker-{os.getpid()}"
 
+# Job hash fields the worker needs besides the payload
+JOB_STATE_FIELDS = ["attempts", "workflow_id"]
+
+LEASE_TTL_SECONDS = 30
+
+
+async def ensure_consumer_group() -> List[str]:
+    """Ensure the consumer group exists for each queue this worker reads.
+
+    Returns:
+        Stream keys of the queues
+    """
+    queues = served_queues() or await list_queues()
+    await ensure_consumer_groups(queues)
+    return [queue_stream(queue) for queue in queues]
+
+
+@dataclass
+class _Execution:
+    """A leased job about to run, with what its completion needs."""
+
+    job_id: str
+    stream: str
+    msg_id: str
+    shard: int  # Shard the message was read from, which holds the job
+    task_type: Optional[str]  # From the stream entry; selects event verbosity
+    partition_key: str
+    attempts: int
+    workflow_id: Optional[str]
+    payload_json: str
+    payload: JobPayload
+    now: datetime
+    fields: Dict[str, str]  # Of the stream entry
+    timings: StageTimings
+    hedged: bool = False  # Another copy of the job may be running (see app.hedging)
+
+
+class _CopyLost(Exception):
+    """Another copy of a hedged job completed it first."""
+
+
+async def _ack(stream: str, msg_id: str, shard: int) -> None:
+    """Acknowledge a job queue message."""
+    with time_stage("ack"):
+        await get_shard(shard).xack(stream, settings.consumer_group, msg_id)
+
+
+def _trace_stages(fields: Dict[str, str], timings: StageTimings) -> None:
+    """Keep the stage intervals of a message whose trace is recorded."""
+    if is_sampled(fields.get("traceparent")):
+        timings.intervals = []
+
 
-async def ensure_consumer_group() -> None:
-    """Ensure consumer group exists for the job stream."""
-    redis = await get_redis()
+async def _record_timings(msg_id: str, fields: Dict[str, str], timings: StageTimings) -> None:
+    """Add a processed message's stage timings to the statistics and its trace."""
+    record_job_trace(
+        msg_id,
+        fields,
+        timings,
+        {"worker.id": CONSUMER_NAME, "job.hedge": fields.get(HEDGE_FIELD) == "true"},
+    )
+    await record_job_timings(fields.get("job_id", ""), fields.get("task_type"), CONSUMER_NAME, timings)
+
+
+async def _start_message(
+    msg_id: str, fields: Dict[str, str], stream: str, timings: StageTimings, shard: int
+) -> Optional[_Execution]:
+    """Lease the job of a message and parse its payload.
+
+    Returns:
+        The execution, or None if the message was settled without running a job
+    """
+    job_id = fields.get("job_id")
+    if not job_id:
+        # Invalid message, ack and skip
+        await _ack(stream, msg_id, shard)
+        return None
+    
+    task_type = fields.get("task_type") or None
+    hedge = fields.get(HEDGE_FIELD) == "true"
     
+    # Jobs of memoized task types with a stored result complete without a lease
+    inline_payload = fields.get("payload_json")
+    payload: Optional[JobPayload] = None
+    if not hedge and is_memoized(task_type):
+        with time_stage("lease"):
+            completed, inline_payload, payload = await _complete_from_memo(job_id, msg_id, fields, stream, shard)
+        if completed:
+            return None
+    
+    # Lease the job and mark it RUNNING in one atomic call (or, for a hedge
+    # request, start a second copy of the running job), reading its state
+    # and, unless the stream entry carries it or the memo lookup read it,
+    # the payload
+    return_fields = JOB_STATE_FIELDS if inline_payload is not None else JOB_STATE_FIELDS + ["payload_json"]
+    with time_stage("lease"):
+        started = await (hedge_job(
+            job_id,
+            CONSUMER_NAME,
+            events=job_event_records(
+                [(job_id, EventType.HEDGED, JobStatus.RUNNING, {"worker_id": CONSUMER_NAME})],
+                task_type=task_type,
+            ),
+            return_fields=return_fields,
+        ) if hedge else start_job(
+            job_id,
+            CONSUMER_NAME,
+            lease_ttl_seconds=LEASE_TTL_SECONDS,
+            events=job_event_records(
+                [
+                    (job_id, EventType.LEASED, JobStatus.PENDING, {"worker_id": CONSUMER_NAME, "lease_ttl_seconds": LEASE_TTL_SECONDS}),
+                    (job_id, EventType.STARTED, JobStatus.RUNNING, {"worker_id": CONSUMER_NAME}),
+                ],
+                task_type=task_type,
+            ),
+            return_fields=return_fields,
+        ))
+    if not started.ok:
+        # Job not found, cancelled, already finished or leased by another
+        # worker (for a hedge request: finished or already hedged)
+        await _ack(stream, msg_id, shard)
+        return None
+    
+    job_hash = started.fields
+    workflow_id = job_hash.get("workflow_id")
+    
+    # Parse payload
     try:
-        await redis.xgroup_create(
-            name=settings.job_stream,
-            groupname=settings.consumer_group,
-            id="$",  # Start from new messages
-            mkstream=True  # Create stream if it doesn't exist
-        )
+        payload_json = inline_payload if inline_payload is not None else job_hash.get("payload_json") or "{}"
+        if payload is None:
+            with time_stage("parse"):
+                payload = JobPayload.model_validate(decode(payload_json))
     except Exception as e:
-        # Ignore "group already exists" errors
-        if "BUSYGROUP" not in str(e) and "already exists" not in str(e).lower():
-            raise
+        if hedge:
+            # The first copy fails the job
+            await withdraw_copy(job_id, CONSUMER_NAME)
+            await _ack(stream, msg_id, shard)
+            return None
+        # Invalid payload, mark as failed (skipping any workflow dependents)
+        await transition_job(
+            job_id, [JobStatus.FAILED], lease_owner=CONSUMER_NAME, release_lease=True, workflow_id=workflow_id
+        )
+        await _ack(stream, msg_id, shard)
+        return None
+    
+    return _Execution(
+        job_id=job_id,
+        stream=stream,
+        msg_id=msg_id,
+        shard=shard,
+        task_type=task_type,
+        partition_key=fields.get("partition_key", ""),
+        attempts=int(job_hash.get("attempts") or "1"),
+        workflow_id=workflow_id,
+        payload_json=payload_json,
+        payload=payload,
+        now=datetime.now(timezone.utc),
+        fields=fields,
+        timings=timings,
+        hedged=hedge,
+    )
 
 
-async def process_message(msg_id: str, fields: Dict[str, str]) -> None:
+async def _complete_from_memo(
+    job_id: str, msg_id: str, fields: Dict[str, str], stream: str, shard: int
+) -> Tuple[bool, Optional[str], Optional[JobPayload]]:
+    """Complete a pending job with the memoized result of its payload.
+
+    Returns:
+        Whether the job was completed and its message acked (if not, it must
+        be started as usual), and the payload text and parsed payload read
+        for the lookup, so that starting the job does not read them again
+    """
+    payload_json = fields.get("payload_json")
+    if payload_json is None:
+        job = (await read_jobs([job_id], ["payload_json"]))[0]
+        if job is None:
+            return False, None, None
+        payload_json = job.get("payload_json") or "{}"
+    try:
+        payload = JobPayload.model_validate(decode(payload_json))
+    except Exception:
+        return False, payload_json, None  # Failed once started
+    if not is_memoized(payload.task_type):
+        return False, payload_json, payload
+    
+    key = memo_key(payload.task_type, payload.data)
+    result = await result_memo.get(key)
+    if result is None:
+        return False, payload_json, payload
+    
+    # No worker holds the lease of a PENDING job, so none is taken; the job
+    # passes through RUNNING as the transition rules require. Workflow
+    # dependents that become ready are enqueued by the same call
+    with time_stage("persist"):
+        completed = await transition_job(
+            job_id,
+            [JobStatus.RUNNING, JobStatus.SUCCEEDED],
+            expected=[JobStatus.PENDING],
+            fields={"result": result},
+            events=job_event_records(
+                [
+                    (job_id, EventType.CACHE_HIT, JobStatus.SUCCEEDED, {"worker_id": CONSUMER_NAME, "memo_key": key}),
+                    (job_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, {"worker_id": CONSUMER_NAME, "result": decode(result)}),
+                ],
+                task_type=payload.task_type,
+            ),
+        )
+    if not completed.ok:
+        # Cancelled, or a running job whose lease expired: start_job settles it
+        return False, payload_json, payload
+    
+    await _ack(stream, msg_id, shard)
+    return True, payload_json, payload
+
+
+async def process_message(
+    msg_id: str,
+    fields: Dict[str, str],
+    stream: Optional[str] = None,
+    timings: Optional[StageTimings] = None,
+    shard: int = 0,
+) -> None:
     """Process a single message from the stream.
     
     Args:
         msg_id: Stream message ID
-        fields: Message fields containing job_id, task_type, payload_json
+        fields: Message fields containing job_id, partition_key, task_type and,
+            for inline stream entries, payload_json
+        stream: Stream key of the queue the message was read from, defaults
+            to the default queue
+        timings: Stage timings of the message so far (e.g. its fetch)
+        shard: Shard the message was read from
     """
-    redis = await get_redis()
+    timings = timings or StageTimings()
+    _trace_stages(fields, timings)
+    token = current_timings.set(timings)
+    try:
+        execution = await _start_message(msg_id, fields, stream or settings.job_stream, timings, shard)
+        if execution is None:
+            return
+        
+        # Execute job
+        started_at = time.monotonic()
+        try:
+            with time_stage("execute"):
+                result = await _run_handler(execution)
+            with time_stage("persist"):
+                await _job_succeeded(execution, result, time.monotonic() - started_at)
+        except _CopyLost:
+            print(f"Cancelled copy of job {execution.job_id}: the other copy completed it")
+            await _ack(execution.stream, execution.msg_id, execution.shard)
+        except Exception as e:
+            with time_stage("persist"):
+                await _job_failed(execution, str(e), time.monotonic() - started_at)
+    finally:
+        current_timings.reset(token)
+        await _record_timings(msg_id, fields, timings)
+
+
+async def _run_handler(execution: _Execution) -> Dict[str, Any]:
+    """Run a job's handler, requesting a second copy once it straggles.
     
-    job_id = fields.get("job_id")
-    if not job_id:
-        # Invalid message, ack and skip
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
-        return
+    Returns:
+        The handler's result
     
-    job_key = f"job:{job_id}"
+    Raises:
+        _CopyLost: If another copy of the job completed it first
+        Exception: If the handler fails
+    """
+    delay = None if execution.hedged else await hedge_delay(execution.payload.task_type)
+    if delay is None and not execution.hedged:
+        return await handle_job(execution.payload)
     
-    # Get job hash
-    job_hash = await redis.hgetall(job_key)
-    if not job_hash:
-        # Job not found, ack and skip
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
-        return
+    handler = asyncio.ensure_future(handle_job(execution.payload))
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait({handler}, timeout=delay)
+            if not done:
+                await request_hedge(execution.stream, execution.fields)
+                execution.hedged = True
+        # Stop once the other copy completed the job
+        while execution.hedged and not handler.done():
+            await asyncio.wait({handler}, timeout=settings.hedge_poll_interval_seconds)
+            if not handler.done() and not await holds_job(execution.job_id, CONSUMER_NAME):
+                raise _CopyLost()
+        return await handler
+    finally:
+        handler.cancel()
+
+
+async def start_batch_messages(messages: List[Tuple[str, str, Dict[str, str]]], shard: int = 0) -> List[_Execution]:
+    """Lease the jobs of messages of a batch-capable task type as they are read.
     
-    # Check if job is cancelled
-    status = job_hash.get("status")
-    if status == "CANCELLED":
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
-        return
+    The jobs are held while their batch fills, so that they are not left
+    unleased in the pending entries list.
     
-    # Try to acquire lease
-    if not await acquire_lease(job_id, CONSUMER_NAME, lease_ttl_seconds=30):
-        # Lease not available, ack and skip (another worker will handle it)
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
-        return
+    Args:
+        messages: (stream key, message ID, message fields) of each message
+        shard: Shard the messages were read from
     
-    # Increment attempts
-    attempts = int(job_hash.get("attempts", "0")) + 1
-    now = datetime.now(timezone.utc)
+    Returns:
+        The executions of the messages whose job was started
+    """
+    async def start(stream: str, msg_id: str, fields: Dict[str, str]) -> Optional[_Execution]:
+        # Each message is started in a task of its own, with its own timings
+        timings = StageTimings()
+        _trace_stages(fields, timings)
+        current_timings.set(timings)
+        execution = await _start_message(msg_id, fields, stream, timings, shard)
+        if execution is None:
+            await _record_timings(msg_id, fields, timings)
+        return execution
     
-    # Update job status to RUNNING
-    await redis.hset(job_key, mapping={
-        "status": JobStatus.RUNNING.value,
-        "updated_at": now.isoformat(),
-        "attempts": str(attempts)
-    })
+    return [
+        execution
+        for execution in await asyncio.gather(
+            *(start(stream, msg_id, fields) for stream, msg_id, fields in messages)
+        )
+        if execution is not None
+    ]
+
+
+async def process_batch(task_type: str, executions: List[_Execution]) -> None:
+    """Run started jobs of a batch-capable task type with one handler call.
     
-    # Emit STARTED event
-    await append_job_event(job_id, EventType.STARTED, JobStatus.RUNNING, details={"worker_id": CONSUMER_NAME})
+    Args:
+        task_type: Task type of every job
+        executions: The started jobs (see start_batch_messages)
+    """
+    if not executions:
+        return
     
-    # Parse payload
+    # Every job of the batch took as long as the call
+    started_at, started_ns = time.monotonic(), time.time_ns()
     try:
-        payload_json = job_hash.get("payload_json", "{}")
-        payload_data = json.loads(payload_json)
-        payload = JobPayload(**payload_data)
+        results: List[BatchItemResult] = await handle_batch(task_type, [execution.payload for execution in executions])
     except Exception as e:
-        # Invalid payload, mark as failed
-        await redis.hset(job_key, mapping={
-            "status": JobStatus.FAILED.value,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        })
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
+        results = [e] * len(executions)
+    runtime = time.monotonic() - started_at
+    
+    async def complete(execution: _Execution, result: BatchItemResult) -> None:
+        current_timings.set(execution.timings)
+        execution.timings.add("execute", runtime, started_ns)
+        try:
+            # Another copy of a hedged job may have completed it meanwhile
+            if execution.hedged and not await holds_job(execution.job_id, CONSUMER_NAME):
+                print(f"Cancelled copy of job {execution.job_id}: the other copy completed it")
+                await _ack(execution.stream, execution.msg_id, execution.shard)
+                return
+            with time_stage("persist"):
+                if isinstance(result, Exception):
+                    await _job_failed(execution, str(result), runtime)
+                    return
+                try:
+                    await _job_succeeded(execution, result, runtime)
+                except Exception as e:
+                    await _job_failed(execution, str(e), runtime)
+        finally:
+            await _record_timings(execution.msg_id, execution.fields, execution.timings)
+    
+    await asyncio.gather(*(complete(execution, result) for execution, result in zip(executions, results)))
+
+
+async def _job_succeeded(execution: _Execution, result: Dict[str, Any], runtime: float) -> None:
+    """Record the result of a job that ran successfully and ack its message."""
+    job_id = execution.job_id
+    
+    # Job succeeded: store the result, release the lease, count the
+    # completion, enqueue ready workflow dependents and emit SUCCEEDED atomically
+    encoded_result = encode(result)
+    succeeded = await transition_job(
+        job_id,
+        [JobStatus.SUCCEEDED],
+        lease_owner=CONSUMER_NAME,
+        release_lease=True,
+        fields={"result": encoded_result},
+        workflow_id=execution.workflow_id,
+        events=job_event_records(
+            [(job_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, {"worker_id": CONSUMER_NAME, "result": result})],
+            task_type=execution.task_type,
+        ),
+    )
+    if not succeeded.ok:
+        await _discard_outcome(execution, succeeded)
         return
     
-    # Execute job
-    try:
-        result = await handle_job(payload)
-        
-        # Job succeeded
-        await redis.hset(job_key, mapping={
-            "status": JobStatus.SUCCEEDED.value,
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "result": json.dumps(result)
-        })
+    await record_attempt(execution.payload.task_type, execution.partition_key, "succeeded", runtime, attempts=execution.attempts)
+    if is_hedged(execution.payload.task_type):
+        await record_runtime(execution.payload.task_type, runtime)
+    
+    # Reuse the result for later jobs with the same payload data
+    if is_memoized(execution.payload.task_type):
+        try:
+            await result_memo.put(
+                execution.payload.task_type,
+                memo_key(execution.payload.task_type, execution.payload.data),
+                encoded_result,
+            )
+        except Exception as e:
+            print(f"Error memoizing result of job {job_id}: {e}")
+    
+    # Ack message
+    await _ack(execution.stream, execution.msg_id, execution.shard)
+
+
+async def _job_failed(execution: _Execution, error_msg: str, runtime: float) -> None:
+    """Retry or dead-letter a job whose handler failed and ack its message."""
+    redis = get_redis()
+    job_id = execution.job_id
+    attempts = execution.attempts
+    payload = execution.payload
+    
+    # Leave a hedged job to its other copy if that one is still running
+    if execution.hedged:
+        withdrawn = await withdraw_copy(job_id, CONSUMER_NAME, lease_ttl_seconds=LEASE_TTL_SECONDS)
+        if withdrawn.ok:
+            print(f"Copy of job {job_id} failed ({error_msg}), the other copy continues")
+            await _ack(execution.stream, execution.msg_id, execution.shard)
+            return
+    
+    # FAILED is emitted together with the DEAD_LETTERED or RETRIED event that follows it
+    failed_event = (job_id, EventType.FAILED, JobStatus.FAILED, {"worker_id": CONSUMER_NAME, "error": error_msg, "attempt": attempts})
+    
+    if attempts >= settings.max_retries:
+        # Max retries reached, move to DLQ (skipping any workflow dependents)
+        dead_lettered = await transition_job(
+            job_id,
+            [JobStatus.FAILED, JobStatus.DEAD_LETTERED],
+            lease_owner=CONSUMER_NAME,
+            release_lease=True,
+            workflow_id=execution.workflow_id,
+            events=job_event_records(
+                [
+                    failed_event,
+                    (job_id, EventType.DEAD_LETTERED, JobStatus.DEAD_LETTERED, {"worker_id": CONSUMER_NAME, "error": error_msg, "final_attempt": attempts}),
+                ],
+                task_type=payload.task_type,
+            ),
+        )
+        if not dead_lettered.ok:
+            await _discard_outcome(execution, dead_lettered)
+            return
         
-        # Emit SUCCEEDED event
-        await append_job_event(job_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, details={"worker_id": CONSUMER_NAME, "result": result})
+        await record_attempt(payload.task_type, execution.partition_key, "failed", runtime, attempts=attempts, dead_lettered=True)
         
-        # Increment completion counter
-        await redis.incr("metrics:jobs_completed_total")
+        # Add to DLQ stream
+        dlq_fields = {
+            "job_id": job_id,
+            "partition_key": execution.partition_key,
+            "task_type": payload.task_type,
+            "payload_json": execution.payload_json,
+            "error": error_msg,
+            "attempts": str(attempts)
+        }
+        await redis.xadd(settings.dlq_stream, dlq_fields)
         
-        # Release lease
-        await release_lease(job_id, CONSUMER_NAME)
+        # Let the parent map job finish without this chunk's items
+        if payload.task_type == MAP_CHUNK_TASK_TYPE:
+            await on_map_chunk_dead_lettered(payload, error_msg)
         
-        # Ack message
-        await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
+        # Ack original message
+        await _ack(execution.stream, execution.msg_id, execution.shard)
+    else:
+        # Retry with backoff
+        next_attempt_time = compute_next_attempt_time(execution.now, attempts)
         
-    except Exception as e:
-        # Job failed
-        error_msg = str(e)
+        # Move the job back to PENDING with its next attempt time, release
+        # the lease and re-add it to the stream atomically
+        retried = await transition_job(
+            job_id,
+            [JobStatus.FAILED, JobStatus.PENDING],
+            lease_owner=CONSUMER_NAME,
+            fields={"next_attempt_at": next_attempt_time.isoformat()},
+            enqueue=True,
+            enqueue_fields={"retry": "true"},
+            task_type=payload.task_type,
+            events=job_event_records(
+                [
+                    failed_event,
+                    (job_id, EventType.RETRIED, JobStatus.PENDING, {"worker_id": CONSUMER_NAME, "attempt": attempts, "next_attempt_at": next_attempt_time.isoformat()}),
+                ],
+                task_type=payload.task_type,
+            ),
+        )
+        if not retried.ok:
+            await _discard_outcome(execution, retried)
+            return
         
-        # Emit FAILED event
-        await append_job_event(job_id, EventType.FAILED, JobStatus.FAILED, details={"worker_id": CONSUMER_NAME, "error": error_msg, "attempt": attempts})
+        await record_attempt(payload.task_type, execution.partition_key, "failed", runtime)
         
-        if attempts >= settings.max_retries:
-            # Max retries reached, move to DLQ
-            await redis.hset(job_key, mapping={
-                "status": JobStatus.DEAD_LETTERED.value,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            })
-            
-            # Emit DEAD_LETTERED event
-            await append_job_event(job_id, EventType.DEAD_LETTERED, JobStatus.DEAD_LETTERED, details={"worker_id": CONSUMER_NAME, "error": error_msg, "final_attempt": attempts})
-            
-            # Add to DLQ stream
-            dlq_fields = {
-                "job_id": job_id,
-                "task_type": payload.task_type,
-                "payload_json": payload_json,
-                "error": error_msg,
-                "attempts": str(attempts)
-            }
-            await redis.xadd(settings.dlq_stream, dlq_fields)
-            
-            # Release lease
-            await release_lease(job_id, CONSUMER_NAME)
-            
-            # Ack original message
-            await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
-        else:
-            # Retry with backoff
-            next_attempt_time = compute_next_attempt_time(now, attempts)
-            
-            # Update job back to PENDING with next attempt time
-            await redis.hset(job_key, mapping={
-                "status": JobStatus.PENDING.value,
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "next_attempt_at": next_attempt_time.isoformat()
-            })
-            
-            # Emit RETRIED event
-            await append_job_event(job_id, EventType.RETRIED, JobStatus.PENDING, details={"worker_id": CONSUMER_NAME, "attempt": attempts, "next_attempt_at": next_attempt_time.isoformat()})
-            
-            # Release lease before re-enqueuing
-            await release_lease(job_id, CONSUMER_NAME)
-            
-            # Re-add to stream for retry
-            retry_fields = {
-                "job_id": job_id,
-                "partition_key": fields.get("partition_key", ""),
-                "task_type": payload.task_type,
-                "payload_json": payload_json,
-                "retry": "true"
-            }
-            await redis.xadd(settings.job_stream, retry_fields)
-            
-            # Ack current message
-            await redis.xack(settings.job_stream, settings.consumer_group, msg_id)
+        # Ack current message
+        await _ack(execution.stream, execution.msg_id, execution.shard)
+
+
+async def _discard_outcome(execution: _Execution, result: TransitionResult) -> None:
+    """Drop the outcome of a job changed while it ran (e.g. cancelled)."""
+    print(f"Discarding outcome of job {execution.job_id}: {result.outcome.value} (status {result.previous_status})")
+    await release_lease(execution.job_id, CONSUMER_NAME)
+    await _ack(execution.stream, execution.msg_id, execution.shard)
+
+
+@dataclass
+class _PendingBatch:
+    """Started jobs of a batch-capable task type waiting for their batch to fill."""
+
+    deadline: float  # time.monotonic() by which the batch runs, full or not
+    executions: List[_Execution] = field(default_factory=list)
+
+
+async def _run_batch(task_type: str, batch: _PendingBatch) -> None:
+    try:
+        await process_batch(task_type, batch.executions)
+    except Exception as e:
+        # Log error but continue processing
+        print(f"Error processing batch of {len(batch.executions)} {task_type} jobs: {e}")
+        # Still ack to avoid reprocessing forever
+        for execution in batch.executions:
+            try:
+                await get_shard(execution.shard).xack(execution.stream, settings.consumer_group, execution.msg_id)
+            except Exception:
+                pass
 
 
-async def worker_loop() -> None:
-    """Main worker loop consuming from Redis Streams."""
-    redis = await get_redis()
+async def worker_loop(shard: int = 0) -> None:
+    """Main worker loop consuming from the Redis Streams of one shard.
+    
+    Args:
+        shard: Shard to read (see app.sharding); run a loop per shard
+    """
+    redis = get_shard(shard)
+    on_shard = f" on shard {shard}" if shard_count() > 1 else ""
     
-    # Ensure consumer group exists
-    await ensure_consumer_group()
+    # Ensure consumer groups exist
+    streams = await ensure_consumer_group()
+    print(f"Worker {CONSUMER_NAME} reading {', '.join(streams)}{on_shard}")
+    refreshed_at = time.monotonic()
+    
+    # Batch-capable task types -> messages collected for their next batch
+    pending_batches: Dict[str, _PendingBatch] = {}
+    read_count = max([10] + [handler.max_size for handler in BATCH_HANDLERS.values()])
     
     while True:
         try:
-            # Read from stream with consumer group
-            messages = await redis.xreadgroup(
+            # Workers serving all queues pick up queues created since
+            if served_queues() is None and time.monotonic() - refreshed_at >= settings.worker_queue_refresh_seconds:
+                refreshed_at = time.monotonic()
+                added = [stream for stream in await ensure_consumer_group() if stream not in streams]
+                if added:
+                    streams += added
+                    print(f"Worker {CONSUMER_NAME} also reading {', '.join(added)}{on_shard}")
+            
+            # Block for 5 seconds if no messages, or until the next pending batch is due
+            block_ms = 5000
+            if pending_batches:
+                next_deadline = min(batch.deadline for batch in pending_batches.values())
+                block_ms = max(1, min(block_ms, int((next_deadline - time.monotonic()) * 1000)))
+            
+            # Read from the queue streams with consumer group, on the blocking pool
+            read_started_at = time.perf_counter()
+            messages = await get_blocking_shard(shard).xreadgroup(
                 groupname=settings.consumer_group,
                 consumername=CONSUMER_NAME,
-                streams={settings.job_stream: ">"},  # Read pending messages
-                count=10,  # Process up to 10 messages at a time
-                block=5000  # Block for 5 seconds if no messages
+                streams={stream: ">" for stream in streams},  # Read pending messages
+                count=read_count,  # Process up to 10 messages (or a full batch) per queue at a time
+                block=block_ms,
             )
-            
-            if not messages:
-                continue
+            # Each message read is charged an equal share of the read
+            read_seconds = time.perf_counter() - read_started_at
+            fetch_seconds = read_seconds / max(1, sum(len(stream_messages) for _, stream_messages in messages or []))
             
             # Process each message
-            for stream_name, stream_messages in messages:
+            batch_messages: List[Tuple[str, str, Dict[str, str]]] = []
+            for stream_name, stream_messages in messages or []:
                 for msg_id, fields in stream_messages:
+                    # Collect messages of batch-capable task types for batches
+                    if fields.get("task_type", "") in BATCH_HANDLERS:
+                        batch_messages.append((stream_name, msg_id, fields))
+                        continue
+                    
                     try:
-                        await process_message(msg_id, fields)
+                        timings = StageTimings()
+                        timings.add("fetch", fetch_seconds)
+                        await process_message(msg_id, fields, stream_name, timings, shard)
                     except Exception as e:
                         # Log error but continue processing
                         print(f"Error processing message {msg_id}: {e}")
                         # Still ack to avoid reprocessing forever
                         try:
                             await redis.xack(
-                                settings.job_stream,
+                                stream_name,
                                 settings.consumer_group,
                                 msg_id
                             )
                         except Exception:
                             pass
+            
+            # Start the jobs of batched messages right away, so they are leased
+            # while their batch fills, and run full batches
+            for execution in await start_batch_messages(batch_messages, shard) if batch_messages else []:
+                task_type = execution.task_type or ""
+                handler = BATCH_HANDLERS[task_type]
+                batch = pending_batches.get(task_type)
+                if batch is None:
+                    batch = pending_batches[task_type] = _PendingBatch(
+                        deadline=time.monotonic() + handler.max_wait_ms / 1000
+                    )
+                batch.executions.append(execution)
+                if len(batch.executions) >= handler.max_size:
+                    await _run_batch(task_type, pending_batches.pop(task_type))
+            
+            # Run batches whose wait is over
+            now = time.monotonic()
+            for task_type in [task_type for task_type, batch in pending_batches.items() if batch.deadline <= now]:
+                await _run_batch(task_type, pending_batches.pop(task_type))
         
         except asyncio.CancelledError:
             break
@@ -253,15 +679,33 @@ async def main() -> None:
                 # Windows does not support add_signal_handler
                 pass
     
-    # Run worker loop
+    await check_shard_set()
+
+    # Buffer job events instead of writing them on the critical path
+    if settings.event_sink_enabled:
+        event_sink.start()
+    if settings.stage_stats_enabled:
+        stage_stats.start()
+    attempt_rollups.start()
+    if settings.tracing_enabled:
+        tracer.start("dtq-worker")
+    
+    # Profile requests and other control commands
+    control = asyncio.create_task(control_listener(CONSUMER_NAME))
+    
+    # Run a worker loop per shard
     try:
-        await worker_loop()
+        await asyncio.gather(*(worker_loop(shard) for shard in range(shard_count())))
     except KeyboardInterrupt:
         print("Worker interrupted")
     finally:
         # Cleanup
-        redis = await get_redis()
-        await redis.aclose()
+        control.cancel()
+        await tracer.stop()
+        await stage_stats.stop()
+        await attempt_rollups.stop()
+        await event_sink.stop()
+        await RedisClient.close()
 
 
 if __name__ == "__main__":
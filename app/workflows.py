@@ -0,0 +1,443 @@
+"""DAG workflows: jobs that run once the jobs they depend on have succeeded."""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.codec import encode
+from app.events import EventRecord, EventType, JobEvent, append_job_events, job_event_records, job_events_key
+from app.job_schema import job_key, job_sub_keys, queue_job_write, read_jobs
+from app.models import JobStatus, WorkflowCreateRequest, WorkflowNode
+from app.queues import enqueue_job, job_stream_for
+from app.sharding import get_redis_for, new_job_id
+
+
+class InvalidWorkflowError(Exception):
+    """Raised when a submitted workflow is not a valid DAG."""
+
+
+# Workflows are kept this long after they finish (reopened if a job is requeued)
+WORKFLOW_TTL_SECONDS = 86400 * 7
+
+# Lua helpers keeping a workflow up to date as its jobs change status. Called
+# by the state machine's transition_job in the same atomic call as the job's
+# own transition (see app.state_machine). Requires JOB_HASH_LUA, QUEUE_LUA and
+# the state machine's change_status / write_events before it.
+#
+# Keys after the transition's own: workflow hash, deps, children, done, then
+# per node of the plan (see workflow_plan) its hash, large payload, large
+# result, event log and queue stream. Members of done are job_id:outcome
+# (succeeded, failed or skipped), so a requeued job's outcome can be undone.
+WORKFLOW_LUA = """
+local WORKFLOW_FAILED = {FAILED = true, DEAD_LETTERED = true, CANCELLED = true}
+
+-- How a job's transition from current to status affects its workflow
+local function workflow_role(current, status)
+    if status == 'SUCCEEDED' then
+        return 'succeeded'
+    end
+    if WORKFLOW_FAILED[status] and not WORKFLOW_FAILED[current] then
+        return 'failed'
+    end
+    if status == 'PENDING' and WORKFLOW_FAILED[current] then
+        return 'requeued'
+    end
+    return false
+end
+
+-- Check a plan declares the nodes the role touches; false if it does not,
+-- 'expired' if the workflow is gone (its jobs then change on their own)
+local function workflow_prepare(keys, offset, workflow_id, job_id, role, plan)
+    if plan.id ~= workflow_id then
+        return false
+    end
+    if redis.call('EXISTS', keys[offset + 1]) == 0 then
+        return 'expired'
+    end
+    local wf = {
+        key = keys[offset + 1], deps = keys[offset + 2], children_key = keys[offset + 3],
+        done = keys[offset + 4], queues = keys[8], stream = keys[5], plan = plan,
+        children = {}, nodes = {}, order = {},
+    }
+    local flat = redis.call('HGETALL', wf.children_key)
+    for i = 1, #flat, 2 do
+        wf.children[flat[i]] = cjson.decode(flat[i + 1])
+    end
+    for i, node in ipairs(plan.nodes) do
+        local base = offset + 4 + (i - 1) * 5
+        wf.nodes[node[1]] = {key = keys[base + 1], log = keys[base + 4], stream = keys[base + 5], events = node[2]}
+    end
+
+    -- Direct children on success, all descendants (breadth first) otherwise
+    local seen = {[job_id] = true}
+    local queue = {job_id}
+    while #queue > 0 do
+        local parent = table.remove(queue, 1)
+        for _, child in ipairs(wf.children[parent] or {}) do
+            if not seen[child] then
+                seen[child] = true
+                if not wf.nodes[child] then
+                    return false
+                end
+                table.insert(wf.order, child)
+                if role ~= 'succeeded' then
+                    table.insert(queue, child)
+                end
+            end
+        end
+    end
+    return wf
+end
+
+-- Whether an ancestor of a job failed (skipped jobs stay skipped)
+local function workflow_blocked(wf, parents, job_id)
+    local seen = {}
+    local queue = {job_id}
+    while #queue > 0 do
+        for _, parent in ipairs(parents[table.remove(queue)] or {}) do
+            if not seen[parent] then
+                if redis.call('SISMEMBER', wf.done, parent .. ':failed') == 1 then
+                    return true
+                end
+                seen[parent] = true
+                table.insert(queue, parent)
+            end
+        end
+    end
+    return false
+end
+
+local function workflow_record(wf, job_id, role, request)
+    local plan = wf.plan
+    local updated_at = request.fields['updated_at']
+    if role == 'succeeded' then
+        if redis.call('SADD', wf.done, job_id .. ':succeeded') == 1 then
+            redis.call('HINCRBY', wf.key, 'succeeded', 1)
+            -- Enqueue the dependents this was the last unfinished dependency of
+            for _, child in ipairs(wf.order) do
+                local node = wf.nodes[child]
+                local remaining = redis.call('HINCRBY', wf.deps, child, -1)
+                if remaining <= 0 and job_get(node.key, 'status') == 'PENDING' then
+                    job_set(node.key, 'updated_at', updated_at)
+                    job_enqueue(node.key, node.stream, wf.queues, plan.inline)
+                    write_events(wf.stream, node.log, node.events, request)
+                end
+            end
+        end
+    elseif role == 'failed' then
+        if redis.call('SADD', wf.done, job_id .. ':failed') == 1 then
+            redis.call('HINCRBY', wf.key, 'failed', 1)
+            -- Skip the descendants that have not run (stored as CANCELLED)
+            for _, descendant in ipairs(wf.order) do
+                local node = wf.nodes[descendant]
+                local fields = {
+                    updated_at = updated_at,
+                    last_status_change_reason = plan.reason,
+                    last_status_actor = 'workflow',
+                }
+                if job_get(node.key, 'status') == 'PENDING'
+                    and change_status(node.key, 'PENDING', 'CANCELLED', fields) then
+                    if redis.call('SADD', wf.done, descendant .. ':skipped') == 1 then
+                        redis.call('HINCRBY', wf.key, 'skipped', 1)
+                    end
+                    write_events(wf.stream, node.log, node.events, request)
+                end
+            end
+        end
+    else
+        if redis.call('SREM', wf.done, job_id .. ':failed') == 1 then
+            redis.call('HINCRBY', wf.key, 'failed', -1)
+        elseif redis.call('SREM', wf.done, job_id .. ':skipped') == 1 then
+            redis.call('HINCRBY', wf.key, 'skipped', -1)
+        end
+        -- Restore the descendants it skipped, unless another failure still skips them;
+        -- they are enqueued once their dependencies succeed
+        local parents = {}
+        for parent, children in pairs(wf.children) do
+            for _, child in ipairs(children) do
+                parents[child] = parents[child] or {}
+                table.insert(parents[child], parent)
+            end
+        end
+        for _, descendant in ipairs(wf.order) do
+            local node = wf.nodes[descendant]
+            local fields = {
+                updated_at = updated_at,
+                last_status_change_reason = plan.restore_reason,
+                last_status_actor = 'workflow',
+            }
+            if redis.call('SISMEMBER', wf.done, descendant .. ':skipped') == 1
+                and not workflow_blocked(wf, parents, descendant)
+                and change_status(node.key, job_get(node.key, 'status'), 'PENDING', fields) then
+                redis.call('SREM', wf.done, descendant .. ':skipped')
+                redis.call('HINCRBY', wf.key, 'skipped', -1)
+                write_events(wf.stream, node.log, node.events, request)
+            end
+        end
+    end
+
+    local keys = {wf.key, wf.deps, wf.children_key, wf.done}
+    local counts = redis.call('HMGET', wf.key, 'total', 'succeeded', 'failed', 'skipped')
+    if not counts[1] then
+        return  -- Checked by workflow_prepare; never count on a partial hash
+    end
+    local unsuccessful = tonumber(counts[3] or '0') + tonumber(counts[4] or '0')
+    if tonumber(counts[2] or '0') + unsuccessful >= tonumber(counts[1]) then
+        local final = 'SUCCEEDED'
+        if unsuccessful > 0 then
+            final = 'FAILED'
+        end
+        redis.call('HSET', wf.key, 'status', final, 'updated_at', plan.now)
+        for _, key in ipairs(keys) do
+            redis.call('EXPIRE', key, plan.ttl)
+        end
+    elseif redis.call('HGET', wf.key, 'status') ~= 'RUNNING' then
+        -- Reopened by a requeued job
+        redis.call('HSET', wf.key, 'status', 'RUNNING', 'updated_at', plan.now)
+        for _, key in ipairs(keys) do
+            redis.call('PERSIST', key)
+        end
+    end
+end
+"""
+
+
+def _workflow_keys(workflow_id: str) -> Dict[str, str]:
+    base = f"workflow:{workflow_id}"
+    return {
+        "workflow": base,
+        "deps": f"{base}:deps",
+        "children": f"{base}:children",
+        "done": f"{base}:done",
+    }
+
+
+def validate_dag(nodes: List[WorkflowNode]) -> List[str]:
+    """
+    Validate workflow nodes and return their keys in topological order.
+
+    Args:
+        nodes: Workflow nodes
+
+    Returns:
+        Node keys ordered so every node follows its dependencies
+
+    Raises:
+        InvalidWorkflowError: On duplicate keys, unknown dependencies or cycles
+    """
+    by_key: Dict[str, WorkflowNode] = {}
+    for node in nodes:
+        if node.key in by_key:
+            raise InvalidWorkflowError(f"Duplicate node key: {node.key}")
+        by_key[node.key] = node
+
+    indegree = {key: 0 for key in by_key}
+    children: Dict[str, List[str]] = {key: [] for key in by_key}
+    for node in nodes:
+        for dep in set(node.depends_on):
+            if dep not in by_key:
+                raise InvalidWorkflowError(f"Node {node.key} depends on unknown node {dep}")
+            indegree[node.key] += 1
+            children[dep].append(node.key)
+
+    # Kahn's algorithm
+    ready = [key for key, degree in indegree.items() if degree == 0]
+    order: List[str] = []
+    while ready:
+        key = ready.pop()
+        order.append(key)
+        for child in children[key]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+
+    if len(order) != len(nodes):
+        cyclic = sorted(key for key, degree in indegree.items() if degree > 0)
+        raise InvalidWorkflowError(f"Workflow contains a cycle involving: {', '.join(cyclic)}")
+
+    return order
+
+
+async def create_workflow(request: WorkflowCreateRequest) -> Dict[str, Any]:
+    """
+    Create all jobs of a workflow and enqueue the ones without dependencies.
+
+    Args:
+        request: Workflow submission
+
+    Returns:
+        Workflow description (see get_workflow)
+
+    Raises:
+        InvalidWorkflowError: If the nodes do not form a valid DAG
+    """
+    validate_dag(request.nodes)
+
+    # The workflow and its jobs share a shard, so its scripts can update them together
+    workflow_id = str(new_job_id())
+    redis = get_redis_for(workflow_id)
+    keys = _workflow_keys(workflow_id)
+    created_at = datetime.now(timezone.utc)
+    now = created_at.isoformat()
+
+    job_ids = {node.key: str(new_job_id(colocate_with=workflow_id)) for node in request.nodes}
+    children: Dict[str, List[str]] = {job_id: [] for job_id in job_ids.values()}
+    for node in request.nodes:
+        for dep in set(node.depends_on):
+            children[job_ids[dep]].append(job_ids[node.key])
+
+    # Create everything in one MULTI so a partially created workflow is never visible
+    pipe = redis.pipeline(transaction=True)
+    pipe.hset(keys["workflow"], mapping={
+        "workflow_id": workflow_id,
+        "name": request.name or "",
+        "status": JobStatus.RUNNING.value,
+        "created_at": now,
+        "updated_at": now,
+        "total": str(len(request.nodes)),
+        "succeeded": "0",
+        "failed": "0",
+        "skipped": "0",
+        "nodes_json": json.dumps(job_ids),
+    })
+
+    events: List[JobEvent] = []
+    for node in request.nodes:
+        job_id = job_ids[node.key]
+        payload_json = encode(node.payload.model_dump(mode="json"))
+        queue_job_write(pipe, job_id, {
+            "status": JobStatus.PENDING.value,
+            "created_at": created_at,
+            "updated_at": created_at,
+            "attempts": "0",
+            "partition_key": node.partition_key,
+            "task_type": node.payload.task_type,
+            "payload_json": payload_json,
+            "workflow_id": workflow_id,
+            "workflow_node": node.key,
+        }, new=True)
+        if children[job_id]:
+            pipe.hset(keys["children"], job_id, json.dumps(children[job_id]))
+
+        events.append((job_id, EventType.CREATED, JobStatus.PENDING, {"workflow_id": workflow_id}))
+        dependencies = set(node.depends_on)
+        if dependencies:
+            pipe.hset(keys["deps"], job_id, len(dependencies))
+        else:
+            enqueue_job(pipe, job_id, node.partition_key or "", node.payload.task_type, payload_json)
+            events.append((job_id, EventType.ENQUEUED, JobStatus.PENDING, None))
+
+    pipe.incrby("metrics:jobs_created_total", len(request.nodes))
+    await pipe.execute()
+    await append_job_events(events)
+
+    return await get_workflow(workflow_id)
+
+
+def _descendants(children: Dict[str, List[str]], job_id: str) -> List[str]:
+    """Descendants of a workflow job, breadth first."""
+    order: List[str] = []
+    seen = {job_id}
+    queue = [job_id]
+    while queue:
+        for child in children.get(queue.pop(0), []):
+            if child not in seen:
+                seen.add(child)
+                order.append(child)
+                queue.append(child)
+    return order
+
+
+async def workflow_plan(
+    workflow_id: str,
+    job_id: str,
+    status: JobStatus,
+) -> Tuple[List[str], Dict[str, Any], List[Tuple[str, List[EventRecord]]]]:
+    """
+    Prepare the workflow bookkeeping of a job's transition to a status.
+
+    The bookkeeping itself runs in the transition's atomic call (see
+    WORKFLOW_LUA); this declares the keys of the nodes it may touch and the
+    events each of them gets if it does.
+
+    Args:
+        workflow_id: The job's workflow
+        job_id: The job
+        status: Status the job ends up in
+
+    Returns:
+        Keys (after the transition's own), the plan, and the plan's nodes
+        with the event records of their change: enqueued after a success,
+        skipped after a failure or restored after a requeue
+    """
+    keys = _workflow_keys(workflow_id)
+    children = {
+        parent: json.loads(children_json)
+        for parent, children_json in (await get_redis_for(workflow_id).hgetall(keys["children"])).items()
+    }
+    if status == JobStatus.SUCCEEDED:
+        nodes = children.get(job_id, [])
+    else:
+        nodes = _descendants(children, job_id)
+    jobs = await read_jobs(nodes, ["task_type"])
+
+    reason = f"Upstream job {job_id} did not succeed"
+    restore_reason = f"Upstream job {job_id} was requeued"
+    plan_keys = [keys["workflow"], keys["deps"], keys["children"], keys["done"]]
+    plan_nodes: List[Tuple[str, List[EventRecord]]] = []
+    for node_id, job in zip(nodes, jobs):
+        task_type = (job or {}).get("task_type")
+        plan_keys += [job_key(node_id), *job_sub_keys(node_id), job_events_key(node_id), job_stream_for(task_type)]
+        if status == JobStatus.SUCCEEDED:
+            event: JobEvent = (node_id, EventType.ENQUEUED, JobStatus.PENDING, {"workflow_id": workflow_id, "after": job_id})
+        elif status == JobStatus.PENDING:
+            event = (node_id, EventType.STATUS_CHANGED, JobStatus.PENDING,
+                     {"workflow_id": workflow_id, "actor": "workflow", "reason": restore_reason})
+        else:
+            event = (node_id, EventType.SKIPPED, JobStatus.CANCELLED, {"workflow_id": workflow_id, "reason": reason})
+        plan_nodes.append((node_id, job_event_records([event], task_type=task_type)))
+
+    plan = {
+        "id": workflow_id,
+        "now": datetime.now(timezone.utc).isoformat(),
+        "ttl": WORKFLOW_TTL_SECONDS,
+        "reason": reason,
+        "restore_reason": restore_reason,
+    }
+    return plan_keys, plan, plan_nodes
+
+
+async def get_workflow(workflow_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get a workflow with the current status of each node.
+
+    Args:
+        workflow_id: The workflow identifier
+
+    Returns:
+        Workflow description, or None if not found
+    """
+    redis = get_redis_for(workflow_id)
+    workflow_hash = await redis.hgetall(_workflow_keys(workflow_id)["workflow"])
+    if not workflow_hash:
+        return None
+
+    job_ids: Dict[str, str] = json.loads(workflow_hash.get("nodes_json", "{}"))
+    jobs = await read_jobs(list(job_ids.values()), ["status"])
+    statuses = [job.get("status") if job else None for job in jobs]
+
+    return {
+        "workflow_id": workflow_id,
+        "name": workflow_hash.get("name") or None,
+        "status": workflow_hash.get("status"),
+        "created_at": workflow_hash.get("created_at"),
+        "updated_at": workflow_hash.get("updated_at"),
+        "total": int(workflow_hash.get("total", "0")),
+        "succeeded": int(workflow_hash.get("succeeded", "0")),
+        "failed": int(workflow_hash.get("failed", "0")),
+        "skipped": int(workflow_hash.get("skipped", "0")),
+        "nodes": {
+            key: {"job_id": job_id, "status": job_status}
+            for (key, job_id), job_status in zip(job_ids.items(), statuses)
+        },
+    }
@@ -0,0 +1,34 @@
+"""Shared fixtures: every test runs against fresh in-memory Redis nodes."""
+
+import pytest
+
+from app import memory_backend, sharding, state_machine
+from app.config import settings
+from app.models import JobCreateRequest, JobPayload
+from app.redis_client import RedisClient
+
+
+@pytest.fixture(autouse=True)
+def memory_redis(monkeypatch):
+    """Point every Redis client at empty in-process servers (see app.memory_backend)."""
+    monkeypatch.setattr(settings, "redis_backend", "memory")
+    monkeypatch.setattr(settings, "redis_shards", None)
+    monkeypatch.setattr(memory_backend, "backend", memory_backend.MemoryBackend())
+    monkeypatch.setattr(RedisClient, "_instance", None)
+    monkeypatch.setattr(RedisClient, "_blocking_instance", None)
+    monkeypatch.setattr(RedisClient, "_node_instances", {})
+    monkeypatch.setattr(sharding, "_ring", None)
+    monkeypatch.setattr(state_machine, "_use_script", False)
+    yield
+
+
+@pytest.fixture
+def make_job():
+    """Create a PENDING job through the API's create_job and return its ID."""
+    from app.api.routes_jobs import create_job
+
+    async def make(task_type: str = "echo", **data) -> str:
+        job = await create_job(JobCreateRequest(payload=JobPayload(task_type=task_type, data=data)))
+        return str(job.job_id)
+
+    return make
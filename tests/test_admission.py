@@ -0,0 +1,109 @@
+"""Tests of admission control: queue depth limits, deferral and release."""
+
+import pytest
+
+from app import admission
+from app.admission import check_admission, count_deferred_jobs, deferred_key, release_deferred_jobs
+from app.api.routes_jobs import create_job
+from app.config import settings
+from app.job_schema import read_job
+from app.models import JobCreateRequest, JobPayload, JobStatus
+from app.queues import job_stream_for
+from app.redis_client import get_redis
+from app.state_machine import transition_job
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(admission, "_samples", {})
+    monkeypatch.setattr(settings, "admission_check_interval_ms", 0)
+    monkeypatch.setattr(settings, "admission_max_queue_depth", 1)
+    monkeypatch.setattr(settings, "admission_mode", "defer")
+
+
+async def _submit(task_type="echo", partition_key=None):
+    """Submit a job like POST /jobs; returns the decision and the job ID (None if rejected)."""
+    decision = await check_admission(partition_key, task_type)
+    if not decision.admitted:
+        return decision, None
+    request = JobCreateRequest(payload=JobPayload(task_type=task_type), partition_key=partition_key)
+    job = await create_job(request, defer=decision.deferred)
+    return decision, str(job.job_id)
+
+
+async def test_full_queue_defers_and_maintenance_releases_once(monkeypatch):
+    await _submit()
+    decision, job_id = await _submit()
+    assert decision.deferred
+    redis = get_redis()
+    stream = job_stream_for("echo")
+    assert await redis.xlen(stream) == 1
+    assert await count_deferred_jobs() == 1
+
+    # Still no room
+    assert await release_deferred_jobs() == 0
+
+    monkeypatch.setattr(settings, "admission_max_queue_depth", 10)
+    assert await release_deferred_jobs() == 1
+    assert await release_deferred_jobs() == 0
+
+    assert await redis.xlen(stream) == 2
+    assert await count_deferred_jobs() == 0
+    job = await read_job(job_id)
+    assert job["status"] == JobStatus.PENDING.value
+    assert "deferred" not in job
+
+
+async def test_deferred_job_enqueued_by_a_requeue_is_not_released_again(monkeypatch):
+    await _submit()
+    _, job_id = await _submit()
+    await transition_job(job_id, [JobStatus.CANCELLED])
+    await transition_job(job_id, [JobStatus.PENDING], enqueue=True)
+    redis = get_redis()
+    entries = await redis.xlen(job_stream_for("echo"))
+
+    monkeypatch.setattr(settings, "admission_max_queue_depth", 10)
+    assert await release_deferred_jobs() == 0
+
+    assert await redis.xlen(job_stream_for("echo")) == entries
+    assert await redis.zcard(deferred_key("default")) == 0
+
+
+async def test_cancelled_deferred_job_is_dropped(monkeypatch):
+    await _submit()
+    _, job_id = await _submit()
+    await transition_job(job_id, [JobStatus.CANCELLED])
+
+    monkeypatch.setattr(settings, "admission_max_queue_depth", 10)
+    assert await release_deferred_jobs() == 0
+    assert await count_deferred_jobs() == 0
+    assert (await read_job(job_id))["status"] == JobStatus.CANCELLED.value
+
+
+async def test_each_queue_is_limited_on_its_own(monkeypatch):
+    monkeypatch.setattr(settings, "job_queue_per_task_type", True)
+    monkeypatch.setattr(settings, "admission_mode", "reject")
+    await _submit("slow")
+
+    rejected, _ = await _submit("slow")
+    admitted, _ = await _submit("fast")
+
+    assert not rejected.admitted and rejected.retry_after_seconds >= 1
+    assert admitted.admitted and not admitted.deferred
+
+
+async def test_rejected_submissions_do_not_use_the_partition_quota(monkeypatch):
+    monkeypatch.setattr(settings, "admission_mode", "reject")
+    monkeypatch.setattr(settings, "admission_partition_quota", 1)
+    await _submit()
+
+    rejected, _ = await _submit(partition_key="tenant")
+    assert not rejected.admitted and rejected.reason == "Job queue is full"
+
+    monkeypatch.setattr(settings, "admission_max_queue_depth", None)
+    admitted, _ = await _submit(partition_key="tenant")
+    refused, _ = await _submit(partition_key="tenant")
+    assert admitted.admitted
+    assert not refused.admitted and "quota" in refused.reason
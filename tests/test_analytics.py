@@ -0,0 +1,116 @@
+"""Tests of job analytics rollups and archive queries."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.analytics import AttemptRollups, attempt_rollups, query_archive, query_rollups, record_attempt
+from app.archive import _write_partition
+from app.config import settings
+from app.redis_client import get_redis
+
+pytestmark = pytest.mark.asyncio
+
+
+def _window():
+    now = datetime.now(timezone.utc)
+    return now - timedelta(hours=1), now + timedelta(hours=1)
+
+
+async def test_attempts_are_buffered_until_flushed():
+    rollups = AttemptRollups()
+    rollups.record("echo", "", "succeeded", 0.5, attempts=1)
+    rollups.record("echo", "", "failed", 1.5)
+    assert await query_rollups(*_window(), ["task_type"]) == []
+
+    await rollups.flush()
+    [group] = await query_rollups(*_window(), ["task_type"])
+    assert group["task_type"] == "echo"
+    assert (group["succeeded"], group["failed"]) == (1, 1)
+    assert group["runtime_seconds"]["mean"] == 1.0
+    assert group["attempts_distribution"] == {"1": 1}
+
+
+async def test_failed_flush_keeps_the_counts(monkeypatch):
+    rollups = AttemptRollups()
+    rollups.record("echo", "", "succeeded", 0.5, attempts=1)
+
+    redis = get_redis()
+    pipeline = redis.pipeline
+
+    def failing_pipeline(transaction):
+        pipe = pipeline(transaction=transaction)
+
+        async def execute():
+            raise ConnectionError("Redis is down")
+
+        pipe.execute = execute
+        return pipe
+
+    with monkeypatch.context() as patch:
+        patch.setattr(redis, "pipeline", failing_pipeline)
+        with pytest.raises(ConnectionError):
+            await rollups.flush()
+    rollups.record("echo", "", "succeeded", 1.5)
+
+    await rollups.flush()
+    [group] = await query_rollups(*_window(), ["task_type"])
+    assert group["succeeded"] == 2
+    assert group["runtime_seconds"]["mean"] == 1.0
+
+
+async def test_histograms_do_not_grow_with_partition_keys():
+    rollups = AttemptRollups()
+    for n in range(50):
+        rollups.record("echo", f"tenant-{n}", "succeeded", n / 10, attempts=1)
+    await rollups.flush()
+
+    [key] = await get_redis().keys("analytics:*")
+    fields = await get_redis().hkeys(key)
+    assert len([field for field in fields if "|rt:" in field or "|att:" in field]) < 50
+
+    [group] = await query_rollups(*_window(), ["task_type"])
+    assert group["succeeded"] == 50 and group["runtime_seconds"]["p50"] is not None
+    assert group["attempts_distribution"] == {"1": 50}
+
+    [tenant] = await query_rollups(*_window(), ["partition_key"], partition_key="tenant-3")
+    assert tenant["succeeded"] == 1
+    assert tenant["runtime_seconds"]["mean"] == pytest.approx(0.3)
+    assert tenant["runtime_seconds"]["p50"] is None and tenant["attempts_distribution"] == {}
+
+
+async def test_record_attempt_writes_at_once_without_the_flusher():
+    assert not attempt_rollups.running
+    await record_attempt("echo", "", "succeeded", 0.1, attempts=1)
+    [group] = await query_rollups(*_window(), [])
+    assert group["succeeded"] == 1
+
+
+async def test_separator_in_partition_key_round_trips():
+    await record_attempt("echo", "tenant|a%7C", "failed", 0.1, dead_lettered=True)
+    [group] = await query_rollups(*_window(), ["partition_key"], partition_key="tenant|a%7C")
+    assert group["partition_key"] == "tenant|a%7C"
+    assert (group["failed"], group["dead_lettered"]) == (1, 1)
+
+
+async def test_archive_range_compares_instants(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    _write_partition("2026-03", [
+        ({
+            "job_id": "j1",
+            "status": "SUCCEEDED",
+            "task_type": "echo",
+            "updated_at": "2026-03-10T12:30:00+00:00",
+            "attempts": "1",
+        }, [{"timestamp": "2026-03-10T12:29:58+00:00", "event_type": "STARTED"}]),
+    ])
+
+    # 12:00-13:00 UTC expressed as 14:00-15:00 at UTC+2
+    offset = timezone(timedelta(hours=2))
+    start, end = datetime(2026, 3, 10, 14, tzinfo=offset), datetime(2026, 3, 10, 15, tzinfo=offset)
+    [group] = await query_archive(start, end, ["hour"])
+    assert group["hour"] == "2026-03-10T12"
+    assert group["succeeded"] == 1
+    assert group["runtime_seconds"]["mean"] == pytest.approx(2.0, abs=1e-3)
+
+    assert await query_archive(start + timedelta(hours=1), end + timedelta(hours=1), []) == []
@@ -0,0 +1,49 @@
+"""Tests of archiving terminal jobs to SQLite."""
+
+import pytest
+
+from app.archive import archive_terminal_jobs, get_archived_job, get_archived_job_events, list_partitions
+from app.config import settings
+from app.events import get_job_events
+from app.job_schema import read_job
+from app.models import JobStatus
+from app.redis_client import get_redis
+from app.state_machine import start_job, transition_job
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+
+
+async def _succeeded_job(make_job):
+    job_id = await make_job(message="hi")
+    await start_job(job_id, "worker-1")
+    await transition_job(job_id, [JobStatus.SUCCEEDED], lease_owner="worker-1", release_lease=True, fields={"result": '{"output":"hi"}'})
+    return job_id
+
+
+async def test_terminal_jobs_move_to_the_archive_with_their_events(make_job):
+    done = await _succeeded_job(make_job)
+    pending = await make_job()
+    job, events = await read_job(done), await get_job_events(done)
+
+    assert await archive_terminal_jobs(older_than_seconds=0) == 1
+
+    assert await read_job(done) is None
+    assert await get_redis().keys(f"job:{done}*") == []
+    assert await get_archived_job(done) == job
+    assert events and await get_archived_job_events(done) == events
+    assert list_partitions() == [job["updated_at"][:7]]
+
+    assert (await read_job(pending))["status"] == JobStatus.PENDING.value
+    assert await get_archived_job(pending) is None
+
+
+async def test_recent_terminal_jobs_stay_in_redis(make_job):
+    done = await _succeeded_job(make_job)
+
+    assert await archive_terminal_jobs(older_than_seconds=3600) == 0
+    assert (await read_job(done))["status"] == JobStatus.SUCCEEDED.value
@@ -0,0 +1,83 @@
+"""Tests of bulk job actions."""
+
+import asyncio
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from app.bulk_ops import BulkAction, apply_bulk_action, count_matching_jobs
+from app.job_schema import read_job
+from app.models import BulkJobFilter, JobStatus
+from app.operations import OPERATION_STALE_SECONDS, create_operation, get_operation, run_operation
+from app.redis_client import get_redis
+from app.state_machine import hedge_job, start_job, transition_job
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_cancel_takes_pending_and_running_jobs(make_job):
+    pending, running, succeeded = await make_job(), await make_job(), await make_job()
+    await start_job(running, "worker-1")
+    await start_job(succeeded, "worker-1")
+    await transition_job(succeeded, [JobStatus.SUCCEEDED])
+
+    changed, failed = await apply_bulk_action(BulkAction.CANCEL, [pending, running, succeeded])
+
+    assert (changed, failed) == ([pending, running], [])
+    assert (await read_job(succeeded))["status"] == JobStatus.SUCCEEDED.value
+
+
+async def test_requeue_clears_lease_and_hedge(make_job):
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+    await hedge_job(job_id, "worker-2")
+    await apply_bulk_action(BulkAction.CANCEL, [job_id])
+
+    assert await apply_bulk_action(BulkAction.REQUEUE, [job_id]) == ([job_id], [])
+
+    job = await read_job(job_id)
+    assert job["status"] == JobStatus.PENDING.value
+    assert job["attempts"] == "0"
+    assert "lease_owner" not in job and "hedge_owner" not in job
+
+
+async def test_empty_filter_must_select_all_jobs_explicitly(make_job):
+    await make_job()
+    await make_job(task_type="other")
+
+    with pytest.raises(ValidationError, match="set all to true"):
+        BulkJobFilter()
+
+    assert await count_matching_jobs(BulkJobFilter(task_type="echo")) == 1
+    assert await count_matching_jobs(BulkJobFilter(all=True)) == 2
+
+
+async def test_operation_without_heartbeat_is_failed():
+    operation_id = await create_operation("bulk_cancel", {})
+    assert (await get_operation(operation_id))["state"] == "running"
+
+    stale = str(time.time() - OPERATION_STALE_SECONDS - 1)
+    await get_redis().hset(f"op:{operation_id}", "heartbeat_at", stale)
+
+    operation = await get_operation(operation_id)
+    assert operation["state"] == "failed"
+    assert "stopped" in operation["error"]
+    assert (await get_operation(operation_id))["state"] == "failed"
+
+
+async def test_finished_operation_is_not_failed_for_its_heartbeat():
+    operation_id = await create_operation("bulk_cancel", {})
+
+    async def work():
+        pass
+
+    run_operation(operation_id, work())
+    for _ in range(100):
+        if (await get_operation(operation_id))["state"] != "running":
+            break
+        await asyncio.sleep(0.01)
+    stale = str(time.time() - OPERATION_STALE_SECONDS - 1)
+    await get_redis().hset(f"op:{operation_id}", "heartbeat_at", stale)
+
+    assert (await get_operation(operation_id))["state"] == "completed"
@@ -0,0 +1,61 @@
+"""Tests of payload serialization and compression."""
+
+import json
+import math
+
+import pytest
+
+from app import codec
+from app.codec import Codec, CodecError, decode
+
+VALUE = {
+    "task_type": "echo",
+    "data": {"text": "hello " * 400, "count": 3, "ratio": 0.25, "tags": ["a", "b"], "none": None},
+}
+
+CONFIGURATIONS = [
+    (name, compression)
+    for name in codec._CODECS
+    for compression in [None, *codec._COMPRESSIONS]
+]
+
+
+@pytest.mark.parametrize("name,compression", CONFIGURATIONS)
+def test_every_configuration_round_trips(name, compression):
+    encoder = Codec(name, compression, compression_threshold=0)
+
+    assert decode(encoder.encode(VALUE)) == VALUE
+    assert decode(encoder.encode([])) == []
+
+
+def test_default_codec_writes_legacy_json():
+    text = Codec().encode(VALUE)
+
+    assert json.loads(text) == VALUE
+
+
+def test_legacy_json_with_nan_is_readable():
+    value = decode(json.dumps({"ratio": float("nan"), "limit": float("inf")}))
+
+    assert math.isnan(value["ratio"]) and value["limit"] == math.inf
+
+
+def test_compression_is_kept_only_when_smaller():
+    encoder = Codec("json", "zlib", compression_threshold=0)
+
+    assert encoder.encode(VALUE).startswith("~1jz:")
+    # Too short to gain anything once base64 encoded
+    assert encoder.encode({"a": 1}) == '{"a":1}'
+
+
+def test_values_below_the_threshold_are_not_compressed():
+    assert Codec("json", "zlib", compression_threshold=1 << 20).encode(VALUE) == json.dumps(VALUE, separators=(",", ":"))
+
+
+def test_unknown_codecs_are_rejected():
+    with pytest.raises(CodecError):
+        Codec("pickle")
+    with pytest.raises(CodecError):
+        Codec("json", "brotli")
+    with pytest.raises(CodecError):
+        decode("~1xn:{}")
@@ -0,0 +1,76 @@
+"""Tests of dead letter queue replay."""
+
+import pytest
+
+from app.config import settings
+from app.dlq import _replayed_key, count_replayable, replay_dlq
+from app.job_schema import read_job
+from app.models import JobStatus
+from app.operations import create_operation, get_operation
+from app.redis_client import get_redis
+from app.state_machine import start_job, transition_job
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _dead_letter(make_job) -> str:
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+    await transition_job(job_id, [JobStatus.FAILED, JobStatus.DEAD_LETTERED], release_lease=True)
+    return await get_redis().xadd(settings.dlq_stream, {
+        "job_id": job_id,
+        "partition_key": "",
+        "task_type": "echo",
+        "payload_json": '{"task_type": "echo", "data": {}}',
+        "error": "boom",
+        "attempts": "1",
+    })
+
+
+async def _replay(**options):
+    operation_id = await create_operation("dlq_replay", {})
+    await replay_dlq(operation_id, rate_per_second=1000, **options)
+    return await get_operation(operation_id)
+
+
+async def test_delete_after_replay_keeps_skipped_entries(make_job):
+    replayed = await _dead_letter(make_job)
+    skipped = await _dead_letter(make_job)
+    # The second job was requeued by other means before the replay
+    job_id = (await get_redis().xrange(settings.dlq_stream, min=skipped, max=skipped))[0][1]["job_id"]
+    await transition_job(job_id, [JobStatus.PENDING], enqueue=True)
+
+    operation = await _replay(delete_after_replay=True)
+
+    assert (operation["succeeded"], operation["skipped"]) == (1, 1)
+    remaining = [entry_id for entry_id, _ in await get_redis().xrange(settings.dlq_stream)]
+    assert remaining == [skipped]
+    assert replayed not in remaining
+
+
+async def test_matched_is_capped_by_limit(make_job):
+    for _ in range(3):
+        await _dead_letter(make_job)
+
+    operation = await _replay(limit=1)
+
+    assert operation["matched"] == 1
+    assert operation["succeeded"] == 1
+
+
+async def test_replayed_entries_are_not_replayed_again(make_job):
+    entry_id = await _dead_letter(make_job)
+    first = await _replay()
+    assert first["succeeded"] == 1
+    assert await get_redis().sismember(_replayed_key(), entry_id)
+
+    # Dead-lettered again after the replay; the old entry must not requeue it
+    job_id = (await get_redis().xrange(settings.dlq_stream))[0][1]["job_id"]
+    await start_job(job_id, "worker-1")
+    await transition_job(job_id, [JobStatus.FAILED, JobStatus.DEAD_LETTERED], release_lease=True)
+    assert await count_replayable() == 0
+
+    second = await _replay()
+
+    assert second["succeeded"] == 0
+    assert (await read_job(job_id))["status"] == JobStatus.DEAD_LETTERED.value
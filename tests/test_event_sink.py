@@ -0,0 +1,55 @@
+"""Tests of the buffered event writer."""
+
+import time
+
+import pytest
+
+from app.event_sink import EventSink
+
+pytestmark = pytest.mark.asyncio
+
+
+class Writer:
+    """Event writer that fails while ``down`` is set."""
+
+    def __init__(self):
+        self.down = False
+        self.records = []
+        self.dropped = 0
+
+    async def __call__(self, records, *, dropped, late):
+        if self.down:
+            raise ConnectionError("Redis is unreachable")
+        self.records += records
+        self.dropped += dropped
+
+
+async def test_blocked_producers_give_up_and_count_drops_while_the_writer_fails():
+    writer = Writer()
+    sink = EventSink(writer, max_buffer=2, batch_size=2, block_timeout_seconds=0.05)
+    writer.down = True
+    await sink.put([1, 2])
+
+    started = time.monotonic()
+    await sink.put([3])
+    assert 0.05 <= time.monotonic() - started < 1
+    started = time.monotonic()
+    await sink.put([4])
+    assert time.monotonic() - started < 0.05
+    assert sink.stats()["dropped"] == 2
+
+    writer.down = False
+    await sink.flush()
+    assert writer.records == [1, 2] and writer.dropped == 2
+    await sink.put([5])
+    assert sink.stats()["buffered"] == 1
+
+
+async def test_drop_newest_keeps_the_buffered_records():
+    writer = Writer()
+    sink = EventSink(writer, max_buffer=2, overflow_policy="drop_newest")
+
+    await sink.put([1, 2, 3])
+    await sink.flush()
+
+    assert writer.records == [1, 2] and writer.dropped == 1
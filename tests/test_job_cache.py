@@ -0,0 +1,86 @@
+"""Tests of the GET /jobs/{job_id} response cache."""
+
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.job_cache import JobCache
+from app.models import JobStatus
+from app.state_machine import transition_job
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _started_cache():
+    cache = JobCache(max_entries=100, ttl_seconds=60, terminal_ttl_seconds=3600)
+    cache.start()
+    for _ in range(100):
+        if cache.stats()["invalidation_active"]:
+            break
+        await asyncio.sleep(0.01)
+    return cache
+
+
+def _cache(cache, job_id, job_status="PENDING"):
+    cache.put(job_id, cache.begin_load(job_id), b"{}", '"etag"', job_status)
+
+
+async def _wait_for_miss(cache, job_id):
+    for _ in range(100):
+        if cache.get(job_id) is None:
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+async def test_changes_to_a_job_invalidate_its_response(monkeypatch, make_job):
+    # The in-process server always publishes keyspace notifications
+    monkeypatch.setattr(settings, "job_cache_configure_notifications", False)
+    job_id, other_id = await make_job(), await make_job()
+    cache = await _started_cache()
+    try:
+        assert cache.stats()["invalidation_active"] == 1
+        _cache(cache, job_id)
+        _cache(cache, other_id)
+        assert cache.get(job_id) == (b"{}", '"etag"')
+
+        await transition_job(job_id, [JobStatus.CANCELLED])
+
+        assert await _wait_for_miss(cache, job_id)
+        assert cache.get(other_id) is not None
+        assert cache.stats()["invalidations"] >= 1
+    finally:
+        await cache.stop()
+
+
+async def test_response_loaded_before_a_change_is_not_cached(monkeypatch, make_job):
+    monkeypatch.setattr(settings, "job_cache_configure_notifications", False)
+    job_id = await make_job()
+    cache = await _started_cache()
+    try:
+        token = cache.begin_load(job_id)
+        await transition_job(job_id, [JobStatus.CANCELLED])
+        for _ in range(100):
+            if cache.stats()["invalidations"]:
+                break
+            await asyncio.sleep(0.01)
+
+        cache.put(job_id, token, b"{}", '"etag"', JobStatus.PENDING.value)
+        assert cache.get(job_id) is None
+    finally:
+        await cache.stop()
+
+
+async def test_without_notifications_terminal_jobs_get_the_short_ttl(monkeypatch):
+    monkeypatch.setattr(settings, "job_cache_configure_notifications", True)  # CONFIG is unavailable
+    cache = JobCache(max_entries=100, ttl_seconds=0, terminal_ttl_seconds=3600)
+    cache.start()
+    try:
+        await asyncio.sleep(0.05)
+        assert cache.stats()["invalidation_active"] == 0
+
+        _cache(cache, "job-1", JobStatus.SUCCEEDED.value)
+        assert cache.get("job-1") is None
+    finally:
+        await cache.stop()
@@ -0,0 +1,80 @@
+"""Tests of the job hash layouts and the migration between them."""
+
+import pytest
+
+from app.config import settings
+from app.job_schema import SCHEMA_VERSION, VERSION_FIELD, job_key, large_value_key, migrate_job_hashes, read_job, read_jobs
+from app.models import JobStatus
+from app.redis_client import get_redis
+from app.state_machine import start_job
+
+pytestmark = pytest.mark.asyncio
+
+JOB_ID = "0b7e1f8e-5f7c-4a53-9d7e-2f1c9e0a6b11"
+
+# A job hash as written before the compact layout (version 1)
+LEGACY_HASH = {
+    "job_id": JOB_ID,
+    "status": "PENDING",
+    "task_type": "echo",
+    "payload_json": '{"task_type":"echo","data":{"message":"hi"}}',
+    "partition_key": "tenant",
+    "attempts": "0",
+    "lease_owner": "",
+    "lease_expires_at": "",
+    "created_at": "2026-03-10T12:00:00.000000+00:00",
+    "updated_at": "2026-03-10T12:00:01.500000+00:00",
+}
+
+
+async def _write_legacy_job():
+    await get_redis().hset(job_key(JOB_ID), mapping=LEGACY_HASH)
+
+
+def _without_placeholders(fields):
+    return {name: value for name, value in fields.items() if value != ""}
+
+
+async def test_new_jobs_use_the_compact_layout(make_job):
+    job_id = await make_job()
+
+    raw = await get_redis().hgetall(job_key(job_id))
+
+    assert raw[VERSION_FIELD] == SCHEMA_VERSION
+    assert raw["s"] == JobStatus.PENDING.value and raw["c"].isdigit()
+    assert "status" not in raw and "job_id" not in raw
+    assert (await read_job(job_id))["created_at"].endswith("+00:00")
+
+
+async def test_legacy_jobs_read_as_before():
+    await _write_legacy_job()
+
+    assert await read_job(JOB_ID) == _without_placeholders(LEGACY_HASH)
+    [job] = await read_jobs([JOB_ID], ["status", "updated_at", "lease_owner"])
+    assert job == {"job_id": JOB_ID, "status": "PENDING", "updated_at": LEGACY_HASH["updated_at"]}
+
+
+async def test_legacy_jobs_can_be_started():
+    await _write_legacy_job()
+
+    started = await start_job(JOB_ID, "worker-1")
+
+    assert started.ok
+    job = await read_job(JOB_ID)
+    assert (job["status"], job["lease_owner"], job["attempts"]) == (JobStatus.RUNNING.value, "worker-1", "1")
+    assert job["payload_json"] == LEGACY_HASH["payload_json"]
+
+
+async def test_migration_converts_legacy_hashes_once(monkeypatch):
+    monkeypatch.setattr(settings, "job_hash_max_value_bytes", 16)
+    await _write_legacy_job()
+
+    assert await migrate_job_hashes(batch_size=10) == 1
+    assert await migrate_job_hashes(batch_size=10) == 0
+
+    raw = await get_redis().hgetall(job_key(JOB_ID))
+    assert raw[VERSION_FIELD] == SCHEMA_VERSION
+    assert raw["u"] == "1773144001500"
+    assert "status" not in raw and "p" not in raw and "lo" not in raw
+    assert await get_redis().get(large_value_key(JOB_ID, "payload_json")) == LEGACY_HASH["payload_json"]
+    assert await read_job(JOB_ID) == _without_placeholders(LEGACY_HASH)
@@ -0,0 +1,80 @@
+"""Tests of map job chunk merges."""
+
+import pytest
+
+from app.codec import decode
+from app.job_schema import read_job, read_jobs
+from app.jobs_service import transition_job_status
+from app.map_jobs import MAP_CHUNK_TASK_TYPE, MAP_TASK_TYPE, get_map_progress, run_map_chunk, submit_map_job
+from app.models import JobCreateRequest, JobPayload, JobStatus
+from app.queues import job_stream_for
+from app.sharding import get_redis_for
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _double(payload: JobPayload):
+    return {"output": payload.data["item"] * 2}
+
+
+async def _submit(items, chunk_size=2):
+    job = await submit_map_job(JobCreateRequest(payload=JobPayload(
+        task_type=MAP_TASK_TYPE,
+        data={"item_task_type": "double", "items": items, "chunk_size": chunk_size, "reducer": "sum"},
+    )))
+    parent_id = str(job.job_id)
+    redis = get_redis_for(parent_id)
+    entries = await redis.xrange(job_stream_for(MAP_CHUNK_TASK_TYPE))
+    chunk_ids = [fields["job_id"] for _, fields in entries]
+    chunks = [JobPayload.model_validate(decode(job["payload_json"])) for job in await read_jobs(chunk_ids)]
+    return parent_id, sorted(chunks, key=lambda chunk: chunk.data["chunk_index"])
+
+
+async def test_last_chunk_completes_the_parent():
+    parent_id, chunks = await _submit([1, 2, 3])
+    redis = get_redis_for(parent_id)
+
+    for chunk in chunks:
+        await run_map_chunk(chunk, _double)
+
+    parent = await read_job(parent_id)
+    assert parent["status"] == JobStatus.SUCCEEDED.value
+    assert decode(parent["result"])["value"] == 12
+    assert await redis.get("metrics:jobs_completed_total") == "1"
+    assert 0 < await redis.ttl(f"map:{parent_id}:done") <= await redis.ttl(f"map:{parent_id}")
+
+
+async def test_chunk_is_merged_once():
+    parent_id, chunks = await _submit([1, 2, 3])
+
+    await run_map_chunk(chunks[0], _double)
+    await run_map_chunk(chunks[0], _double)
+
+    progress = await get_map_progress(parent_id)
+    assert (progress["chunks_done"], progress["items_succeeded"]) == (1, 2)
+
+
+async def test_cancel_during_map_is_not_overwritten():
+    parent_id, chunks = await _submit([1, 2, 3, 4])
+    redis = get_redis_for(parent_id)
+    await run_map_chunk(chunks[0], _double)
+
+    await transition_job_status(parent_id, JobStatus.CANCELLED, actor="user")
+    await run_map_chunk(chunks[1], _double)
+
+    parent = await read_job(parent_id)
+    assert parent["status"] == JobStatus.CANCELLED.value
+    assert "result" not in parent
+    assert await redis.get("metrics:jobs_completed_total") is None
+    progress = await get_map_progress(parent_id)
+    assert (progress["status"], progress["chunks_done"]) == (JobStatus.CANCELLED.value, 2)
+
+
+async def test_item_errors_expire_with_the_map():
+    parent_id, chunks = await _submit([1, "x"])
+    redis = get_redis_for(parent_id)
+
+    await run_map_chunk(chunks[0], _double)
+
+    assert await redis.llen(f"map:{parent_id}:errors") == 1
+    assert await redis.ttl(f"map:{parent_id}:errors") > 0
@@ -0,0 +1,56 @@
+"""Tests of worker stage timings and the slow-job log."""
+
+import time
+
+import pytest
+
+from app import profiling
+from app.config import settings
+from app.profiling import STAGES, StageStats, StageTimings, get_slow_jobs, get_stage_stats, record_job_timings
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_nested_stages_are_counted_once():
+    timings = StageTimings()
+    started = time.perf_counter()
+    with timings.stage("persist"):
+        time.sleep(0.02)
+        with timings.stage("events"):
+            time.sleep(0.02)
+    elapsed = time.perf_counter() - started
+
+    assert timings.seconds["persist"] >= 0.02 and timings.seconds["events"] >= 0.02
+    # Time in the inner stage is not counted for the outer one as well
+    assert timings.total <= elapsed
+
+
+async def test_timings_are_added_up_per_task_type(monkeypatch):
+    stats = StageStats()
+    monkeypatch.setattr(profiling, "stage_stats", stats)
+    for seconds in (0.01, 0.03):
+        timings = StageTimings()
+        timings.add("execute", seconds)
+        timings.add("ack", 0.001)
+        await record_job_timings("job-1", "echo", "worker-1", timings)
+    assert await get_stage_stats() == {}
+
+    await stats.flush()
+
+    stages = (await get_stage_stats())["echo"]
+    assert list(stages) == [stage for stage in STAGES if stage in ("execute", "ack")]
+    assert stages["execute"] == {"jobs": 2, "total_seconds": 0.04, "mean_ms": 20.0}
+
+
+async def test_slow_jobs_are_logged_with_their_stages(monkeypatch):
+    monkeypatch.setattr(settings, "slow_job_threshold_seconds", 0.05)
+    fast, slow = StageTimings(), StageTimings()
+    fast.add("execute", 0.01)
+    slow.add("execute", 0.2)
+
+    await record_job_timings("fast-job", "echo", "worker-1", fast)
+    await record_job_timings("slow-job", "echo", "worker-1", slow)
+
+    [record] = await get_slow_jobs(10)
+    assert record["job_id"] == "slow-job"
+    assert record["stages_ms"] == {"execute": 200.0}
@@ -0,0 +1,52 @@
+"""Tests of routing jobs to queues by task type."""
+
+import pytest
+
+from app.config import settings
+from app.queues import ensure_consumer_groups, list_queues, queue_stats, queue_stream, served_queues
+from app.redis_client import get_redis
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(settings, "job_queue_routes", {"resize": "media", "transcode": "media"})
+
+
+async def _entries(queue):
+    return [fields["job_id"] for _, fields in await get_redis().xrange(queue_stream(queue))]
+
+
+async def test_jobs_go_to_the_queue_of_their_task_type(make_job, monkeypatch):
+    monkeypatch.setattr(settings, "job_queue_per_task_type", True)
+    resize, transcode, echo = await make_job("resize"), await make_job("transcode"), await make_job("echo")
+
+    assert await _entries("media") == [resize, transcode]
+    assert await _entries("echo") == [echo]
+    assert await list_queues() == ["default", "echo", "media"]
+
+
+async def test_unrouted_task_types_share_the_default_queue(make_job):
+    echo, other = await make_job("echo"), await make_job("other")
+
+    assert await _entries("default") == [echo, other]
+    assert await list_queues() == ["default", "media"]
+
+
+async def test_workers_serve_declared_queues_and_task_types(monkeypatch):
+    assert served_queues() is None
+
+    monkeypatch.setattr(settings, "worker_queues", "default, bulk")
+    monkeypatch.setattr(settings, "worker_task_types", "resize,transcode")
+    assert served_queues() == ["default", "bulk", "media"]
+
+
+async def test_each_queue_reports_its_own_lag(make_job):
+    await ensure_consumer_groups(["default", "media"])
+    await make_job("resize")
+    await make_job("resize")
+    await make_job("echo")
+
+    assert (await queue_stats(queue_stream("media")))["lag"] == 2
+    assert (await queue_stats(queue_stream("default")))["lag"] == 1
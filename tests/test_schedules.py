@@ -0,0 +1,68 @@
+"""Tests of cron expressions and schedule fire times."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.cron import CronExpression, CronParseError
+from app.models import JobPayload, ScheduleTemplate
+from app.schedules import due_runs, next_fire_after
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def _template(**kwargs):
+    return ScheduleTemplate(name="report", payload=JobPayload(task_type="echo"), **kwargs)
+
+
+@pytest.mark.parametrize("expression,after,expected", [
+    ("*/15 * * * *", _utc(2026, 3, 10, 10, 7, 30), _utc(2026, 3, 10, 10, 15)),
+    ("*/15 * * * *", _utc(2026, 3, 10, 10, 15), _utc(2026, 3, 10, 10, 30)),  # Strictly after
+    ("30 23 * * *", _utc(2026, 3, 31, 23, 45), _utc(2026, 4, 1, 23, 30)),
+    ("0 9 * * 1", _utc(2026, 3, 8, 12), _utc(2026, 3, 9, 9)),  # Next Monday
+    ("0 0 * * 7", _utc(2026, 3, 2), _utc(2026, 3, 8)),  # 7 is Sunday
+    ("0 0 13 * 5", _utc(2026, 3, 1), _utc(2026, 3, 6)),  # Day of month or weekday
+    ("0 0 1 1 *", _utc(2026, 3, 10), _utc(2027, 1, 1)),
+    ("0 12 29 2 *", _utc(2026, 3, 1), _utc(2028, 2, 29, 12)),
+])
+def test_cron_next_fire(expression, after, expected):
+    assert CronExpression(expression).next_after(after) == expected
+
+
+def test_cron_that_never_fires_is_an_error():
+    with pytest.raises(CronParseError):
+        CronExpression("0 0 31 2 *").next_after(_utc(2026, 1, 1))
+    with pytest.raises(CronParseError):
+        CronExpression("0 0 * *")
+
+
+def test_interval_schedules_fire_on_multiples_of_the_interval():
+    template = _template(interval_seconds=3600)
+
+    assert next_fire_after(template, _utc(2026, 3, 10, 10, 30)) == _utc(2026, 3, 10, 11)
+    assert next_fire_after(template, _utc(2026, 3, 10, 11)) == _utc(2026, 3, 10, 12)
+
+
+@pytest.mark.parametrize("policy,fired", [
+    ("catch_up", 3),
+    ("fire_once", 1),
+    ("skip", 0),
+])
+def test_missed_runs_follow_the_misfire_policy(policy, fired):
+    template = _template(cron="0 * * * *", misfire_policy=policy, misfire_grace_seconds=60)
+    now = _utc(2026, 3, 10, 12, 30)
+
+    runs, next_run = due_runs(template, _utc(2026, 3, 10, 10), now)
+
+    assert runs == [_utc(2026, 3, 10, hour) for hour in (10, 11, 12)][3 - fired:]
+    assert next_run == _utc(2026, 3, 10, 13)
+
+
+def test_run_within_the_grace_period_fires_under_skip():
+    template = _template(cron="0 * * * *", misfire_policy="skip", misfire_grace_seconds=60)
+    due = _utc(2026, 3, 10, 12)
+
+    assert due_runs(template, due, due + timedelta(seconds=30)) == ([due], _utc(2026, 3, 10, 13))
+    assert due_runs(template, None, due) == ([], _utc(2026, 3, 10, 13))
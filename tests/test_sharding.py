@@ -0,0 +1,76 @@
+"""Tests of job placement across shards."""
+
+from collections import Counter
+from uuid import uuid4
+
+import pytest
+
+from app.config import settings
+from app.job_schema import read_job
+from app.sharding import HashRing, check_shard_set, get_redis_for, get_shard, new_job_id, shard_count, shard_index
+
+pytestmark = pytest.mark.asyncio
+
+SHARDS = "redis://shard-a:6379,redis://shard-b:6379,redis://shard-c:6379"
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    monkeypatch.setattr(settings, "redis_shards", SHARDS)
+
+
+async def test_ring_spreads_ids_evenly_and_deterministically():
+    nodes = SHARDS.split(",")
+    ring = HashRing(nodes, 160)
+    ids = [str(uuid4()) for _ in range(6000)]
+
+    counts = Counter(ring.node_for(job_id) for job_id in ids)
+
+    assert set(counts) == {0, 1, 2}
+    assert all(1500 < count < 2500 for count in counts.values())
+    assert [HashRing(nodes, 160).node_for(job_id) for job_id in ids[:100]] == [ring.node_for(job_id) for job_id in ids[:100]]
+
+
+async def test_adding_a_node_only_remaps_ids_to_it():
+    nodes = SHARDS.split(",")
+    before, after = HashRing(nodes, 160), HashRing(nodes + ["redis://shard-d:6379"], 160)
+    ids = [str(uuid4()) for _ in range(4000)]
+
+    moved = [job_id for job_id in ids if before.node_for(job_id) != after.node_for(job_id)]
+
+    assert all(after.node_for(job_id) == 3 for job_id in moved)
+    assert 0.15 < len(moved) / len(ids) < 0.35
+
+
+async def test_jobs_are_stored_on_their_shard(shards, make_job):
+    assert shard_count() == 3
+    job_ids = [await make_job() for _ in range(12)]
+
+    for job_id in job_ids:
+        holders = [index for index in range(3) if await get_shard(index).exists(f"job:{job_id}")]
+        assert holders == [shard_index(job_id)]
+        assert (await read_job(job_id))["status"] == "PENDING"
+
+
+async def test_colocated_ids_share_the_shard(shards):
+    workflow_id = str(new_job_id())
+    for _ in range(20):
+        assert shard_index(str(new_job_id(colocate_with=workflow_id))) == shard_index(workflow_id)
+    assert get_redis_for(workflow_id) is get_shard(shard_index(workflow_id))
+
+
+async def test_shard_set_cannot_change_once_recorded(monkeypatch):
+    await check_shard_set()
+    await check_shard_set()
+
+    monkeypatch.setattr(settings, "redis_shards", SHARDS)
+    with pytest.raises(RuntimeError, match="shard set cannot change"):
+        await check_shard_set()
+    monkeypatch.setattr(settings, "redis_shard_vnodes", 80)
+    with pytest.raises(RuntimeError):
+        await check_shard_set()
+
+    monkeypatch.setattr(settings, "redis_shards_accept_change", True)
+    await check_shard_set()
+    monkeypatch.setattr(settings, "redis_shards_accept_change", False)
+    await check_shard_set()
@@ -0,0 +1,197 @@
+"""Tests of the job state machine's Redis function library."""
+
+import pytest
+from redis.exceptions import ResponseError
+
+from app import state_machine
+from app.config import settings
+from app.events import EventType, job_event_records, job_events_key
+from app.job_schema import now_ms, read_job
+from app.models import JobStatus
+from app.queues import job_stream_for
+from app.redis_client import get_redis
+from app.sharding import get_redis_for
+from app.state_machine import (
+    Transition,
+    TransitionOutcome,
+    hedge_job,
+    release_lease,
+    start_job,
+    transition_job,
+    transition_jobs,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_illegal_transition_is_rejected_without_writes(make_job):
+    job_id = await make_job()
+    redis = get_redis_for(job_id)
+    log_before = await redis.get(job_events_key(job_id))
+
+    result = await transition_job(
+        job_id,
+        [JobStatus.SUCCEEDED],
+        events=job_event_records([(job_id, EventType.SUCCEEDED, JobStatus.SUCCEEDED, None)]),
+    )
+
+    assert result.outcome == TransitionOutcome.INVALID
+    assert result.previous_status == JobStatus.PENDING.value
+    assert (await read_job(job_id))["status"] == JobStatus.PENDING.value
+    assert await redis.get(job_events_key(job_id)) == log_before
+    assert await redis.get("metrics:jobs_completed_total") is None
+
+
+async def test_every_step_must_be_allowed(make_job):
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+
+    # RUNNING -> PENDING is not allowed even though RUNNING -> FAILED -> PENDING is
+    result = await transition_job(job_id, [JobStatus.PENDING, JobStatus.FAILED])
+    assert result.outcome == TransitionOutcome.INVALID
+
+    result = await transition_job(job_id, [JobStatus.FAILED, JobStatus.PENDING], enqueue=True)
+    assert result.ok
+    assert (await read_job(job_id))["status"] == JobStatus.PENDING.value
+
+
+async def test_succeeded_is_terminal(make_job):
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+    assert (await transition_job(job_id, [JobStatus.SUCCEEDED], lease_owner="worker-1")).ok
+
+    for target in JobStatus:
+        result = await transition_job(job_id, [target])
+        assert result.outcome == TransitionOutcome.INVALID
+    assert await get_redis_for(job_id).get("metrics:jobs_completed_total") == "1"
+
+
+async def test_unexpected_status_is_refused(make_job):
+    job_id = await make_job()
+
+    result = await transition_job(job_id, [JobStatus.CANCELLED], expected=[JobStatus.RUNNING])
+
+    assert result.outcome == TransitionOutcome.UNEXPECTED
+    assert (await read_job(job_id))["status"] == JobStatus.PENDING.value
+
+
+async def test_missing_job(make_job):
+    result = await transition_job("00000000-0000-0000-0000-000000000000", [JobStatus.CANCELLED])
+    assert result.outcome == TransitionOutcome.NOT_FOUND
+
+
+async def test_lease_owner_is_checked(make_job):
+    job_id = await make_job()
+    assert (await start_job(job_id, "worker-1")).ok
+
+    result = await transition_job(job_id, [JobStatus.SUCCEEDED], lease_owner="worker-2")
+
+    assert result.outcome == TransitionOutcome.LEASE_LOST
+    assert (await read_job(job_id))["status"] == JobStatus.RUNNING.value
+
+
+async def test_release_lease_compares_owner(make_job):
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+
+    assert (await release_lease(job_id, "worker-2")).outcome == TransitionOutcome.LEASE_LOST
+    assert (await read_job(job_id))["lease_owner"] == "worker-1"
+
+    assert (await release_lease(job_id, "worker-1")).ok
+    assert "lease_owner" not in await read_job(job_id)
+
+
+async def test_release_lease_of_hedged_copy(make_job):
+    job_id = await make_job()
+    await start_job(job_id, "worker-1")
+    assert (await hedge_job(job_id, "worker-2")).ok
+
+    assert (await release_lease(job_id, "worker-2")).ok
+
+    job = await read_job(job_id)
+    assert job["lease_owner"] == "worker-1"
+    assert "hedge_owner" not in job
+
+
+async def test_batch_results_are_per_job(make_job):
+    pending, running = await make_job(), await make_job()
+    await start_job(running, "worker-1")
+    await hedge_job(running, "worker-2")
+    stream = job_stream_for("echo")
+    entries_before = await get_redis_for(pending).xlen(stream)
+
+    results = await transition_jobs([
+        Transition(job_id=pending, steps=[JobStatus.SUCCEEDED]),
+        Transition(job_id=running, steps=[JobStatus.CANCELLED, JobStatus.PENDING], enqueue=True),
+    ])
+
+    assert [result.outcome for result in results] == [TransitionOutcome.INVALID, TransitionOutcome.OK]
+    job = await read_job(running)
+    assert job["status"] == JobStatus.PENDING.value
+    assert "lease_owner" not in job and "hedge_owner" not in job
+    assert await get_redis_for(running).xlen(stream) == entries_before + 1
+
+
+async def test_create_recreates_missing_job_only_if_allowed(make_job):
+    job_id = "11111111-1111-1111-1111-111111111111"
+    create = {"created_at": "2026-01-01T00:00:00+00:00", "attempts": 0}
+
+    refused = await transition_job(
+        job_id, [JobStatus.SUCCEEDED], expected=[JobStatus.DEAD_LETTERED], create=create
+    )
+    assert refused.outcome == TransitionOutcome.INVALID
+    assert await read_job(job_id) is None
+
+    created = await transition_job(
+        job_id,
+        [JobStatus.PENDING],
+        expected=[JobStatus.DEAD_LETTERED],
+        create=create,
+        fields={"task_type": "echo", "payload_json": '{"task_type": "echo", "data": {}}'},
+        enqueue=True,
+        task_type="echo",
+    )
+    assert created.ok
+    job = await read_job(job_id)
+    assert job["status"] == JobStatus.PENDING.value
+    assert job["task_type"] == "echo"
+
+
+async def test_enqueue_requires_the_declared_queue(make_job, monkeypatch):
+    job_id = await make_job()
+    await transition_job(job_id, [JobStatus.CANCELLED])
+    # Declares another queue than the library routes the job's task type to
+    monkeypatch.setattr(settings, "job_queue_routes", {"other": "fast"})
+
+    with pytest.raises(ResponseError):
+        await transition_job(job_id, [JobStatus.PENDING], enqueue=True, task_type="other")
+    assert (await read_job(job_id))["status"] == JobStatus.CANCELLED.value
+
+
+async def test_failed_call_does_not_abort_the_batch(make_job, monkeypatch):
+    broken, other = await make_job(), await make_job()
+    for job_id in (broken, other):
+        await transition_job(job_id, [JobStatus.CANCELLED])
+    monkeypatch.setattr(settings, "job_queue_routes", {"other": "fast"})
+
+    results = await transition_jobs([
+        Transition(job_id=broken, steps=[JobStatus.PENDING], enqueue=True, task_type="other"),
+        Transition(job_id=other, steps=[JobStatus.PENDING], enqueue=True, task_type="echo"),
+    ])
+
+    assert results[0].outcome == TransitionOutcome.ERROR
+    assert isinstance(results[0].error, ResponseError)
+    assert results[1].ok
+    assert (await read_job(other))["status"] == JobStatus.PENDING.value
+
+
+async def test_loading_the_library_deletes_stale_versions():
+    redis = get_redis()
+    for name in ("dtq_stale", "dtq_recent"):
+        await redis.function_load(f"#!lua name={name}\nredis.register_function('{name}_f', function() return 1 end)")
+    await redis.hset(state_machine.LIBRARIES_KEY, "dtq_recent", now_ms())
+
+    await state_machine._load_library(redis)
+
+    names = {dict(zip(library[::2], library[1::2]))["library_name"] for library in await redis.function_list()}
+    assert names == {state_machine.LIBRARY_NAME, "dtq_recent"}
@@ -0,0 +1,63 @@
+"""Tests of trimming consumed job queue entries."""
+
+import pytest
+
+from app.config import settings
+from app.redis_client import get_redis
+from app.stream_retention import oldest_needed_id, trim_consumed_entries
+
+pytestmark = pytest.mark.asyncio
+
+STREAM = "jobs:test"
+
+
+@pytest.fixture(autouse=True)
+def exact_trimming(monkeypatch):
+    monkeypatch.setattr(settings, "stream_trim_approximate", False)
+
+
+async def _stream(entries=5):
+    redis = get_redis()
+    await redis.xgroup_create(STREAM, "workers", id="0", mkstream=True)
+    return [await redis.xadd(STREAM, {"job_id": str(n)}) for n in range(entries)]
+
+
+async def _read(count, group="workers"):
+    [(_, messages)] = await get_redis().xreadgroup(group, "worker-1", {STREAM: ">"}, count=count)
+    return [msg_id for msg_id, _ in messages]
+
+
+async def test_pending_and_undelivered_entries_are_kept():
+    ids = await _stream()
+    await _read(3)
+    await get_redis().xack(STREAM, "workers", ids[0], ids[2])
+
+    assert await oldest_needed_id(STREAM) == ids[1]
+    assert await trim_consumed_entries(STREAM) == 1
+    assert [msg_id for msg_id, _ in await get_redis().xrange(STREAM)] == ids[1:]
+
+
+async def test_acknowledged_entries_are_trimmed_up_to_the_last_delivered():
+    ids = await _stream()
+    await get_redis().xack(STREAM, "workers", *await _read(3))
+
+    assert await trim_consumed_entries(STREAM) == 3
+    assert [msg_id for msg_id, _ in await get_redis().xrange(STREAM)] == ids[3:]
+
+
+async def test_every_group_must_have_consumed_an_entry():
+    ids = await _stream()
+    await get_redis().xgroup_create(STREAM, "auditors", id="0")
+    await get_redis().xack(STREAM, "workers", *await _read(5))
+    await get_redis().xack(STREAM, "auditors", *await _read(2, group="auditors"))
+
+    assert await trim_consumed_entries(STREAM) == 2
+    assert await get_redis().xlen(STREAM) == len(ids) - 2
+
+
+async def test_streams_without_groups_are_not_trimmed():
+    await get_redis().xadd(STREAM, {"job_id": "1"})
+
+    assert await oldest_needed_id(STREAM) is None
+    assert await trim_consumed_entries(STREAM) == 0
+    assert await trim_consumed_entries("jobs:missing") == 0
@@ -0,0 +1,78 @@
+"""Tests of job tracing."""
+
+import json
+
+import pytest
+
+from app.api.routes_jobs import create_job
+from app.config import settings
+from app.models import JobCreateRequest, JobPayload
+from app.queues import ensure_consumer_groups, job_stream_for
+from app.redis_client import get_redis
+from app.tracing import parse_traceparent, tracer
+from app.worker import worker_main
+from app.worker.worker_main import process_message
+
+pytestmark = pytest.mark.asyncio
+
+CALLER = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(settings, "tracing_enabled", True)
+    monkeypatch.setattr(settings, "trace_exporter", "file")
+    monkeypatch.setattr(settings, "trace_file", str(path))
+    return path
+
+
+def _spans(path):
+    return [
+        span
+        for line in path.read_text().splitlines()
+        for resource in json.loads(line)["resourceSpans"]
+        for scope in resource["scopeSpans"]
+        for span in scope["spans"]
+    ]
+
+
+async def test_traceparent_parsing():
+    context = parse_traceparent(CALLER)
+    assert (context.trace_id, context.span_id, context.sampled) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert parse_traceparent(CALLER[:-2] + "00").sampled is False
+    assert parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("garbage") is None
+
+
+async def test_job_trace_continues_the_caller_through_processing(trace_file):
+    await ensure_consumer_groups(["default"])
+    tracer.start("dtq-test")
+    try:
+        job = await create_job(JobCreateRequest(payload=JobPayload(task_type="echo")), traceparent=CALLER)
+        [(_, [(msg_id, fields)])] = await get_redis().xreadgroup(
+            settings.consumer_group, worker_main.CONSUMER_NAME, {job_stream_for("echo"): ">"}, count=1
+        )
+        await process_message(msg_id, fields, job_stream_for("echo"))
+    finally:
+        await tracer.stop()
+
+    spans = {span["name"]: span for span in _spans(trace_file)}
+    assert {"job.create", "job.queue_wait", "job.process", "job.lease", "job.execute", "job.persist", "job.ack"} <= set(spans)
+    assert {span["traceId"] for span in spans.values()} == {"4bf92f3577b34da6a3ce929d0e0e4736"}
+    assert spans["job.create"]["parentSpanId"] == "00f067aa0ba902b7"
+    create_id = spans["job.create"]["spanId"]
+    assert spans["job.queue_wait"]["parentSpanId"] == spans["job.process"]["parentSpanId"] == create_id
+    assert spans["job.execute"]["parentSpanId"] == spans["job.process"]["spanId"]
+    assert str(job.job_id) in json.dumps(spans["job.process"]["attributes"])
+
+
+async def test_unsampled_jobs_record_nothing(trace_file):
+    await ensure_consumer_groups(["default"])
+    tracer.start("dtq-test")
+    try:
+        await create_job(JobCreateRequest(payload=JobPayload(task_type="echo")), traceparent=CALLER[:-2] + "00")
+    finally:
+        await tracer.stop()
+
+    assert not trace_file.exists()
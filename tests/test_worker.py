@@ -0,0 +1,181 @@
+"""Tests of message processing by workers."""
+
+import asyncio
+import math
+
+import pytest
+import pytest_asyncio
+
+from app import hedging
+from app.config import settings
+from app.hedging import request_hedge
+from app.job_schema import read_job
+from app.memoization import ResultMemo
+from app.models import JobStatus
+from app.queues import ensure_consumer_groups, job_stream_for
+from app.redis_client import get_redis
+from app.state_machine import hedge_job, start_job, transition_job
+from app.worker import worker_main
+from app.worker.job_handlers import BATCH_HANDLERS, BatchHandler
+from app.worker.worker_main import process_batch, process_message, start_batch_messages
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def consumer_group():
+    await ensure_consumer_groups(["default"])
+
+
+async def _deliver(job_id):
+    """Read the next message of the queue like a worker, the job's; returns (stream, message ID, fields)."""
+    stream = job_stream_for("echo")
+    [(_, [(msg_id, fields)])] = await get_redis().xreadgroup(
+        settings.consumer_group, worker_main.CONSUMER_NAME, {stream: ">"}, count=1
+    )
+    assert fields["job_id"] == job_id
+    return stream, msg_id, fields
+
+
+@pytest.fixture
+def memoized(monkeypatch):
+    monkeypatch.setattr(settings, "memoize_task_types", {"echo": 60})
+    monkeypatch.setattr(worker_main, "result_memo", ResultMemo(local_size=10))
+    reads = []
+    read_jobs, start_job = worker_main.read_jobs, worker_main.start_job
+
+    async def recording_read_jobs(job_ids, fields=None):
+        reads.append(fields)
+        return await read_jobs(job_ids, fields)
+
+    async def recording_start_job(job_id, worker_id, **kwargs):
+        reads.append(kwargs.get("return_fields"))
+        return await start_job(job_id, worker_id, **kwargs)
+
+    monkeypatch.setattr(worker_main, "read_jobs", recording_read_jobs)
+    monkeypatch.setattr(worker_main, "start_job", recording_start_job)
+    return reads
+
+
+async def test_memo_miss_runs_the_job_reading_its_payload_once(memoized, make_job):
+    job_id = await make_job(message="hi")
+    await process_message(*_args(await _deliver(job_id)))
+
+    job = await read_job(job_id)
+    assert job["status"] == JobStatus.SUCCEEDED.value
+    lookup, start = memoized
+    assert lookup == ["payload_json"] and "payload_json" not in start
+    assert worker_main.result_memo.misses == 1
+
+
+async def test_memo_hit_completes_an_equal_job_without_running_it(memoized, make_job, monkeypatch):
+    first = await make_job(message="hi")
+    await process_message(*_args(await _deliver(first)))
+
+    async def must_not_run(payload):
+        raise AssertionError("handler called on a memo hit")
+
+    monkeypatch.setattr(worker_main, "handle_job", must_not_run)
+    second = await make_job(message="hi")
+    await process_message(*_args(await _deliver(second)))
+
+    job = await read_job(second)
+    assert job["status"] == JobStatus.SUCCEEDED.value
+    assert job["result"] == (await read_job(first))["result"]
+    assert worker_main.result_memo.local_hits == 1
+    assert (await get_redis().xpending(job_stream_for("echo"), settings.consumer_group))["pending"] == 0
+
+
+def _args(delivery):
+    stream, msg_id, fields = delivery
+    return msg_id, fields, stream
+
+
+@pytest.fixture
+def batched(monkeypatch):
+    async def handler(payloads):
+        return [{"output": payload.data.get("message")} for payload in payloads]
+
+    monkeypatch.setitem(BATCH_HANDLERS, "echo", BatchHandler(handler=handler, max_size=10))
+
+
+async def test_batched_jobs_are_leased_while_the_batch_fills(batched, make_job):
+    job_ids = [await make_job(message=str(n)) for n in range(2)]
+    deliveries = [await _deliver(job_id) for job_id in job_ids]
+
+    executions = await start_batch_messages(deliveries)
+
+    for job_id in job_ids:
+        job = await read_job(job_id)
+        assert job["status"] == JobStatus.RUNNING.value
+        assert job["lease_owner"] == worker_main.CONSUMER_NAME
+
+    await process_batch("echo", executions)
+    assert [(await read_job(job_id))["status"] for job_id in job_ids] == [JobStatus.SUCCEEDED.value] * 2
+
+
+async def test_hedged_copy_in_a_batch_is_dropped_once_the_other_copy_completed(batched, make_job, monkeypatch):
+    job_id = await make_job(message="hi")
+    stream, _, fields = await _deliver(job_id)
+    await start_job(job_id, "worker-1")
+    await request_hedge(stream, fields)
+    [execution] = await start_batch_messages([await _deliver(job_id)])
+    assert execution.hedged
+    await transition_job(job_id, [JobStatus.SUCCEEDED], lease_owner="worker-1", release_lease=True, fields={"result": "{}"})
+
+    transitions = []
+    monkeypatch.setattr(worker_main, "transition_job", lambda *args, **kwargs: transitions.append(args))
+    await process_batch("echo", [execution])
+
+    assert transitions == []
+    assert (await read_job(job_id))["result"] == "{}"
+    assert (await get_redis().xpending(stream, settings.consumer_group))["pending"] == 1  # Only worker-1's message
+
+
+@pytest.fixture
+def hedged(monkeypatch):
+    monkeypatch.setattr(settings, "hedge_task_types", {"echo": 50})
+    monkeypatch.setattr(settings, "hedge_poll_interval_seconds", 0.01)
+    monkeypatch.setattr(hedging, "_delays", {"echo": (0.01, math.inf)})
+
+    async def straggle(payload):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(worker_main, "handle_job", straggle)
+
+
+async def test_straggler_requests_a_hedge_and_stops_once_the_hedge_completed(hedged, make_job):
+    job_id = await make_job(message="hi")
+    stream, msg_id, fields = await _deliver(job_id)
+    original = asyncio.create_task(process_message(msg_id, fields, stream))
+
+    for _ in range(100):
+        if await get_redis().xlen(stream) == 2:
+            break
+        await asyncio.sleep(0.01)
+    _, _, hedge_fields = await _deliver(job_id)
+    assert hedge_fields["hedge"] == "true"
+    await hedge_job(job_id, "worker-2")
+    await transition_job(job_id, [JobStatus.SUCCEEDED], lease_owner="worker-2", release_lease=True, fields={"result": "{}"})
+
+    await asyncio.wait_for(original, 1)
+    job = await read_job(job_id)
+    assert (job["status"], job["result"]) == (JobStatus.SUCCEEDED.value, "{}")
+    assert (await get_redis().xpending(stream, settings.consumer_group))["pending"] == 1  # Only the hedge request
+
+
+async def test_failing_hedge_copy_leaves_the_job_to_the_original(hedged, make_job, monkeypatch):
+    async def fail(payload):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(worker_main, "handle_job", fail)
+    job_id = await make_job(message="hi")
+    stream, _, fields = await _deliver(job_id)
+    await start_job(job_id, "worker-1")
+    await request_hedge(stream, fields)
+
+    await process_message(*_args(await _deliver(job_id)))
+
+    job = await read_job(job_id)
+    assert (job["status"], job["lease_owner"], job["attempts"]) == (JobStatus.RUNNING.value, "worker-1", "1")
+    assert "hedge_owner" not in job
@@ -0,0 +1,147 @@
+"""Tests of workflow bookkeeping done by job transitions."""
+
+import pytest
+
+from app.job_schema import read_job
+from app.jobs_service import transition_job_status
+from app.models import JobPayload, JobStatus, WorkflowCreateRequest, WorkflowNode
+from app.queues import job_stream_for
+from app.sharding import get_redis_for
+from app.state_machine import start_job, transition_job
+from app.workflows import WORKFLOW_TTL_SECONDS, create_workflow, get_workflow
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _workflow(*edges):
+    """Create a workflow from (node, dependencies) pairs; returns it and its job IDs by node."""
+    request = WorkflowCreateRequest(nodes=[
+        WorkflowNode(key=key, payload=JobPayload(task_type="echo"), depends_on=list(depends_on))
+        for key, depends_on in edges
+    ])
+    workflow = await create_workflow(request)
+    return workflow, {key: node["job_id"] for key, node in workflow["nodes"].items()}
+
+
+async def _run(job_id, status, **options):
+    assert (await start_job(job_id, "worker-1")).ok
+    steps = [JobStatus.FAILED, JobStatus.DEAD_LETTERED] if status == JobStatus.DEAD_LETTERED else [status]
+    return await transition_job(job_id, steps, lease_owner="worker-1", release_lease=True, **options)
+
+
+async def _statuses(workflow_id):
+    workflow = await get_workflow(workflow_id)
+    return workflow, {key: node["status"] for key, node in workflow["nodes"].items()}
+
+
+async def test_success_enqueues_dependents_in_the_same_call():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]))
+    redis = get_redis_for(workflow["workflow_id"])
+    entries = await redis.xlen(job_stream_for("echo"))
+
+    # Without the workflow_id hint the library asks for the workflow's keys first
+    assert (await _run(jobs["a"], JobStatus.SUCCEEDED)).ok
+
+    assert await redis.xlen(job_stream_for("echo")) == entries + 1
+    assert await redis.sismember(f"workflow:{workflow['workflow_id']}:done", f"{jobs['a']}:succeeded")
+
+
+async def test_success_with_workflow_hint_finishes_the_workflow():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]))
+    workflow_id = workflow["workflow_id"]
+
+    await _run(jobs["a"], JobStatus.SUCCEEDED, workflow_id=workflow_id)
+    await _run(jobs["b"], JobStatus.SUCCEEDED, workflow_id=workflow_id)
+
+    workflow, _ = await _statuses(workflow_id)
+    assert (workflow["status"], workflow["succeeded"]) == (JobStatus.SUCCEEDED.value, 2)
+    redis = get_redis_for(workflow_id)
+    for suffix in ("", ":deps", ":children", ":done"):
+        assert 0 < await redis.ttl(f"workflow:{workflow_id}{suffix}") <= WORKFLOW_TTL_SECONDS
+
+
+async def test_failure_skips_descendants_through_the_state_machine():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]), ("c", ["b"]))
+    workflow_id = workflow["workflow_id"]
+
+    await _run(jobs["a"], JobStatus.DEAD_LETTERED)
+
+    workflow, statuses = await _statuses(workflow_id)
+    assert statuses == {"a": "DEAD_LETTERED", "b": "CANCELLED", "c": "CANCELLED"}
+    assert (workflow["status"], workflow["failed"], workflow["skipped"]) == ("FAILED", 1, 2)
+    assert (await read_job(jobs["c"]))["last_status_actor"] == "workflow"
+    assert await get_redis_for(workflow_id).ttl(f"workflow:{workflow_id}") > 0
+
+
+async def test_requeued_failure_restores_and_releases_dependents():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]), ("c", ["b"]))
+    workflow_id = workflow["workflow_id"]
+    await _run(jobs["a"], JobStatus.DEAD_LETTERED)
+
+    await transition_job_status(jobs["a"], JobStatus.PENDING, actor="ui")
+
+    workflow, statuses = await _statuses(workflow_id)
+    assert statuses == {"a": "PENDING", "b": "PENDING", "c": "PENDING"}
+    assert (workflow["status"], workflow["failed"], workflow["skipped"]) == ("RUNNING", 0, 0)
+    assert await get_redis_for(workflow_id).ttl(f"workflow:{workflow_id}") == -1
+
+    # The requeued job's success now releases its dependents
+    redis = get_redis_for(workflow_id)
+    entries = await redis.xlen(job_stream_for("echo"))
+    await _run(jobs["a"], JobStatus.SUCCEEDED)
+    assert await redis.xlen(job_stream_for("echo")) == entries + 1
+    await _run(jobs["b"], JobStatus.SUCCEEDED)
+    await _run(jobs["c"], JobStatus.SUCCEEDED)
+    workflow, _ = await _statuses(workflow_id)
+    assert (workflow["status"], workflow["succeeded"]) == ("SUCCEEDED", 3)
+
+
+async def test_requeue_keeps_jobs_skipped_by_another_failure():
+    workflow, jobs = await _workflow(("a", []), ("x", []), ("c", ["a", "x"]))
+    await _run(jobs["a"], JobStatus.DEAD_LETTERED)
+    await _run(jobs["x"], JobStatus.DEAD_LETTERED)
+
+    await transition_job_status(jobs["a"], JobStatus.PENDING, actor="ui")
+
+    workflow, statuses = await _statuses(workflow["workflow_id"])
+    assert statuses == {"a": "PENDING", "x": "DEAD_LETTERED", "c": "CANCELLED"}
+    assert (workflow["failed"], workflow["skipped"]) == (1, 1)
+
+
+async def test_retry_does_not_touch_the_workflow():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]))
+    await start_job(jobs["a"], "worker-1")
+
+    retried = await transition_job(
+        jobs["a"], [JobStatus.FAILED, JobStatus.PENDING], lease_owner="worker-1", enqueue=True
+    )
+
+    assert retried.ok
+    workflow, statuses = await _statuses(workflow["workflow_id"])
+    assert statuses == {"a": "PENDING", "b": "PENDING"}
+    assert (workflow["failed"], workflow["skipped"]) == (0, 0)
+
+
+async def test_cancelled_job_skips_dependents():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]))
+
+    await transition_job_status(jobs["a"], JobStatus.CANCELLED, actor="user")
+
+    workflow, statuses = await _statuses(workflow["workflow_id"])
+    assert statuses == {"a": "CANCELLED", "b": "CANCELLED"}
+    assert workflow["status"] == "FAILED"
+
+
+async def test_requeue_after_the_workflow_expired_changes_the_job_alone():
+    workflow, jobs = await _workflow(("a", []), ("b", ["a"]))
+    workflow_id = workflow["workflow_id"]
+    await _run(jobs["a"], JobStatus.DEAD_LETTERED)
+    redis = get_redis_for(workflow_id)
+    await redis.delete(*(f"workflow:{workflow_id}{suffix}" for suffix in ("", ":deps", ":children", ":done")))
+
+    requeued = await transition_job(jobs["a"], [JobStatus.PENDING], enqueue=True)
+
+    assert requeued.ok
+    assert (await read_job(jobs["a"]))["status"] == "PENDING"
+    assert (await read_job(jobs["b"]))["status"] == "CANCELLED"
+    assert not await redis.exists(f"workflow:{workflow_id}")